@@ -0,0 +1,133 @@
+import atexit
+import queue
+import threading
+from datetime import datetime
+from datetime import timezone
+import exiftool
+from exiftool import ExifToolHelper
+
+CREATE_DATE_TAGS = ["EXIF:CreateDate", "QuickTime:CreateDate"]
+GPS_POSITION_TAG = "Composite:GPSPosition"
+
+# exiftool processes started with -stay_open are kept running and handed out to callers one at a time.
+# Each call can carry any number of files so the per-file cost is a few milliseconds instead of starting perl
+class ExifToolService:
+    def __init__(self, process_count=1):
+        self.idle_helpers = queue.LifoQueue()
+        self.running_helpers = []
+        self.running_helpers_lock = threading.Lock()
+        for i in range(process_count):
+            self.idle_helpers.put(None) # Processes get started the first time they are needed
+
+    def acquire_helper(self):
+        helper = self.idle_helpers.get()
+        if helper == None:
+            # If exiftool can't be started the slot has to go back, otherwise every later call waits forever
+            try:
+                helper = ExifToolHelper()
+                helper.run()
+            except Exception:
+                self.idle_helpers.put(None)
+                raise
+            with self.running_helpers_lock:
+                self.running_helpers.append(helper)
+        return helper
+
+    def release_helper(self, helper, healthy=True):
+        if not healthy:
+            with self.running_helpers_lock:
+                self.running_helpers.remove(helper)
+            try:
+                helper.terminate()
+            except Exception:
+                pass
+            helper = None
+        self.idle_helpers.put(helper)
+
+    def execute(self, method, files, *args):
+        helper = self.acquire_helper()
+        healthy = True
+        try:
+            return getattr(helper, method)(files, *args)
+        except exiftool.exceptions.ExifToolExecuteError:
+            raise
+        except Exception:
+            healthy = False
+            raise
+        finally:
+            self.release_helper(helper, healthy)
+
+    # One bad file makes exiftool fail the whole batch, so then retry the files one by one and return
+    # None for the ones that fail
+    def execute_batch(self, method, files, *args):
+        if len(files) == 0:
+            return []
+        try:
+            return self.execute(method, files, *args)
+        except exiftool.exceptions.ExifToolExecuteError:
+            if len(files) == 1:
+                return [None]
+        results = []
+        for file in files:
+            try:
+                results.append(self.execute(method, [file], *args)[0])
+            except exiftool.exceptions.ExifToolExecuteError:
+                results.append(None)
+        return results
+
+    def get_tags(self, files, tags):
+        return self.execute_batch("get_tags", files, tags, ["-fast"])
+
+    def get_metadata(self, files):
+        return self.execute_batch("get_metadata", files)
+
+    def get_create_epochs(self, files):
+        epochs = []
+        for metadata in self.get_tags(files, CREATE_DATE_TAGS):
+            epochs.append(-1 if metadata == None else create_epoch_from_metadata(metadata))
+        return epochs
+
+    # Returns (lat, lon) for every file, None for files without a position
+    def get_gps_positions(self, files):
+        positions = []
+        for metadata in self.get_tags(files, [GPS_POSITION_TAG]):
+            positions.append(None if metadata == None else gps_position_from_metadata(metadata))
+        return positions
+
+    def close(self):
+        with self.running_helpers_lock:
+            for helper in self.running_helpers:
+                try:
+                    helper.terminate()
+                except Exception:
+                    pass
+            self.running_helpers.clear()
+
+def create_epoch_from_metadata(metadata):
+    for key in CREATE_DATE_TAGS: #TODO add subseconds
+        if key in metadata:
+            try:
+                create_date_notz = datetime.strptime(metadata[key], '%Y:%m:%d %H:%M:%S')
+            except (ValueError, TypeError):
+                continue
+            return int(create_date_notz.replace(tzinfo=timezone.utc).timestamp())
+    return -1
+
+def gps_position_from_metadata(metadata):
+    try:
+        lat, lon = (float(i) for i in str(metadata[GPS_POSITION_TAG]).split())
+    except (KeyError, ValueError):
+        return None
+    return lat, lon
+
+service = None
+service_lock = threading.Lock()
+
+# Every process (the UI and each loader worker) gets one service that lives until it exits
+def get_service(process_count=1):
+    global service
+    with service_lock:
+        if service == None:
+            service = ExifToolService(process_count)
+            atexit.register(service.close)
+        return service
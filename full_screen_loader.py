@@ -0,0 +1,381 @@
+import concurrent.futures
+import threading
+import numpy
+from datetime import datetime
+from datetime import timezone
+from PIL import Image
+import rawpy
+
+import media_interface
+import gnss_track_helpers
+import icons
+import exiftool_service
+
+# How many items before and after the shown one are kept loaded
+PREFETCH_NEIGHBOURS = 3
+PREFETCH_JOBS = 2
+# Decoded images of a burst of RAW files add up quickly, neighbours are only kept while they fit in this
+PREFETCH_MEMORY_BUDGET = 1024*1024*1024
+
+# Everything FullScreenItem needs that is slow to get, loaded without touching Tk so it can be prepared in
+# the background before the item is opened
+class PreparedMedia:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.file_list = []
+        self.best_file = None
+        self.image_raw_file = None
+        self.exif_path = None
+        self.metadata_future = None # The exiftool table loads on its own, see load_metadata_table
+        self.pyramids = {} # "raw" and "jpeg", see build_pyramid
+        self.rawpy_object = None
+        self.linear_preview = None # Half size linear 16 bit RGB of the RAW, see develop_linear
+        self.gnss_data = None
+        self.track_levels = None # See gnss_track_helpers.build_track_levels
+        self.memory_size = 0
+
+def build_metadata_table(metadata):
+    if metadata[0] == None:
+        return { "Couldn't get metadata": "" }
+
+    table = {
+            "Filename": "",
+            "Create date": "",
+            "Create time": ""
+            }
+    for d in metadata:
+        if "Composite:ShutterSpeed" in d:
+            #Add the exposure values in this order if they exist
+            table["Shutter speed"]=""
+            table["Aperature"]=""
+            table["ISO"]=""
+            table["Focal length (35mm)"]=""
+            break
+
+    for d in metadata:
+        for key, value in d.items():
+            match key:
+                case "File:FileName":
+                    table["Filename"] = value
+                case "EXIF:Make":
+                    table["Camera make"] = value
+                case "EXIF:Model"|"QuickTime:Model":
+                    table["Camera model"] = value
+                case "EXIF:CreateDate"|"QuickTime:CreateDate":
+                    try:
+                        create_date_notz = datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
+                        create_date = create_date_notz.replace(tzinfo=timezone.utc)
+                        table["Create date"] = create_date.strftime("%Y-%m-%d")
+                        table["Create time"] = create_date.strftime("%H:%M:%S")
+                    except AttributeError:
+                        True
+                case "Composite:ShutterSpeed":
+                    if int(value) < 1:
+                            table["Shutter speed"] = "1/"+"{:.2f}".format(1/value)+" s"
+                    else:
+                            table["Shutter speed"] = "{:.2f}".format(value)+" s"
+                case "EXIF:ISO":
+                    table["ISO"] = str(value)
+                case "EXIF:FNumber":
+                    table["Aperature"]="f" + str(value)
+                case "EXIF:Software"|"QuickTime:FirmwareVersion":
+                    table["Software version"] = value
+                case "EXIF:SubSecTimeOriginal":
+                    table["Create time"] += "." + str(value)
+                case "EXIF:ExposureCompensation"|"QuickTime:ExposureCompensation":
+                    table["Exposure compensation"] = str(value)
+                case "EXIF:FocalLengthIn35mmFormat":
+                    table["Focal length (35mm)"] = str(value)+"mm"
+                case "EXIF:Contrast":
+                    table["Contrast"] = str(value)
+                case "EXIF:Saturation":
+                    table["Saturation"] = str(value)
+                case "EXIF:Sharpness"|"QuickTime:Sharpness":
+                    table["Sharpness"] = str(value)
+                case "EXIF:SerialNumber"|"QuickTime:CameraSerialNumber":
+                    table["Serial Number"] = value
+                case "APP6:HDRSetting"|"QuickTime:HDRVideo":
+                    table["HDR Setting"] = value
+                case "EXIF:DigitalZoomRatio"|"QuickTime:DigitalZoomAmount":
+                    table["Digital Zoom ratio"] = str(value)
+                case "EXIF:LensModel":
+                    table["Lens model"] = value
+                case "MakerNotes:ImageStabilization":
+                    if value == 1:
+                        table["Image stabilization"] = "enabled"
+                    else:
+                        table["Image stabilization"] = "disabled"
+                case "MakerNotes:ElectronicFrontCurtainShutter":
+                    table["Electronic Front Curtain"] = str(value)
+                case "MakerNotes:FocusMode":
+                    table["Focus mode"] = str(value) #TODO figure what the values mean
+                case "MakerNotes:FocusLocation":
+                    True #TODO maybe draw it?
+                case "MakerNotes:BatteryTemperature":
+                    table["Battery temprature"]="{:.1f}".format(value)+"°C"#TODO make sure it's Celsius
+                case "MakerNotes:BatteryLevel":
+                    table["Battery level"] = str(value)+"%"
+                case "MakerNotes:ShutterCount":
+                    table["Shutter count"] = str(value)
+                case "Composite:FocusDistance2":
+                    table["Focus distance"] = str(value)+"m"
+                case "QuickTime:ElectronicStabilizationOn":
+                    table["S/W Image stabilization"] = str(value)
+                case "QuickTime:BitrateSetting":
+                    table["Video bitrate"] = str(value)
+                case "QuickTime:VideoFrameRate":
+                    table["Framerate"] = str(value)
+                case "Composite:AvgBitrate":
+                    table["Average bitrate"]="{:.1f}".format(value/1000/1000)+"Mbps"
+                case "Composite:ImageSize":
+                    table["Resolution"] = str(value).replace(' ','x')
+                case "QuickTime:AudioSampleRate":
+                    table["Audio Sample rate"]="{:.1f}".format(value/1000)+"kHz"
+                case "QuickTime:AudioBitsPerSample":
+                    table["Audio Bit depth"] = str(value)
+                case "QuickTime:AudioChannels":
+                    table["Audio Channels"] = str(value)
+                case "QuickTime:CompressorName":
+                    table["Video Compressor name"] = str(value)
+                case "QuickTime:CompressorID":
+                    codec="unknown (" + value + ")"
+                    match value:
+                        case "hvc1":
+                            codec="H.265"
+                    table["Video codec"] = codec
+                case "MakerNotes:Shutter":
+                    if value == '0 0 0':
+                        table["Shutter type:"]="electronic"
+                    else:
+                        table["Shutter type:"]="mechanical"
+                case "Composite:GPSPosition":
+                    table["GPS"] = value
+
+    return table
+
+def load_metadata_table(exif_path):
+    return build_metadata_table(exiftool_service.get_service().get_metadata([exif_path]))
+
+# The metadata table is read on metadata_pool while the image gets decoded, the view shows whichever is
+# ready first
+def load_media(input_data, file_path, metadata_pool):
+    media = PreparedMedia(file_path)
+
+    data = media_interface.load_interface_data(input_data, 0, 'get-related', arg=file_path)
+    media.file_list = data["file_list"]
+
+    for file in data["file_list"]:
+        if file["item_type"] == file["file_type"]:
+            media.best_file = file
+        if file["file_type"] == "image-raw":
+            media.image_raw_file = file
+
+    if media.best_file == None:
+        raise ValueError(f"Media interface didn't list a file of the item type for {file_path}")
+
+    if "metadata_file" in data:
+        media.exif_path = data["metadata_file"]
+    else:
+        media.exif_path = media.best_file["file_path"]
+
+    media.metadata_future = metadata_pool.submit(load_metadata_table, media.exif_path)
+
+    if media.best_file["item_type"] == "image":
+        try:
+            if media.image_raw_file != None:
+                media.rawpy_object = rawpy.imread(media.image_raw_file["file_path"])
+                # Developed once, the shown image and the exposure previews are both made from it. Only a
+                # settled exposure change runs postprocess again, see render_exposure
+                linear = develop_linear(media.rawpy_object)
+                media.pyramids["raw"] = build_pyramid(Image.fromarray(apply_exposure(linear, 0)))
+                media.linear_preview = numpy.ascontiguousarray(linear[::2, ::2])
+            else:
+                raise rawpy._rawpy.LibRawFileUnsupportedError
+        except rawpy._rawpy.LibRawFileUnsupportedError:
+            media.rawpy_object = None
+
+        try:
+            pil_image_jpeg = Image.open(media.best_file["file_path"]).convert("RGB")
+        except Image.UnidentifiedImageError:
+            pil_image_jpeg = icons.gen_corrupted_file_icon((1000, 1000))
+        media.pyramids["jpeg"] = build_pyramid(pil_image_jpeg)
+    elif media.best_file["item_type"] == "gnss-track":
+        media.gnss_data = gnss_track_helpers.get_gpx_data(file_path)
+        media.track_levels = gnss_track_helpers.get_track_levels(file_path)
+
+    media.memory_size = estimate_memory_size(media)
+    return media
+
+# Levels stop halving once they'd get smaller than this
+MIN_PYRAMID_SIZE = 256
+
+# Returns [img, img at 1/2, img at 1/4, ...]. Resizing for the screen starts from the smallest level that's
+# still big enough, so it never has to go through the full resolution image again. Costs a third more memory
+def build_pyramid(img):
+    pyramid = [img]
+    while min(pyramid[-1].size) >= MIN_PYRAMID_SIZE*2:
+        pyramid.append(pyramid[-1].reduce(2))
+    return pyramid
+
+# Same size Image.thumbnail would give, fitting inside frame_size without enlarging unless asked to
+def get_fitted_size(image_size, frame_size, enlarge=False):
+    scale = min(frame_size[0]/image_size[0], frame_size[1]/image_size[1])
+    if not enlarge:
+        scale = min(scale, 1)
+    return (max(1, round(image_size[0]*scale)), max(1, round(image_size[1]*scale)))
+
+def resize_from_pyramid(pyramid, frame_size, enlarge=False):
+    target_size = get_fitted_size(pyramid[0].size, frame_size, enlarge)
+    level = pyramid[0]
+    for candidate in pyramid[1:]:
+        if candidate.width < target_size[0] or candidate.height < target_size[1]:
+            break
+        level = candidate
+    if level.size == target_size:
+        return level
+    return level.resize(target_size, Image.BICUBIC)
+
+def estimate_memory_size(media):
+    size = 0
+    for pyramid in media.pyramids.values():
+        for level in pyramid:
+            size += level.width*level.height*len(level.getbands())
+    if media.rawpy_object != None:
+        size += media.rawpy_object.raw_image.nbytes
+    if media.linear_preview != None:
+        size += media.linear_preview.nbytes
+    return size
+
+# Develops the RAW without exposure or output curve applied, as 16 bit linear RGB. apply_exposure turns
+# it into the shown image and the exposure previews, so postprocess doesn't run for them
+def develop_linear(rawpy_object):
+    return rawpy_object.postprocess(gamma=(1, 1), no_auto_bright=True, output_bps=16, use_camera_wb=True, highlight_mode = rawpy.HighlightMode.Reconstruct(5))
+
+# Skips rows and columns while the copy stays at least as big as the size the array fits into frame_size
+# with. Returns the copy and that size, render_exposure_preview resizes to it exactly
+def downscale_to_fit(array, frame_size):
+    target_size = get_fitted_size((array.shape[1], array.shape[0]), frame_size)
+    step = max(1, min(array.shape[1]//target_size[0], array.shape[0]//target_size[1]))
+    return numpy.ascontiguousarray(array[::step, ::step]), target_size
+
+def render_exposure_preview(linear, target_size, exposure):
+    return Image.fromarray(apply_exposure(linear, exposure)).resize(target_size, Image.BILINEAR)
+
+# Scales the linear 16 bit values by 2**exposure and applies rawpy's default BT.709 curve (gamma 2.222, toe
+# slope 4.5). Everything goes through one lookup table, so the cost doesn't depend on the exposure
+def apply_exposure(linear, exposure):
+    values = numpy.clip(numpy.arange(65536, dtype=numpy.float32)/65535*(2**exposure), 0, 1)
+    curve = numpy.where(values < 0.018, values*4.5, 1.099*numpy.power(values, 0.45) - 0.099)
+    lookup_table = numpy.round(curve*255).astype(numpy.uint8)
+    return lookup_table[linear]
+
+# The full quality version of an exposure change, this is what update_exposure used to run on every tick.
+# Returns the pyramid of the rendered image
+def render_exposure(rawpy_object, exposure):
+    rgb = rawpy_object.postprocess(exp_shift=2**exposure, no_auto_bright=True, use_camera_wb=True, highlight_mode = rawpy.HighlightMode.Reconstruct(5))
+    return build_pyramid(Image.fromarray(rgb))
+
+# Keeps the items around the one shown in full screen loaded, so stepping through them doesn't wait for
+# get-related, exiftool and decoding every time. Entries farthest from the shown item are dropped first
+# when they don't fit in the memory budget
+class FullScreenPrefetcher:
+    def __init__(self, input_data, neighbour_count=PREFETCH_NEIGHBOURS, memory_budget=PREFETCH_MEMORY_BUDGET):
+        self.input_data = input_data
+        self.neighbour_count = neighbour_count
+        self.memory_budget = memory_budget
+        # Reentrant because done callbacks of futures that already finished run right away
+        self.lock = threading.RLock()
+        self.entries = {} # file_path -> future of a PreparedMedia, or of None if it didn't fit
+        self.paths = []
+        self.path_positions = {}
+        self.position = 0
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=PREFETCH_JOBS)
+        # The shown item gets its own thread so it never waits behind the neighbours
+        self.shown_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.metadata_pool = concurrent.futures.ThreadPoolExecutor(max_workers=PREFETCH_JOBS)
+
+    # Returns a future of the PreparedMedia of the item set_position was last called for
+    def get_shown_future(self):
+        with self.lock:
+            shown_path = self.paths[self.position]
+            future = self.entries[shown_path]
+            # A neighbour that was skipped for the memory budget or failed to load gets another try
+            if future.done() and (future.cancelled() or future.exception() != None or future.result() == None):
+                future = self.submit_entry(shown_path, self.shown_pool)
+            return future
+
+    # paths is the timeline the item at position is shown from. The shown item and its neighbours get
+    # loaded nearest first, everything else is dropped
+    def set_position(self, paths, position):
+        with self.lock:
+            if paths is not self.paths:
+                self.paths = paths
+                self.path_positions = {path: i for i, path in enumerate(paths)}
+            self.position = position
+
+            wanted = [paths[position]]
+            for distance in range(1, self.neighbour_count+1):
+                for i in (position+distance, position-distance):
+                    if 0 <= i < len(paths):
+                        wanted.append(paths[i])
+
+            for path in list(self.entries):
+                if path not in wanted:
+                    self.entries.pop(path).cancel()
+
+            # A queued neighbour load of the shown item moves to the shown item's thread
+            shown_future = self.entries.get(wanted[0])
+            if shown_future == None or shown_future.cancel():
+                self.submit_entry(wanted[0], self.shown_pool)
+            for path in wanted[1:]:
+                if path not in self.entries:
+                    self.submit_entry(path, self.pool)
+
+    # Must be called with the lock held
+    def submit_entry(self, file_path, pool):
+        future = pool.submit(self.load_entry, file_path)
+        self.entries[file_path] = future
+        future.add_done_callback(self.on_entry_loaded)
+        return future
+
+    def clear(self):
+        with self.lock:
+            for future in self.entries.values():
+                future.cancel()
+            self.entries.clear()
+
+    # Runs on a prefetch thread
+    def load_entry(self, file_path):
+        with self.lock:
+            if file_path != self.paths[self.position] and self.get_used_memory() >= self.memory_budget:
+                return None
+        return load_media(self.input_data, file_path, self.metadata_pool)
+
+    def on_entry_loaded(self, future):
+        with self.lock:
+            self.trim_to_budget()
+
+    # Must be called with the lock held
+    def get_used_memory(self):
+        used = 0
+        for future in self.entries.values():
+            if future.done() and not future.cancelled() and future.exception() == None and future.result() != None:
+                used += future.result().memory_size
+        return used
+
+    # Must be called with the lock held
+    def get_distance(self, file_path):
+        return abs(self.path_positions.get(file_path, self.position) - self.position)
+
+    # Must be called with the lock held. The shown item is never dropped
+    def trim_to_budget(self):
+        used = self.get_used_memory()
+        shown_path = self.paths[self.position] if self.paths else None
+        for path in sorted(self.entries, key=self.get_distance, reverse=True):
+            if used <= self.memory_budget:
+                break
+            future = self.entries[path]
+            if path == shown_path or not future.done() or future.cancelled() or future.exception() != None or future.result() == None:
+                continue
+            used -= future.result().memory_size
+            del self.entries[path]
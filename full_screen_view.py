@@ -1,197 +1,140 @@
 import tkinter as tk
-from exiftool import ExifToolHelper
-import exiftool
-from datetime import datetime
-from datetime import timezone
 import mpv
-import os
+import concurrent.futures
 from PIL import Image, ImageTk
-from tkinter import ttk
-import tkintermapview
-import rawpy
-import gpxpy as gpxpy
+from tkinter import ttk, messagebox
 
-import media_interface
-import item_grid
-import gnss_track_helpers
 import icons
+import video_frames
+import full_screen_loader
+import gnss_track_helpers
+import tiled_image_view
+import tile_map_view
+import tile_provider
+
+# Exposure slider timing in milliseconds. Previews are cheap, the full render only starts once the slider
+# has stopped moving for a while
+EXPOSURE_PREVIEW_DELAY = 30
+EXPOSURE_RENDER_DELAY = 600
+EXPOSURE_POLL_INTERVAL = 50
+# Resizes are applied at most once per this many milliseconds
+RESIZE_FRAME_INTERVAL = 16
+# How often a view that's still loading checks on the media and metadata
+MEDIA_POLL_INTERVAL = 20
+# How often the track map checks if its zoom changed and the track needs more or fewer points
+MAP_ZOOM_POLL_INTERVAL = 100
+
+# Part lengths are read in parallel, each job keeps its own mpv instance open between files
+VIDEO_LENGTH_JOBS = 4
 
 def get_video_length(file):
-    player = mpv.MPV(vo='null', ao='null')
-    player.pause = True
-    player.play(file)
-    start_time = datetime.now()
-    while player.duration == None:
-        if (datetime.now()-start_time).total_seconds() > 15 :
-            #Timeout
-            break;
-    ret = player.duration
-    player.command('quit')
-    del player
-    return ret
+    try:
+        return video_frames.get_extractor(VIDEO_LENGTH_JOBS).get_duration(file)
+    except Exception: # A part that can't be read counts as 0 long, the other parts still get their place
+        return 0
 
 class FullScreenItem(tk.Frame):
-    def __init__(self, root, input_data, file_path, exit_callback, **kwargs):
+    def __init__(self, root, input_data, media_future, thumbnail, track_position, exit_callback, step_callback, **kwargs):
         super().__init__(root, **kwargs)
 
-        self.best_file = None
+        self.input_data = input_data
+        self.track_position = track_position # (lat, lon) from the GPX tracks, see geotag.py
         self.exit_callback = exit_callback
+        self.step_callback = step_callback
         self.image = None
+        self.photo_obj = None
         self.old_image_size = (0, 0)
+        self.resize_after_id = None
+        self.best_file = None
+        self.mpv = None
+        self.raw_pool = None
+        self.tiled_view = None
+        self.zoomed = False
 
-        data = media_interface.load_interface_data(input_data, 0, 'get-related', arg=file_path)
+        # Until the media is loaded the grid thumbnail stands in for it, scaled up to the window
+        self.pyramid = [thumbnail] if thumbnail != None else None
+        self.showing_placeholder = True
 
-        self.image_raw_file = None
-        for file in data["file_list"]:
-            if file["item_type"] == file["file_type"]:
-                self.best_file = file
-            if file["file_type"] == "image-raw":
-                self.image_raw_file = file
+        self.content_frame = tk.Frame(self)
+        self.metadata_frame = tk.Frame(self)
 
-        if self.best_file == None:
-            raise ValueError
+        self.metadata_canvas = tk.Canvas(self.metadata_frame, highlightthickness=0, width=250)
+        self.metadata_canvas.grid(row=0, column=0, sticky='nwe')
+        self.metadata_canvas.grid_rowconfigure(0, weight=1)
+        self.metadata_canvas.grid_columnconfigure(0, weight=1)
+        self.show_metadata({ "Loading metadata": "" })
 
-        self.best_file_path = self.best_file["file_path"]
+        self.attach_binds(self.metadata_canvas)
 
-        if "metadata_file" in data:
-            self.exif_path = data["metadata_file"]
-        else:
-            self.exif_path = self.best_file_path
+        self.content_frame.grid(row=0, column=0, sticky='nswe')
+        self.attach_binds(self.content_frame)
 
-        self.content_frame = tk.Frame(self)
-        self.metadata_frame = tk.Frame(self)
+        self.metadata_frame.grid(row=0, column=1, sticky='nse')
+        self.attach_binds(self.metadata_frame)
+
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+
+        self.attach_binds(self)
 
-        with ExifToolHelper() as et:
-            try:
-                metadata = et.get_metadata(self.exif_path)
-                self.metadata = {
-                        "Filename": "",
-                        "Create date": "",
-                        "Create time": ""
-                        }
-                for d in metadata:
-                    if "Composite:ShutterSpeed" in d:
-                        #Add the exposure values in this order if they exist
-                        self.metadata["Shutter speed"]=""
-                        self.metadata["Aperature"]=""
-                        self.metadata["ISO"]=""
-                        self.metadata["Focal length (35mm)"]=""
-                        break
-
-                for d in metadata:
-                    for key, value in d.items():
-                        match key:
-                            case "File:FileName":
-                                self.metadata["Filename"] = value
-                            case "EXIF:Make":
-                                self.metadata["Camera make"] = value
-                            case "EXIF:Model"|"QuickTime:Model":
-                                self.metadata["Camera model"] = value
-                            case "EXIF:CreateDate"|"QuickTime:CreateDate":
-                                try:
-                                    create_date_notz = datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
-                                    create_date = create_date_notz.replace(tzinfo=timezone.utc)
-                                    self.metadata["Create date"] = create_date.strftime("%Y-%m-%d")
-                                    self.metadata["Create time"] = create_date.strftime("%H:%M:%S")
-                                except AttributeError:
-                                    True
-                            case "Composite:ShutterSpeed":
-                                if int(value) < 1:
-                                        self.metadata["Shutter speed"] = "1/"+"{:.2f}".format(1/value)+" s"
-                                else:
-                                        self.metadata["Shutter speed"] = "{:.2f}".format(value)+" s"
-                            case "EXIF:ISO":
-                                self.metadata["ISO"] = str(value)
-                            case "EXIF:FNumber":
-                                self.metadata["Aperature"]="f" + str(value)
-                            case "EXIF:Software"|"QuickTime:FirmwareVersion":
-                                self.metadata["Software version"] = value
-                            case "EXIF:SubSecTimeOriginal":
-                                self.metadata["Create time"] += "." + str(value)
-                            case "EXIF:ExposureCompensation"|"QuickTime:ExposureCompensation":
-                                self.metadata["Exposure compensation"] = str(value)
-                            case "EXIF:FocalLengthIn35mmFormat":
-                                self.metadata["Focal length (35mm)"] = str(value)+"mm"
-                            case "EXIF:Contrast":
-                                self.metadata["Contrast"] = str(value)
-                            case "EXIF:Saturation":
-                                self.metadata["Saturation"] = str(value)
-                            case "EXIF:Sharpness"|"QuickTime:Sharpness":
-                                self.metadata["Sharpness"] = str(value)
-                            case "EXIF:SerialNumber"|"QuickTime:CameraSerialNumber":
-                                self.metadata["Serial Number"] = value
-                            case "APP6:HDRSetting"|"QuickTime:HDRVideo":
-                                self.metadata["HDR Setting"] = value
-                            case "EXIF:DigitalZoomRatio"|"QuickTime:DigitalZoomAmount":
-                                self.metadata["Digital Zoom ratio"] = str(value)
-                            case "EXIF:LensModel":
-                                self.metadata["Lens model"] = value
-                            case "MakerNotes:ImageStabilization":
-                                if value == 1:
-                                    self.metadata["Image stabilization"] = "enabled"
-                                else:
-                                    self.metadata["Image stabilization"] = "disabled"
-                            case "MakerNotes:ElectronicFrontCurtainShutter":
-                                self.metadata["Electronic Front Curtain"] = str(value)
-                            case "MakerNotes:FocusMode":
-                                self.metadata["Focus mode"] = str(value) #TODO figure what the values mean
-                            case "MakerNotes:FocusLocation":
-                                True #TODO maybe draw it?
-                            case "MakerNotes:BatteryTemperature":
-                                self.metadata["Battery temprature"]="{:.1f}".format(value)+"°C"#TODO make sure it's Celsius
-                            case "MakerNotes:BatteryLevel":
-                                self.metadata["Battery level"] = str(value)+"%"
-                            case "MakerNotes:ShutterCount":
-                                self.metadata["Shutter count"] = str(value)
-                            case "Composite:FocusDistance2":
-                                self.metadata["Focus distance"] = str(value)+"m"
-                            case "QuickTime:ElectronicStabilizationOn":
-                                self.metadata["S/W Image stabilization"] = str(value)
-                            case "QuickTime:BitrateSetting":
-                                self.metadata["Video bitrate"] = str(value)
-                            case "QuickTime:VideoFrameRate":
-                                self.metadata["Framerate"] = str(value)
-                            case "Composite:AvgBitrate":
-                                self.metadata["Average bitrate"]="{:.1f}".format(value/1000/1000)+"Mbps"
-                            case "Composite:ImageSize":
-                                self.metadata["Resolution"] = str(value).replace(' ','x')
-                            case "QuickTime:AudioSampleRate":
-                                self.metadata["Audio Sample rate"]="{:.1f}".format(value/1000)+"kHz"
-                            case "QuickTime:AudioBitsPerSample":
-                                self.metadata["Audio Bit depth"] = str(value)
-                            case "QuickTime:AudioChannels":
-                                self.metadata["Audio Channels"] = str(value)
-                            case "QuickTime:CompressorName":
-                                self.metadata["Video Compressor name"] = str(value)
-                            case "QuickTime:CompressorID":
-                                codec="unknown (" + value + ")"
-                                match value:
-                                    case "hvc1":
-                                        codec="H.265"
-                                self.metadata["Video codec"] = codec
-                            case "MakerNotes:Shutter":
-                                if value == '0 0 0':
-                                    self.metadata["Shutter type:"]="electronic"
-                                else:
-                                    self.metadata["Shutter type:"]="mechanical"
-                            case "Composite:GPSPosition":
-                                self.metadata["GPS"] = value
-            except exiftool.exceptions.ExifToolExecuteError:
-                self.metadata={ "Couldn't get metadata": "" }
+        self.media_future = media_future
+        self.media_after_id = None
+        self.metadata_after_id = None
+        self.map_zoom_after_id = None
+        self.video_lengths_after_id = None
+        self.exposure_preview_after_id = None
+        self.exposure_render_after_id = None
+        self.exposure_poll_after_id = None
+        self.track_path = None
+        self.track_path_level = None
+        self.check_media()
+
+    def check_media(self):
+        self.media_after_id = None
+        if not self.media_future.done():
+            self.media_after_id = self.after(MEDIA_POLL_INTERVAL, self.check_media)
+            return
+        try:
+            media = self.media_future.result()
+        except Exception as error:
+            # The media is loaded on prefetch threads, so what went wrong is only shown here
+            messagebox.showinfo("Error", f"ERROR: Couldn't open the item: {str(error) or type(error).__name__}")
+            self.close()
+            self.exit_callback()
+            return
+        self.show_media(media)
+        self.check_metadata(media.metadata_future)
+
+    def check_metadata(self, metadata_future):
+        self.metadata_after_id = None
+        if not metadata_future.done():
+            self.metadata_after_id = self.after(MEDIA_POLL_INTERVAL, lambda: self.check_metadata(metadata_future))
+            return
+        try:
+            metadata = metadata_future.result()
+        except Exception:
+            metadata = { "Couldn't get metadata": "" }
+        # Photos without their own position are shown where the tracks recorded at the same time put them
+        if "GPS" not in metadata and self.track_position != None:
+            metadata = dict(metadata)
+            metadata["GPS from track"] = f"{self.track_position[0]:.6f} {self.track_position[1]:.6f}"
+        self.show_metadata(metadata)
+
+    def show_metadata(self, metadata):
+        self.metadata = metadata
 
         metadata_key_x_end = 150
         metadata_value_x_start = metadata_key_x_end+5
         metadata_y_border = 20
         metadata_y_step = 15
 
-        self.metadata_canvas = tk.Canvas(self.metadata_frame, highlightthickness=0, width=250, height=len(self.metadata)*metadata_y_step+metadata_y_border*2)
-        self.metadata_canvas.grid(row=0, column=0, sticky='nwe')
-        self.metadata_canvas.grid_rowconfigure(0, weight=1)
-        self.metadata_canvas.grid_columnconfigure(0, weight=1)
+        self.metadata_canvas.delete("all")
+        self.metadata_canvas.configure(height=len(self.metadata)*metadata_y_step+metadata_y_border*2)
 
-        if "GPS" in self.metadata:
-            long, lat = self.metadata["GPS"].split(' ')
-            self.map_widget = tkintermapview.TkinterMapView(self.metadata_frame, width=400, height=400, corner_radius=10, use_database_only=input_data["force_offline"], database_path=input_data["map_database"])
+        gps = self.metadata.get("GPS", self.metadata.get("GPS from track"))
+        if gps != None:
+            long, lat = gps.split(' ')
+            self.map_widget = tile_map_view.TileMapView(self.metadata_frame, tile_provider.open_provider(self.input_data), width=400, height=400, corner_radius=10)
             self.map_widget.set_position(float(long), float(lat))
             self.map_widget.set_marker(float(long), float(lat))
             self.map_widget.set_zoom(15)
@@ -205,36 +148,26 @@ class FullScreenItem(tk.Frame):
             key_id = self.metadata_canvas.create_text(metadata_key_x_end, y, text=key+":", anchor="e", fill="#333")
             val_id = self.metadata_canvas.create_text(metadata_value_x_start, y, text=value, anchor="w", fill="#000")
 
-        self.attach_binds(self.metadata_canvas)
-
-        self.content_frame.grid(row=0, column=0, sticky='nswe')
-        self.attach_binds(self.content_frame)
-
-        self.metadata_frame.grid(row=0, column=1, sticky='nse')
-        self.attach_binds(self.metadata_frame)
-
-        self.grid_rowconfigure(0, weight=1)
-        self.grid_columnconfigure(0, weight=1)
+    def show_media(self, media):
+        input_data = self.input_data
+        self.best_file = media.best_file
+        self.image_raw_file = media.image_raw_file
+        self.best_file_path = self.best_file["file_path"]
+        self.exif_path = media.exif_path
+        self.showing_placeholder = False
 
-        self.attach_binds(self)
-        self.mpv = None
+        if self.best_file["item_type"] in ("video", "gnss-track"):
+            # These pack their widgets into the content frame, the placeholder label has to go first
+            self.pyramid = None
+            if self.image != None:
+                self.image.destroy()
+                self.image = None
+                self.photo_obj = None
 
         if self.best_file["item_type"] == "image":
-            try:
-                if self.image_raw_file != None:
-                    self.rawpy_object = rawpy.imread(self.image_raw_file["file_path"])
-                    rgb = self.rawpy_object.postprocess(use_camera_wb=True, no_auto_bright=False, highlight_mode = rawpy.HighlightMode.Reconstruct(5))
-                    self.pil_image_raw = Image.fromarray(rgb)
-                else:
-                    raise rawpy._rawpy.LibRawFileUnsupportedError
-            except rawpy._rawpy.LibRawFileUnsupportedError:
-                self.pil_image_raw = None
-                self.rawpy_object = None
-
-            try:
-                self.pil_image_jpeg = Image.open(self.best_file_path).convert("RGB")
-            except Image.UnidentifiedImageError:
-                self.pil_image_jpeg = icons.gen_corrupted_file_icon((1000, 1000))
+            self.rawpy_object = media.rawpy_object
+            # Exposure renders replace the RAW pyramid, the prefetched media keeps the original
+            self.pyramids = dict(media.pyramids)
 
             if self.rawpy_object != None:
                 self.exposure_slider = tk.Scale(self.metadata_frame, from_=-3, to=3, resolution=0.1, orient='horizontal', label="Exposure", command=self.update_exposure)
@@ -242,10 +175,19 @@ class FullScreenItem(tk.Frame):
                 self.raw_jpeg_switch = tk.Button(self.metadata_frame, text="Switch to JPEG", command=self.raw_jpeg_switch)
                 self.raw_jpeg_state = "raw"
                 self.raw_jpeg_switch.grid(row=3, column=0, sticky='we')
-                self.pil_image = self.pil_image_raw
+                self.pyramid = self.pyramids["raw"]
+                # The exposure the RAW pyramid was rendered with
                 self.last_exposure_slider_setting = 0
+
+                # rawpy objects can't be used from two threads at once, so the full renders run on one thread.
+                # The previews are made from the linear image the loader developed
+                self.raw_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+                self.linear_preview = media.linear_preview
+                self.screen_sized_linear = None # (frame size, array, target size)
+                self.pending_exposure = 0
+                self.exposure_render = None # (exposure, future)
             else:
-                self.pil_image = self.pil_image_jpeg
+                self.pyramid = self.pyramids["jpeg"]
 
         elif self.best_file["item_type"] == "video":
             self.video_frame = tk.Frame(self.content_frame)
@@ -264,44 +206,77 @@ class FullScreenItem(tk.Frame):
 
             self.video_parts_matching = []
 
-            related = media_interface.load_interface_data(input_data, 0, 'get-related', arg=file_path)
-
-            start = 0
-            end = 0
+            self.video_part_files = []
             for part_id_to_process in range(1, self.best_file["part_count"]+1):
-                for i in related["file_list"]:
+                for i in media.file_list:
                     if i["part_num"] == part_id_to_process and i["file_type"] == 'video':
                         file = i
                         break;
-                length = get_video_length(file["file_path"])
-                start = end
-                end = start + length
-                self.video_parts_matching.append((file["file_path"], start, end))
+                self.video_part_files.append(file["file_path"])
+
+            # The lengths are only needed for the seek bar, so the first part starts playing while they load
+            video_length_pool = concurrent.futures.ThreadPoolExecutor(max_workers=VIDEO_LENGTH_JOBS)
+            self.video_length_futures = [video_length_pool.submit(get_video_length, part_file) for part_file in self.video_part_files]
+            video_length_pool.shutdown(wait=False)
+            self.video_lengths_after_id = self.after(50, self.check_video_lengths)
 
             window_id = self.video_frame.winfo_id()
             self.mpv = mpv.MPV( wid=window_id, vo='x11', keep_open=True)
 
             self.mpv.pause = True
-            self.playing_file = self.video_parts_matching[0]
+            self.playing_file = (self.video_part_files[0], 0, 0)
             self.video = self.mpv.play(self.playing_file[0])
 
             self.mpv.observe_property('time-pos', self.video_time_callback)
             self.mpv.observe_property('eof-reached', self.on_end_file)
         elif self.best_file["item_type"] == "gnss-track":
-            if input_data["force_offline"] and input_data["map_database"] == None:
-                db_name = os.devnull
-            else:
-                db_name = input_data["map_database"]
-            self.main_map = tkintermapview.TkinterMapView(self.content_frame, use_database_only=input_data["force_offline"], database_path=db_name)
+            self.main_map = tile_map_view.TileMapView(self.content_frame, tile_provider.open_provider(input_data))
             self.main_map.pack(fill=tk.BOTH, expand=True)
 
-            gnss_data = gnss_track_helpers.get_gpx_data(file_path)
+            self.gnss_data = media.gnss_data
+            self.track_levels = media.track_levels
 
-            self.main_map.fit_bounding_box((gnss_data["max_lat"], gnss_data["min_lon"]), (gnss_data["min_lat"], gnss_data["max_lon"]))
-            self.main_map.set_path([(point[0], point[1]) for point in gnss_data["points"]])
+            self.main_map.fit_bounding_box((self.gnss_data["max_lat"], self.gnss_data["min_lon"]), (self.gnss_data["min_lat"], self.gnss_data["max_lon"]))
+            self.check_map_zoom()
 
         else:
-            self.pil_image = icons.gen_corrupted_file_icon((1000, 1000))
+            self.pyramid = [icons.gen_corrupted_file_icon((1000, 1000))]
+
+
+        self.update_size(force=True)
+
+    # The map redraws every point of a path whenever it moves, so the path only gets the points that are
+    # visible at the current zoom and is replaced when the zoom changes
+    def check_map_zoom(self):
+        self.map_zoom_after_id = self.after(MAP_ZOOM_POLL_INTERVAL, self.check_map_zoom)
+        level = gnss_track_helpers.get_track_level(self.track_levels, self.main_map.zoom)
+        if self.track_path != None and level is self.track_path_level:
+            return
+
+        lats = self.gnss_data["lat"] if level is None else self.gnss_data["lat"][level]
+        lons = self.gnss_data["lon"] if level is None else self.gnss_data["lon"][level]
+        if self.track_path != None:
+            self.track_path.delete()
+        self.track_path = self.main_map.set_path(list(zip(lats.tolist(), lons.tolist())))
+        self.track_path_level = level
+
+    def check_video_lengths(self):
+        self.video_lengths_after_id = None
+        if not all(future.done() for future in self.video_length_futures):
+            self.video_lengths_after_id = self.after(50, self.check_video_lengths)
+            return
+
+        start = 0
+        end = 0
+        video_parts_matching = []
+        for part_file, future in zip(self.video_part_files, self.video_length_futures):
+            start = end
+            end = start + future.result()
+            video_parts_matching.append((part_file, start, end))
+        for i in video_parts_matching:
+            if i[0] == self.playing_file[0]:
+                self.playing_file = i
+        self.video_parts_matching = video_parts_matching
 
     def on_end_file(self, name, value):
         get_next = False
@@ -315,21 +290,20 @@ class FullScreenItem(tk.Frame):
 
 
     def video_time_callback(self, name, value):
+        if len(self.video_parts_matching) == 0:
+            return
         scale_time_length = self.video_parts_matching[-1][2]
         if value != None :
             self.scale.set(((value+self.playing_file[1])*100)/scale_time_length)
 
-    def switch_video_files_mpv(self, new_file):
+    # mpv seeks to the start position itself once the file is loaded, so there is nothing to wait for here
+    def switch_video_files_mpv(self, new_file, start=0):
         self.playing_file = new_file
-        self.video = self.mpv.play(self.playing_file[0])
-        #Wait for it to load the new video
-        start_time = datetime.now()
-        while ( self.mpv.time_pos == None ): #or self.mpv.time_pos < .2):
-            if (datetime.now()-start_time).total_seconds() > 15 :
-                #Timeout
-                break;
+        self.video = self.mpv.loadfile(self.playing_file[0], start=str(start))
 
     def video_scale_click(self, event):
+        if len(self.video_parts_matching) == 0:
+            return
         orig_pause = self.mpv.pause
         self.mpv.pause = True
         scale_pixel_length = self.scale.winfo_width()
@@ -341,10 +315,11 @@ class FullScreenItem(tk.Frame):
             if i[2] > new_time:
                 file_to_play = i
                 break;
+        relative_time = new_time-file_to_play[1];
         if self.playing_file[0] != file_to_play[0]:
-            self.switch_video_files_mpv(file_to_play)
-        relative_time = new_time-self.playing_file[1];
-        self.mpv.time_pos = relative_time
+            self.switch_video_files_mpv(file_to_play, start=relative_time)
+        else:
+            self.mpv.time_pos = relative_time
         self.mpv.pause = orig_pause
 
     def video_play_pause(self):
@@ -356,21 +331,41 @@ class FullScreenItem(tk.Frame):
             self.mpv.pause = False
 
     def attach_binds(self, widget):
-        widget.bind("<Configure>", lambda x: self.after_idle(self.update_size))
+        widget.bind("<Configure>", lambda x: self.schedule_update_size())
         widget.bind("<Key>", self.key_callback)
         widget.bind("<Enter>", lambda x: x.widget.focus_set() )
 
+    def close(self):
+        # Stepping through items destroys views that are still loading
+        for after_id in (self.media_after_id, self.metadata_after_id, self.map_zoom_after_id, self.video_lengths_after_id,
+                         self.exposure_preview_after_id, self.exposure_render_after_id, self.exposure_poll_after_id,
+                         self.resize_after_id):
+            if after_id != None:
+                self.after_cancel(after_id)
+        if self.mpv != None:
+            self.mpv.command('quit')
+        if self.raw_pool != None:
+            self.raw_pool.shutdown(wait=False, cancel_futures=True)
+
     def enter(self, event):
         event.widget.focus_set()
 
     def key_callback(self, event):
+        match event.keysym:
+            case 'Left':
+                self.step_callback(-1)
+                return
+            case 'Right':
+                self.step_callback(1)
+                return
         match event.char:
             case '\r':
-                if self.mpv != None:
-                    self.mpv.command('quit')
+                self.close()
                 self.exit_callback()
             case ' ':
                 self.video_play_pause()
+            case 'z':
+                self.toggle_zoom()
             case '.':
                 self.mpv.command('frame-step')
                 self.video_play_button.config(text="play")
@@ -381,46 +376,142 @@ class FullScreenItem(tk.Frame):
     def raw_jpeg_switch(self):
         if self.raw_jpeg_state == 'raw':
             self.raw_jpeg_switch.configure(text="Switch to RAW")
-            self.pil_image = self.pil_image_jpeg
+            self.pyramid = self.pyramids["jpeg"]
             self.raw_jpeg_state = 'jpeg'
         else:
             self.raw_jpeg_switch.configure(text="Switch to JPEG")
-            self.pil_image = self.pil_image_raw
+            self.pyramid = self.pyramids["raw"]
             self.raw_jpeg_state = 'raw'
         if self.last_exposure_slider_setting != self.exposure_slider.get():
             self.update_exposure(self.exposure_slider.get())
         self.update_size(force=True)
 
+    # Slider callback. Dragging the slider only shows previews made from the linear preview, the full
+    # quality render starts once the slider stays put
     def update_exposure(self, exp_shift):
         if self.raw_jpeg_state == 'raw':
-            exp_shift = float(exp_shift)
-            rgb = self.rawpy_object.postprocess(exp_shift=2**exp_shift, no_auto_bright=True, use_camera_wb=True, highlight_mode = rawpy.HighlightMode.Reconstruct(5))
-            self.pil_image_raw = Image.fromarray(rgb)
-            self.pil_image = self.pil_image_raw
+            self.pending_exposure = float(exp_shift)
+            if self.exposure_preview_after_id != None:
+                self.after_cancel(self.exposure_preview_after_id)
+            self.exposure_preview_after_id = self.after(EXPOSURE_PREVIEW_DELAY, self.show_exposure_preview)
+            if self.exposure_render_after_id != None:
+                self.after_cancel(self.exposure_render_after_id)
+            self.exposure_render_after_id = self.after(EXPOSURE_RENDER_DELAY, self.start_exposure_render)
+
+    def show_exposure_preview(self):
+        self.exposure_preview_after_id = None
+        # Previews are screen sized, zoomed in there's nothing to gain from them so wait for the full render
+        if self.raw_jpeg_state != 'raw' or self.zoomed:
+            return
+
+        frame_size = (self.content_frame.winfo_width(), self.content_frame.winfo_height())
+        if self.screen_sized_linear == None or self.screen_sized_linear[0] != frame_size:
+            self.screen_sized_linear = (frame_size, *full_screen_loader.downscale_to_fit(self.linear_preview, frame_size))
+
+        self.pyramid = [full_screen_loader.render_exposure_preview(self.screen_sized_linear[1], self.screen_sized_linear[2], self.pending_exposure)]
+        self.update_size(force=True)
+
+    def start_exposure_render(self):
+        self.exposure_render_after_id = None
+        exposure = self.pending_exposure
+        if exposure == self.last_exposure_slider_setting:
+            # Back to what's already rendered, replace the preview
+            if self.raw_jpeg_state == 'raw':
+                self.pyramid = self.pyramids["raw"]
+                self.update_size(force=True)
+            return
+        future = self.raw_pool.submit(full_screen_loader.render_exposure, self.rawpy_object, exposure)
+        self.exposure_render = (exposure, future)
+        self.exposure_poll_after_id = self.after(EXPOSURE_POLL_INTERVAL, lambda: self.check_exposure_render(exposure, future))
+
+    def check_exposure_render(self, exposure, future):
+        self.exposure_poll_after_id = None
+        if not future.done():
+            self.exposure_poll_after_id = self.after(EXPOSURE_POLL_INTERVAL, lambda: self.check_exposure_render(exposure, future))
+            return
+        # A newer render was started while this one ran, or the slider moved again
+        if future is not self.exposure_render[1] or exposure != self.pending_exposure:
+            return
+        try:
+            self.pyramids["raw"] = future.result()
+        except Exception:
+            return
+        self.last_exposure_slider_setting = exposure
+        if self.raw_jpeg_state == 'raw':
+            self.pyramid = self.pyramids["raw"]
             self.update_size(force=True)
-            self.last_exposure_slider_setting = exp_shift
 
+    # Configure events come in bursts from every widget while resizing, they are handled once per frame
+    def schedule_update_size(self):
+        if self.resize_after_id == None:
+            self.resize_after_id = self.after(RESIZE_FRAME_INTERVAL, self.run_scheduled_update_size)
+
+    def run_scheduled_update_size(self):
+        self.resize_after_id = None
+        self.update_size()
+
+    # Videos and tracks have no pyramid, they fill the content frame by themselves
     def update_size(self, force=False):
-        if self.best_file["item_type"] == "image":
-            self.update_image_size(force=force)
-        elif self.best_file["item_type"] == "video":
-            pass
-        elif self.best_file["item_type"] == "gnss-track":
-            pass
-        else:
+        if self.pyramid != None:
             self.update_image_size(force=force)
 
+    # Switches between fitting the image in the window and the tiled view at 1:1. The point under
+    # view_point stays where it is
+    def toggle_zoom(self, view_point=None):
+        if self.pyramid == None or self.showing_placeholder:
+            return
+        if self.zoomed:
+            self.exit_zoom()
+            return
+
+        frame_size = (self.content_frame.winfo_width(), self.content_frame.winfo_height())
+        if view_point == None:
+            view_point = (frame_size[0]/2, frame_size[1]/2)
+        fitted_size = full_screen_loader.get_fitted_size(self.pyramid[0].size, frame_size)
+        fit_scale = fitted_size[0]/self.pyramid[0].width
+        image_point = (min(view_point[0], fitted_size[0])/fit_scale, min(view_point[1], fitted_size[1])/fit_scale)
+
+        if self.tiled_view == None:
+            self.tiled_view = tiled_image_view.TiledImageView(self.content_frame, self.exit_zoom)
+            self.tiled_view.bind("<Key>", self.key_callback)
+            self.tiled_view.bind("<Enter>", lambda x: x.widget.focus_set())
+            self.tiled_view.bind("<Double-Button-1>", lambda event: self.exit_zoom())
+            self.content_frame.grid_rowconfigure(0, weight=1)
+            self.content_frame.grid_columnconfigure(0, weight=1)
+        self.zoomed = True
+        if self.image != None:
+            self.image.grid_remove()
+        self.tiled_view.grid(row=0, column=0, sticky='nswe')
+        self.tiled_view.update_idletasks()
+        self.tiled_view.set_pyramid(self.pyramid)
+        self.tiled_view.set_zoom(1, image_point, view_point)
+        self.tiled_view.focus_set()
+
+    def exit_zoom(self):
+        self.zoomed = False
+        self.tiled_view.grid_remove()
+        if self.image != None:
+            self.image.grid()
+        self.update_size(force=True)
+
     def update_image_size(self, force):
+        if self.zoomed:
+            self.tiled_view.set_pyramid(self.pyramid)
+            return
         frame_width = self.content_frame.winfo_width()
         frame_height = self.content_frame.winfo_height()
         image_size = (frame_width, frame_height)
         if image_size != self.old_image_size or force:
             self.old_image_size = image_size
-            if self.image:
-                self.image.destroy()
-            image_resized = self.pil_image.copy()
-            image_resized.thumbnail(image_size)
+            image_resized = full_screen_loader.resize_from_pyramid(self.pyramid, image_size, enlarge=self.showing_placeholder)
 
-            self.photo_obj = ImageTk.PhotoImage(image_resized)
-            self.image = tk.Label(self.content_frame, image=self.photo_obj, borderwidth=0)
-            self.image.grid(row=0, column=0, sticky='nw')
+            # The label stays, only its image changes. Same sized images are pasted into the PhotoImage
+            if self.photo_obj != None and (self.photo_obj.width(), self.photo_obj.height()) == image_resized.size:
+                self.photo_obj.paste(image_resized)
+            else:
+                self.photo_obj = ImageTk.PhotoImage(image_resized)
+                if self.image == None:
+                    self.image = tk.Label(self.content_frame, borderwidth=0)
+                    self.image.grid(row=0, column=0, sticky='nw')
+                    self.image.bind("<Double-Button-1>", lambda event: self.toggle_zoom((event.x, event.y)))
+                self.image.configure(image=self.photo_obj)
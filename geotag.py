@@ -0,0 +1,79 @@
+import numpy
+
+import gnss_track_helpers
+
+# Photos taken further than this from the track points around them don't get a position, the logger was
+# probably switched off in between
+MAX_INTERPOLATION_GAP = 5*60
+
+# All timestamped points of a set of GPX tracks sorted by time, so the position at any moment can be
+# looked up with a binary search
+class TrackIndex:
+    def __init__(self, tracks):
+        times = numpy.concatenate([numpy.asarray(i["time"], dtype=numpy.int64) for i in tracks] or [numpy.empty(0, dtype=numpy.int64)])
+        lats = numpy.concatenate([i["lat"] for i in tracks] or [numpy.empty(0)])
+        lons = numpy.concatenate([i["lon"] for i in tracks] or [numpy.empty(0)])
+
+        timed = times != gnss_track_helpers.TIME_MISSING
+        order = numpy.argsort(times[timed], kind="stable")
+        self.times = times[timed][order]
+        self.lats = lats[timed][order]
+        self.lons = lons[timed][order]
+
+    # epochs are the create epochs of the photos, read from a camera clock that runs camera_clock_offset
+    # seconds ahead of the GPS time. Returns arrays of the latitudes and longitudes linearly interpolated
+    # between the track points around every epoch, NaN where there is no track
+    def locate(self, epochs, camera_clock_offset=0):
+        epochs = numpy.asarray(epochs, dtype=numpy.int64)
+        point_count = len(self.times)
+        if point_count == 0:
+            return numpy.full(len(epochs), numpy.nan), numpy.full(len(epochs), numpy.nan)
+
+        times = epochs - camera_clock_offset
+        right = numpy.searchsorted(self.times, times, side="left")
+        left = numpy.maximum(right - 1, 0)
+        right_clipped = numpy.minimum(right, point_count - 1)
+
+        span = self.times[right_clipped] - self.times[left]
+        exact = (right < point_count) & (self.times[right_clipped] == times)
+        between = (right > 0) & (right < point_count) & (span <= MAX_INTERPOLATION_GAP)
+        valid = (exact | between) & (epochs != -1)
+
+        fraction = numpy.where(span > 0, (times - self.times[left]) / numpy.where(span > 0, span, 1), 0.0)
+        fraction = numpy.where(exact, 1.0, fraction)
+        lats = self.lats[left] + (self.lats[right_clipped] - self.lats[left]) * fraction
+        lons = self.lons[left] + (self.lons[right_clipped] - self.lons[left]) * fraction
+        return numpy.where(valid, lats, numpy.nan), numpy.where(valid, lons, numpy.nan)
+
+# Tracks that can't be read are left out, their thumbnails already report what's wrong with them
+def build_track_index(gpx_paths):
+    tracks = []
+    for path in gpx_paths:
+        try:
+            tracks.append(gnss_track_helpers.get_gpx_data(path))
+        except Exception:
+            continue
+    return TrackIndex(tracks)
+
+# entries are (create_epoch, file_path) pairs of the photos. Returns a dict from file path to the
+# (lat, lon) the tracks put it at, photos without one are left out
+def locate_photos(track_index, entries, camera_clock_offset=0):
+    lats, lons = track_index.locate([i[0] for i in entries], camera_clock_offset)
+    located = numpy.flatnonzero(~numpy.isnan(lats)).tolist()
+    lats = lats.tolist()
+    lons = lons.tolist()
+    return {entries[i][1]: (lats[i], lons[i]) for i in located}
+
+# Positions every item of a timeline ((create_epoch, item_data) pairs, see item_grid.ItemGrid) that isn't a
+# track itself against all the tracks in it
+def geotag_timeline(timeline, camera_clock_offset=0):
+    track_paths = []
+    entries = []
+    for create_epoch, item_data in timeline:
+        if item_data[0]["file_type"] == "gnss-track":
+            track_paths.append(item_data[0]["file_path"])
+        elif create_epoch != -1:
+            entries.append((create_epoch, item_data[0]["file_path"]))
+    if not track_paths or not entries:
+        return {}
+    return locate_photos(build_track_index(track_paths), entries, camera_clock_offset)
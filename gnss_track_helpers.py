@@ -1,14 +1,12 @@
 import math
-import gpxpy
-import requests
+import os
+import re
+import array
+import functools
+import warnings
+import numpy
 from PIL import Image, ImageDraw
-from io import BytesIO
-from datetime import datetime
-import sqlite3
-
-HEADERS = {
-    "User-Agent": "media-organiser/1.0"
-}
+import xml.etree.ElementTree as ET
 
 def deg2tile(lat_deg, lon_deg, zoom):
     lat_rad = math.radians(lat_deg)
@@ -25,57 +23,311 @@ def deg2pixel(lat_deg, lon_deg, zoom, tile_origin_x, tile_origin_y):
     # convert to stitched image pixel (subtract origin tile)
     return int(x - tile_origin_x * 256), int(y - tile_origin_y * 256)
 
-def get_gpx_data(gpx_filename):
-    gpx = gpxpy.parse(open(gpx_filename))
+# Web-Mercator can't show the poles, tiles stop at this latitude
+MAX_MERCATOR_LAT = 85.0511287798
+
+# Vectorized deg2pixel, returns float pixel coordinates on the whole world map at this zoom
+def project_to_pixels(lats, lons, zoom):
+    lat_rad = numpy.radians(numpy.clip(lats, -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT))
+    world_size = 2.0 ** zoom * 256
+    x = (numpy.asarray(lons) + 180.0) / 360.0 * world_size
+    y = (1.0 - numpy.log(numpy.tan(lat_rad) + 1 / numpy.cos(lat_rad)) / math.pi) / 2.0 * world_size
+    return x, y
+
+# Tracks get simplified for every map zoom up to this one, deeper zooms use the full track
+MAX_TRACK_ZOOM = 19
+# How far in screen pixels a simplified track may be from the real one
+TRACK_TOLERANCE = 0.5
+
+# Returns the indices of the points that stay after Douglas-Peucker simplification. Instead of recursing,
+# every round splits all the spans that are still too far off at once, so a round is a few numpy passes
+# over the points and the number of rounds is the depth of the recursion
+def douglas_peucker(xs, ys, tolerance):
+    keep = numpy.zeros(len(xs), dtype=bool)
+    if len(xs) == 0:
+        return numpy.flatnonzero(keep)
+    keep[0] = keep[-1] = True
+    active = numpy.ones(len(xs), dtype=bool) # Points in spans that may still need splitting
+    while True:
+        kept = numpy.flatnonzero(keep)
+        points = numpy.flatnonzero(active)
+        # Every point belongs to the span starting at the last kept point before it
+        span = numpy.cumsum(keep)[points] - 1
+        starts = kept[span]
+        ends = kept[numpy.minimum(span + 1, len(kept) - 1)]
+
+        dx = xs[ends] - xs[starts]
+        dy = ys[ends] - ys[starts]
+        px = xs[points] - xs[starts]
+        py = ys[points] - ys[starts]
+        length = numpy.hypot(dx, dy)
+        distances = numpy.where(length > 0, numpy.abs(px*dy - py*dx) / numpy.where(length > 0, length, 1), numpy.hypot(px, py))
+
+        span_max = numpy.zeros(len(kept))
+        numpy.maximum.at(span_max, span, distances)
+        split_spans = span_max > tolerance
+        if not split_spans.any():
+            break
+
+        # The farthest point of each span that's too far off becomes a new kept point
+        candidates = numpy.flatnonzero(split_spans[span] & (distances == span_max[span]))
+        unique_spans, first = numpy.unique(span[candidates], return_index=True)
+        keep[points[candidates[first]]] = True
+        active[points[~split_spans[span]]] = False
+    return numpy.flatnonzero(keep)
+
+# Returns a list with the indices of the points to draw at every zoom from 0 to MAX_TRACK_ZOOM. Points
+# falling on the same pixel as the one before are dropped first, which is cheap and takes out most of a
+# densely recorded track, Douglas-Peucker then removes the ones that don't change the shape. Every level is
+# made from the finer one, so the levels only get cheaper to compute
+def build_track_levels(data):
+    # Pixels at zoom 0, a pixel at zoom z is 2**-z of them
+    world_x, world_y = project_to_pixels(data["lat"], data["lon"], 0)
+    indices = numpy.arange(len(world_x))
+    levels = [None] * (MAX_TRACK_ZOOM + 1)
+    for zoom in range(MAX_TRACK_ZOOM, -1, -1):
+        scale = 2.0 ** zoom
+        xs = world_x[indices]
+        ys = world_y[indices]
+        if len(indices) > 2:
+            pixel_x = numpy.floor(xs * scale)
+            pixel_y = numpy.floor(ys * scale)
+            moved = numpy.empty(len(indices), dtype=bool)
+            moved[0] = moved[-1] = True
+            moved[1:-1] = (pixel_x[1:-1] != pixel_x[:-2]) | (pixel_y[1:-1] != pixel_y[:-2])
+            indices = indices[moved]
+            xs = xs[moved]
+            ys = ys[moved]
+        indices = indices[douglas_peucker(xs, ys, TRACK_TOLERANCE / scale)]
+        indices.flags.writeable = False # Shared between callers
+        levels[zoom] = indices
+    return levels
 
-    lats = []
-    lons = []
-    for track in gpx.tracks:
-        for segment in track.segments:
-            for p in segment.points:
-                lats.append(p.latitude)
-                lons.append(p.longitude)
+# Parsed tracks kept per process, so the thumbnail, the tile packs and the full screen view parse a track
+# only once as long as the file doesn't change
+GPX_CACHE_SIZE = 16
+# Stored in the time array for track points without a timestamp
+TIME_MISSING = numpy.iinfo(numpy.int64).min
 
+TRACK_POINT_START = re.compile(rb'<(?:[\w.-]+:)?trkpt\b')
+TRACK_POINT_LAT = re.compile(rb'<(?:[\w.-]+:)?trkpt\b[^>]*?\slat\s*=\s*["\']([^"\']+)')
+TRACK_POINT_LON = re.compile(rb'<(?:[\w.-]+:)?trkpt\b[^>]*?\slon\s*=\s*["\']([^"\']+)')
+# A whole track point, group 1 is its content, None if the element is empty
+TRACK_POINT_ELEMENT = re.compile(rb'<(?:[\w.-]+:)?trkpt\b[^>]*?(?:/>|>(.*?)</(?:[\w.-]+:)?trkpt\s*>)', re.DOTALL)
+TIME_ELEMENT = re.compile(rb'<(?:[\w.-]+:)?time>\s*([^<\s]+)\s*<')
+# The summary reads the file in chunks of this size
+SUMMARY_CHUNK_SIZE = 1024*1024
+# The end of a chunk is searched for the last track point in windows starting at this size
+SUMMARY_SEARCH_WINDOW = 4096
+MAX_TAG_LENGTH = 256
+
+def get_local_tag(element):
+    return element.tag.rsplit('}', 1)[-1]
+
+# GPX times are UTC, numpy converts the ones with an offset and warns that it can't keep the offset
+def parse_gpx_times(time_strings):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        milliseconds = numpy.array([i[:-1] if i.endswith("Z") else i for i in time_strings], dtype="datetime64[ms]").astype(numpy.int64)
+    return numpy.where(milliseconds == TIME_MISSING, TIME_MISSING, milliseconds // 1000)
+
+# A track starts at the first of its points that has a time, -1 if none has one. The timeline places
+# tracks with this and the thumbnail reports the same time
+def get_start_epoch(times):
+    valid = times[times != TIME_MISSING]
+    return int(valid[0]) if len(valid) else -1
+
+def get_bounds(lats, lons):
+    if len(lats) == 0:
+        raise ValueError("GPX file has no track points")
     return {
-        "min_lat": min(lats),
-        "max_lat": max(lats),
-        "min_lon": min(lons),
-        "max_lon": max(lons),
-        "points": [(p.latitude, p.longitude, p.time) for track in gpx.tracks
-                   for seg in track.segments
-                   for p in seg.points]
+        "min_lat": float(lats.min()),
+        "max_lat": float(lats.max()),
+        "min_lon": float(lons.min()),
+        "max_lon": float(lons.max()),
+    }
+
+# Streams through the file, only the current track point is kept as XML. Returns the bounds and packed
+# arrays "lat", "lon" (float64) and "time" (int64 epoch seconds, TIME_MISSING where a point has none)
+def read_gpx_track(gpx_filename):
+    lats = array.array('d')
+    lons = array.array('d')
+    times = []
+    segment = None
+    # This loop runs for every element of the file, so the tags are only checked with endswith
+    for event, element in ET.iterparse(gpx_filename, events=("start", "end")):
+        if event == "start":
+            if element.tag.endswith("trkseg"):
+                segment = element
+            continue
+        if not element.tag.endswith("trkpt"):
+            continue
+
+        lats.append(float(element.get("lat")))
+        lons.append(float(element.get("lon")))
+        point_time = "NaT"
+        for child in element:
+            if child.tag.endswith("time") and child.text:
+                point_time = child.text.strip()
+                break
+        times.append(point_time)
+
+        # Drop the finished points, otherwise the whole tree builds up in memory
+        element.clear()
+        if segment != None:
+            del segment[:]
+
+    data = {
+        "lat": numpy.frombuffer(lats, dtype=numpy.float64),
+        "lon": numpy.frombuffer(lons, dtype=numpy.float64),
+        "time": parse_gpx_times(times),
     }
+    data.update(get_bounds(data["lat"], data["lon"]))
+    return data
 
+# Yields where the track points in data[:end] start, the last one first
+def iterate_track_point_starts_backwards(data, end):
+    window = SUMMARY_SEARCH_WINDOW
+    search_end = end
+    while search_end > 0:
+        window_start = max(0, search_end - window)
+        # The search goes a bit past search_end, so tags cut by the window before are found
+        starts = [i.start() for i in TRACK_POINT_START.finditer(data, window_start, min(end, search_end + MAX_TAG_LENGTH))]
+        for point_start in reversed(starts):
+            if point_start < search_end:
+                yield point_start
+        search_end = window_start
+        window *= 4
+
+def get_track_point_time(data, point_start, end):
+    point = TRACK_POINT_ELEMENT.match(data, point_start, end)
+    if point == None or point.group(1) == None:
+        return None
+    time = TIME_ELEMENT.search(point.group(1))
+    if time == None or get_start_epoch(parse_gpx_times([time.group(1).decode()])) == -1:
+        return None # Left out like a point without time, see get_start_epoch
+    return time.group(1)
+
+# The fast mode, regular expressions over the raw file instead of an XML parser. The file is read in chunks
+# and only the bounds, the first and last track point time and the point count are kept. Returns those,
+# the times are -1 if no track point has one. Times of the metadata and waypoints are left out
+def read_gpx_summary(gpx_filename):
+    bounds = None
+    point_count = 0
+    first_time = None
+    last_time = None
+    buffer = b""
+    with open(gpx_filename, 'rb') as file:
+        while True:
+            chunk = file.read(SUMMARY_CHUNK_SIZE)
+            buffer += chunk
+            # A track point that isn't complete yet is carried over to the next chunk. Without a track point
+            # only the end is kept, it could hold the first part of one
+            last_point_start = next(iterate_track_point_starts_backwards(buffer, len(buffer)), None)
+            if chunk == b"":
+                parsed_end = len(buffer)
+            elif last_point_start == None:
+                parsed_end = max(0, len(buffer) - SUMMARY_SEARCH_WINDOW)
+            else:
+                last_point = TRACK_POINT_ELEMENT.match(buffer, last_point_start)
+                parsed_end = last_point.end() if last_point != None else last_point_start
+
+            lats = numpy.array(TRACK_POINT_LAT.findall(buffer, 0, parsed_end), dtype=numpy.float64)
+            lons = numpy.array(TRACK_POINT_LON.findall(buffer, 0, parsed_end), dtype=numpy.float64)
+            if len(lats):
+                chunk_bounds = get_bounds(lats, lons)
+                if bounds == None:
+                    bounds = chunk_bounds
+                else:
+                    bounds = {key: (min if key.startswith("min") else max)(bounds[key], value) for key, value in chunk_bounds.items()}
+                point_count += len(lats)
+
+                if first_time == None:
+                    for point in TRACK_POINT_START.finditer(buffer, 0, parsed_end):
+                        first_time = get_track_point_time(buffer, point.start(), parsed_end)
+                        if first_time != None:
+                            break
+                for point_start in iterate_track_point_starts_backwards(buffer, parsed_end):
+                    point_time = get_track_point_time(buffer, point_start, parsed_end)
+                    if point_time != None:
+                        last_time = point_time
+                        break
+
+            if chunk == b"":
+                break
+            buffer = buffer[parsed_end:]
+
+    if bounds == None:
+        raise ValueError("GPX file has no track points")
+    summary = dict(bounds)
+    summary["point_count"] = point_count
+    times = parse_gpx_times([first_time.decode(), last_time.decode()]) if first_time != None else []
+    summary["start_epoch"] = int(times[0]) if len(times) and times[0] != TIME_MISSING else -1
+    summary["end_epoch"] = int(times[1]) if len(times) and times[1] != TIME_MISSING else -1
+    return summary
+
+@functools.lru_cache(maxsize=GPX_CACHE_SIZE)
+def read_gpx_track_cached(real_path, size, mtime_ns):
+    data = read_gpx_track(real_path)
+    for key in ("lat", "lon", "time"):
+        data[key].flags.writeable = False # Shared between callers
+    return data
+
+@functools.lru_cache(maxsize=GPX_CACHE_SIZE*4)
+def read_gpx_summary_cached(real_path, size, mtime_ns):
+    return read_gpx_summary(real_path)
+
+@functools.lru_cache(maxsize=GPX_CACHE_SIZE)
+def build_track_levels_cached(real_path, size, mtime_ns):
+    return build_track_levels(read_gpx_track_cached(real_path, size, mtime_ns))
+
+def get_file_cache_key(gpx_filename):
+    stat = os.stat(gpx_filename)
+    return os.path.realpath(gpx_filename), stat.st_size, stat.st_mtime_ns
+
+# Callers must not modify the returned arrays
+def get_gpx_data(gpx_filename):
+    return read_gpx_track_cached(*get_file_cache_key(gpx_filename))
+
+def get_track_levels(gpx_filename):
+    return build_track_levels_cached(*get_file_cache_key(gpx_filename))
+
+# The indices of the track points worth drawing at a map zoom, zoom can be fractional
+def get_track_level(levels, zoom):
+    zoom = math.ceil(zoom)
+    if zoom > MAX_TRACK_ZOOM:
+        return None # Everything
+    return levels[max(0, zoom)]
+
+def get_gpx_summary(gpx_filename):
+    return read_gpx_summary_cached(*get_file_cache_key(gpx_filename))
+
+# Only reads the file up to the first timestamped track point, used to place tracks on the timeline before
+# the whole file gets parsed for the thumbnail
+def get_gpx_start_epoch(gpx_filename):
+    in_track_point = False
+    for event, element in ET.iterparse(gpx_filename, events=("start", "end")):
+        tag = get_local_tag(element)
+        if tag == "trkpt":
+            in_track_point = event == "start"
+        elif tag == "time" and event == "end" and in_track_point and element.text:
+            epoch = get_start_epoch(parse_gpx_times([element.text.strip()]))
+            if epoch != -1:
+                return epoch
+    return -1
+
+# Missing tiles are drawn as a plain placeholder, see tile_provider.TileProvider.get_tiles for where the
+# others come from
+def download_tiles(min_x, max_x, min_y, max_y, zoom, tile_provider):
+    wanted = [(zoom, x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+    found = tile_provider.get_tiles(wanted)
 
-def download_tiles(min_x, max_x, min_y, max_y, zoom, force_offline, map_database):
     tiles = {}
-    for x in range(min_x, max_x + 1):
-        for y in range(min_y, max_y + 1):
-            tile = None
-            if force_offline == False:
-                url = f"https://tile.openstreetmap.org/{zoom}/{x}/{y}.png"
-                r = requests.get(url, headers=HEADERS)
-                r.raise_for_status()
-                tile = Image.open(BytesIO(r.content))
-
-            if tile==None and map_database != None:
-                db_connection = sqlite3.connect(map_database)
-                db_cursor = db_connection.cursor()
-
-                try:
-                    db_cursor.execute("SELECT t.tile_image FROM tiles t WHERE t.zoom=? AND t.x=? AND t.y=? AND t.server=?;",
-                                      (zoom, x, y, "https://a.tile.openstreetmap.org/{z}/{x}/{y}.png"))
-                    result = db_cursor.fetchone()
-
-                    if result is not None:
-                        tile = Image.open(BytesIO(result[0]))
-
-                except sqlite3.OperationalError:
-                        pass
-
-            if tile == None:
-                tile = Image.new("RGB", (256, 256), (0x99, 0xff, 0x99))
-            tiles[(x, y)] = tile
+    for tile in wanted:
+        image = found.get(tile)
+        if image == None:
+            image = Image.new("RGB", (256, 256), (0x99, 0xff, 0x99))
+        tiles[(tile[1], tile[2])] = image
     return tiles
 
 def stitch_tiles(tiles, min_x, max_x, min_y, max_y):
@@ -102,7 +354,7 @@ def calculate_zoom(bounds, max_tiles_x=2, max_tiles_y=2, max_zoom=19, min_zoom=2
 
     return min_zoom  # fallback
 
-def gnss_thumbnail_and_timestamp(gpx_file, max_tiles=2, max_zoom=19, force_offline=False, map_database=None):
+def gnss_thumbnail_and_timestamp(gpx_file, tile_provider, max_tiles=2, max_zoom=19):
     data = get_gpx_data(gpx_file)
 
     zoom = calculate_zoom(data, max_tiles_x=max_tiles, max_tiles_y=max_tiles, max_zoom=max_zoom)
@@ -111,16 +363,20 @@ def gnss_thumbnail_and_timestamp(gpx_file, max_tiles=2, max_zoom=19, force_offli
     min_x, min_y = deg2tile(data["max_lat"], data["min_lon"], zoom)
     max_x, max_y = deg2tile(data["min_lat"], data["max_lon"], zoom)
 
-    tiles = download_tiles(min_x, max_x, min_y, max_y, zoom, force_offline, map_database)
+    tiles = download_tiles(min_x, max_x, min_y, max_y, zoom, tile_provider)
     map_img = stitch_tiles(tiles, min_x, max_x, min_y, max_y)
 
     # draw track
     draw = ImageDraw.Draw(map_img)
-    pixel_points = [
-        deg2pixel(lat, lon, zoom, min_x, min_y)
-        for lat, lon, _ in data["points"]
-    ]
+    level = get_track_level(get_track_levels(gpx_file), zoom)
+    lats = data["lat"] if level is None else data["lat"][level]
+    lons = data["lon"] if level is None else data["lon"][level]
+    xs, ys = project_to_pixels(lats, lons, zoom)
+    # convert to stitched image pixel (subtract origin tile)
+    xs = (xs - min_x * 256).astype(numpy.int64)
+    ys = (ys - min_y * 256).astype(numpy.int64)
+    pixel_points = list(zip(xs.tolist(), ys.tolist()))
 
     draw.line(pixel_points, fill="red", width=4)
 
-    return map_img, data["points"][0][2].timestamp()
+    return map_img, get_start_epoch(data["time"])
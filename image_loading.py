@@ -0,0 +1,64 @@
+from PIL import Image, ExifTags
+from io import BytesIO
+
+EXIF_THUMBNAIL_OFFSET_TAG = 0x0201
+EXIF_THUMBNAIL_LENGTH_TAG = 0x0202
+# Embedded thumbnails are usually 160x120, that's a bit smaller than the grid thumbnails. Upscaling it this
+# much is hardly visible at that size and much cheaper than decoding the image
+EMBEDDED_THUMBNAIL_MIN_SCALE = 0.85
+
+def get_embedded_thumbnail(img):
+    exif_bytes = img.info.get("exif")
+    if not exif_bytes:
+        return None
+
+    thumbnail_ifd = img.getexif().get_ifd(ExifTags.IFD.IFD1)
+    offset = thumbnail_ifd.get(EXIF_THUMBNAIL_OFFSET_TAG)
+    length = thumbnail_ifd.get(EXIF_THUMBNAIL_LENGTH_TAG)
+    if not offset or not length:
+        return None
+
+    # The offsets are relative to the TIFF header, which comes after the APP1 "Exif" marker
+    tiff_header_start = 6 if exif_bytes.startswith(b"Exif\x00\x00") else 0
+    thumbnail_bytes = exif_bytes[tiff_header_start+offset:tiff_header_start+offset+length]
+
+    thumbnail = Image.open(BytesIO(thumbnail_bytes))
+    thumbnail.load()
+    return thumbnail
+
+# Cameras often letterbox the embedded thumbnail to 4:3, only use it when it has the same shape as the image
+def embedded_thumbnail_usable(thumbnail, image_size, thumb_size):
+    if thumbnail == None or thumbnail.size[0] < thumb_size[0]*EMBEDDED_THUMBNAIL_MIN_SCALE:
+        return False
+    image_ratio = image_size[0]/image_size[1]
+    thumbnail_ratio = thumbnail.size[0]/thumbnail.size[1]
+    return abs(image_ratio-thumbnail_ratio)/image_ratio < 0.02
+
+def resize_to_width(img, width):
+    orig_width, orig_height = img.size
+    target_height = int(orig_height*(width/orig_width))
+    return img.resize((width, target_height))
+
+def load_image_thumbnail(file_path, thumb_size):
+    try:
+        img = Image.open(file_path)
+
+        # Opening only reads the header, so this is the point to skip decoding the main image
+        try:
+            embedded_thumbnail = get_embedded_thumbnail(img)
+        except Exception:
+            embedded_thumbnail = None
+        if embedded_thumbnail_usable(embedded_thumbnail, img.size, thumb_size):
+            return resize_to_width(embedded_thumbnail.convert("RGB"), thumb_size[0])
+
+        # Let the JPEG decoder do the bulk of the downscaling with its DCT scaling (1/2, 1/4 or 1/8). It
+        # picks the smallest scale that is still at least as big as the requested size
+        orig_width, orig_height = img.size
+        img.draft("RGB", (thumb_size[0], int(orig_height*(thumb_size[0]/orig_width))))
+        return resize_to_width(img.convert("RGB"), thumb_size[0])
+    except Exception:
+        pass
+
+    # Fall back to a plain full decode
+    img = Image.open(file_path).convert("RGB")
+    return resize_to_width(img, thumb_size[0])
@@ -1,131 +1,144 @@
 import gnss_track_helpers
 import constants
-import tkinter as tk
 from PIL import Image, ImageTk
-import mpv
 from datetime import datetime
-from exiftool import ExifToolHelper
 from datetime import timezone
 import os
-import time
+import io
 
 import icons
+import thumbnail_cache
+import tile_provider
+import exiftool_service
+import image_loading
+import video_frames
 
-class Item(tk.Frame):
+# Items are plain objects, the ItemGrid draws the visible ones on its canvas. draw_callback gets called
+# whenever something that's shown about the item changes
+class Item:
     last_selected = None
     mouse_action = 1
+    placeholder_photos = {}
 
-    def __init__(self, root, item_data, selected_items, input_data, input_data_source_index, thumb_size, bg_color, select_color, enter_callback, leave_callback, full_screen_callback, shift_select_callback, select_all_callback, preloaded_image=None, preloaded_epoch=-1, **kwargs):
-        super().__init__(root, **kwargs)
-
+    def __init__(self, item_data, selected_items, thumb_size, draw_callback, shift_select_callback, preloaded_image=None, preloaded_epoch=-1):
         self.selected_items = selected_items
         self.dragged_over = set()
-        self.bg_color = bg_color
-        self.select_color = select_color
         self.file_path = item_data[0]["file_path"]
+        self.item_type = item_data[0]["item_type"]
         self.source_properties = item_data[1]
-        self.full_screen_callback = full_screen_callback
+        self.draw_callback = draw_callback
         self.shift_select_callback = shift_select_callback
-        self.select_all_callback = select_all_callback
         self.create_epoch = preloaded_epoch
-        self.icon_check_label = None
+        self.linked = False
+        self.caption = os.path.basename(self.file_path)
+        self.thumb_size = thumb_size
 
+        # Items without a thumbnail yet all share one placeholder image. Only the items around the visible
+        # ones keep their thumbnail decoded, see release_thumbnail
+        self.thumbnail = preloaded_image
+        self.thumbnail_in_cache = False
+        self.compressed_thumbnail = None
+        # Only items that are on screen hold a PhotoImage and a cell, the grid creates and releases them
+        self.photo_obj = None
+        self.cell = None
 
-        if preloaded_image:
-            self.photo_obj = ImageTk.PhotoImage(preloaded_image)
-        else:
-            img = Image.new("RGB", thumb_size, (60, 60, 60))
-            self.photo_obj = ImageTk.PhotoImage(img)
+    def get_photo(self):
+        if self.photo_obj == None:
+            thumbnail = self.get_thumbnail()
+            if thumbnail != None:
+                self.photo_obj = ImageTk.PhotoImage(thumbnail)
+            else:
+                self.photo_obj = Item.get_placeholder_photo(self.thumb_size)
+        return self.photo_obj
 
+    # Returns None if the thumbnail isn't loaded or was released to the thumbnail cache
+    def get_thumbnail(self):
+        if self.thumbnail == None and self.compressed_thumbnail != None:
+            return Image.open(io.BytesIO(self.compressed_thumbnail))
+        return self.thumbnail
 
-        self.image = tk.Label(self, image=self.photo_obj, borderwidth=0)
-        self.image.pack()
-        self.icons = tk.Frame(self)
-        self.icons.pack(fill=tk.X)
-        self.caption = tk.Label(self, text=os.path.basename(self.file_path), wraplength=thumb_size[0], borderwidth=0)
-        self.caption.pack()
+    @staticmethod
+    def get_placeholder_photo(thumb_size):
+        if thumb_size not in Item.placeholder_photos:
+            Item.placeholder_photos[thumb_size] = ImageTk.PhotoImage(Image.new("RGB", thumb_size, (60, 60, 60)))
+        return Item.placeholder_photos[thumb_size]
 
-        self.icon_size=(thumb_size[0]/8, thumb_size[1]/8)
+    # in_cache tells if the thumbnail can be loaded from the thumbnail cache again once it's released
+    def set_thumbnail(self, img, in_cache=False):
+        self.thumbnail = img
+        self.thumbnail_in_cache = in_cache
+        self.compressed_thumbnail = None
+        self.photo_obj = None
+        self.draw_callback(self)
 
-        if item_data[0]["item_type"] == "video":
-            icon = icons.gen_video_icon(self.icon_size)
-        elif item_data[0]["item_type"] == "image":
-            icon = icons.gen_image_icon(self.icon_size)
-        elif item_data[0]["item_type"] == "gnss-track":
-            icon = icons.gen_gnss_icon(self.icon_size)
-        else:
-            icon = icons.gen_unknown_icon(self.icon_size)
-
-        self.icon_photo_obj = ImageTk.PhotoImage(icon)
-        self.icon_label = tk.Label(self.icons, image=self.icon_photo_obj)
-        self.icon_label.pack(side=tk.LEFT)
-
-        for i in (self.image, self.icons, self.caption, self.icon_label, self):
-            i.bind("<Button-1>", self.on_click)
-            i.bind("<B1-Motion>", self.on_drag)
-            i.bind("<Enter>", enter_callback)
-            i.bind("<Leave>", leave_callback)
-            i.bind("<Key>", self.key_callback)
-
-        if self.source_properties == constants.source_properties.read_only:
-            to_color_list = [self.image, self.caption, self.icons, self.icon_label, self]
-            if self.icon_check_label != None:
-                to_color_list.append(self.icon_check_label)
-            for i in to_color_list:
-                i.config(bg='#404040')
-            self.caption.config(fg='lightgrey')
-
-        if self.create_epoch == -1:
-            tk.messagebox.showinfo("Error",(f"Warning: No create date could be found for file {self.file_path}"))
+    # Frees the decoded thumbnail, the grid calls this for items far from the visible ones. Thumbnails that
+    # are in the thumbnail cache are dropped and True is returned, the grid loads them again when they come
+    # close. The others are kept as JPEG, that's a tenth of the size
+    def release_thumbnail(self):
+        if self.thumbnail == None:
+            return False
+        if self.thumbnail_in_cache:
+            self.thumbnail = None
+            return True
+        buffer = io.BytesIO()
+        self.thumbnail.save(buffer, format="JPEG", quality=90)
+        self.compressed_thumbnail = buffer.getvalue()
+        self.thumbnail = None
+        return False
 
+    def release_photo(self):
+        self.photo_obj = None
+
+    def is_selected(self):
+        return self.file_path in self.selected_items
+
+    # Runs in a worker process. The thumbnail is sent back as raw RGB bytes, that's much cheaper to
+    # pickle than a PIL object. Cached thumbnails are looked up here too, so cache hits are scheduled like
+    # any other job and don't hold up the items on screen. The last value tells if the thumbnail is in the
+    # cache, so the grid can drop it and load it again later
     @staticmethod
-    def preload_media_data(queue_ref, item_data, thumb_size, input_data):
+    def preload_media_data(item_data, thumb_size, input_data, create_epoch=-1):
 
         file_path = item_data[0]["file_path"]
 
-        create_epoch = -1
+        cacheable = True
+        error_message = None
 
-        if "metadata_file" in item_data[0]:
-            exif_path = item_data[0]["metadata_file"]
-        else:
-            exif_path = file_path
+        exif_path = Item.get_exif_path(item_data)
 
         if not file_path or not os.path.exists(file_path):
             raise FileNotFoundError("File not found for item")
 
+        cache = thumbnail_cache.open_cache(input_data)
+        cache_key = None
+        if cache != None:
+            try:
+                cache_key = cache.make_key(item_data, thumb_size, input_data)
+            except OSError:
+                pass
+            else:
+                cached = cache.get(cache_key)
+                if cached != None:
+                    img = cached[0].convert("RGB")
+                    return item_data, (img.size, img.tobytes()), cached[1], None, True
+
         #Create thumbnail image
         if item_data[0]["file_type"] in ["image-preview", "image"]:
             try:
-                img = Image.open(file_path).convert("RGB")
-                orig_width, orig_height = img.size
-                target_height = int(orig_height*(thumb_size[0]/orig_width))
-                img = img.resize((thumb_size[0], target_height))
+                img = image_loading.load_image_thumbnail(file_path, thumb_size)
             except Exception:
                 img = icons.gen_corrupted_file_icon(thumb_size)
 
         elif item_data[0]["file_type"] == "video":
-            player = mpv.MPV(vo='null', ao='null')
-            player.pause = True
-            player.play(file_path)
-            start_time = datetime.now()
-            while True:
-                if (datetime.now() - start_time).total_seconds() > 15:
-                    #Timeout
-                    img = icons.gen_corrupted_file_icon(thumb_size)
-                    messagebox.showinfo("Error", f"ERROR: Timed out loading video '{file_path}'. It might be corrupt")
-                    break
-                try:
-                    img = player.screenshot_raw()
-                    break;
-                except Exception:
-                    time.sleep(0.2)
-            player.command('quit')
-            del player
-            orig_width, orig_height = img.size
-            target_height = int(orig_height*(thumb_size[0]/orig_width))
-            img = img.resize((thumb_size[0], target_height))
+            try:
+                img = video_frames.get_extractor().extract(file_path)
+                img = image_loading.resize_to_width(img, thumb_size[0])
+            except video_frames.VideoFrameTimeout:
+                img = icons.gen_corrupted_file_icon(thumb_size)
+                cacheable = False
+                error_message = f"ERROR: Timed out loading video '{file_path}'. It might be corrupt"
         elif item_data[0]["file_type"] == "gnss-track":
-            img, create_epoch = gnss_track_helpers.gnss_thumbnail_and_timestamp(file_path, force_offline=input_data["force_offline"], map_database=input_data["map_database"])
+            img, create_epoch = gnss_track_helpers.gnss_thumbnail_and_timestamp(file_path, tile_provider.open_provider(input_data))
             orig_width, orig_height = img.size
             target_height = int(orig_height*(thumb_size[0]/orig_width))
             img = img.resize((thumb_size[0], target_height))
@@ -134,67 +147,97 @@ class Item(tk.Frame):
 
         #Try to get epoch with PIL
         if create_epoch == -1:
-            try:
-                pil_img = Image.open(exif_path)
-                exif_data = pil_img._getexif()
-                if exif_data:
-                    # 36867 is DateTimeOriginal, 306 is DateTime
-                    date_str = exif_data.get(36867) or exif_data.get(306)
-                    if date_str:
-                        dt = datetime.strptime(date_str, '%Y:%m:%d %H:%M:%S')
-                        create_epoch = int(dt.replace(tzinfo=timezone.utc).timestamp())
-            except Exception:
-                pass
+            create_epoch = Item.read_pil_create_epoch(exif_path)
 
         #Try to get epoch with exiftool
         if create_epoch == -1:
             try:
-                with ExifToolHelper() as et:
-                    metadata = et.get_metadata(exif_path)
-                    for d in metadata:
-                        for key, value in d.items():
-                            match key:
-                                case "EXIF:CreateDate"|"QuickTime:CreateDate": #TODO add subseconds
-                                    create_date_notz = datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
-                                    create_date = create_date_notz.replace(tzinfo=timezone.utc)
-                                    create_epoch = int(create_date.timestamp())
+                create_epoch = exiftool_service.get_service().get_create_epochs([exif_path])[0]
             except Exception:
                 pass
 
-        queue_ref.put((item_data, img, create_epoch))
+        in_cache = False
+        if cache_key != None and cacheable:
+            in_cache = cache.put(cache_key, img, create_epoch)
+
+        img = img.convert("RGB")
+        return item_data, (img.size, img.tobytes()), create_epoch, error_message, in_cache
+
+    @staticmethod
+    def get_exif_path(item_data):
+        if "metadata_file" in item_data[0]:
+            return item_data[0]["metadata_file"]
+        return item_data[0]["file_path"]
 
-    def key_callback(self, event):
-        if event.char == '\r' :
-            self.full_screen_callback(self.file_path)
-        if event.state & constants.TK_CONTROL_MASK and event.keysym == 'a':
-            self.select_all_callback()
+    # Opening an image with PIL only reads its header, so this doesn't decode anything
+    @staticmethod
+    def read_pil_create_epoch(exif_path):
+        try:
+            pil_img = Image.open(exif_path)
+            exif_data = pil_img._getexif()
+            if exif_data:
+                # 36867 is DateTimeOriginal, 306 is DateTime
+                date_str = exif_data.get(36867) or exif_data.get(306)
+                if date_str:
+                    dt = datetime.strptime(date_str, '%Y:%m:%d %H:%M:%S')
+                    return int(dt.replace(tzinfo=timezone.utc).timestamp())
+        except Exception:
+            pass
+        return -1
+
+    # Runs in a worker process. Only reads what's needed to find the create dates: image headers with PIL,
+    # the first point of tracks and one exiftool call for everything else (videos, RAW files and images
+    # PIL couldn't read a date from)
+    @staticmethod
+    def read_create_epochs(item_data_list):
+        create_epochs = [-1]*len(item_data_list)
+        exiftool_indices = []
+
+        for index, item_data in enumerate(item_data_list):
+            file_type = item_data[0]["file_type"]
+            if file_type == "gnss-track":
+                try:
+                    create_epochs[index] = gnss_track_helpers.get_gpx_start_epoch(item_data[0]["file_path"])
+                except Exception:
+                    pass
+                continue
+            if file_type in ["image-preview", "image"]:
+                create_epochs[index] = Item.read_pil_create_epoch(Item.get_exif_path(item_data))
+            if create_epochs[index] == -1:
+                exiftool_indices.append(index)
+
+        if exiftool_indices:
+            try:
+                exiftool_epochs = exiftool_service.get_service().get_create_epochs([Item.get_exif_path(item_data_list[i]) for i in exiftool_indices])
+            except Exception:
+                exiftool_epochs = [-1]*len(exiftool_indices)
+            for index, create_epoch in zip(exiftool_indices, exiftool_epochs):
+                create_epochs[index] = create_epoch
+
+        return create_epochs
+
+    @staticmethod
+    def unpack_preloaded_image(image_data):
+        size, raw_bytes = image_data
+        return Image.frombytes("RGB", size, raw_bytes)
 
     def deselect(self):
         if self.source_properties != constants.source_properties.read_only:
-            to_color_list = [self.image, self.caption, self.icons, self.icon_label, self]
-            if self.icon_check_label != None:
-                to_color_list.append(self.icon_check_label)
-            for i in to_color_list:
-                i.config(bg=self.bg_color)
             if self.file_path in self.selected_items:
                 self.selected_items.remove(self.file_path)
+                self.draw_callback(self)
 
     def select(self):
         if self.source_properties != constants.source_properties.read_only:
-            to_color_list = [self.image, self.caption, self.icons, self.icon_label, self]
-            if self.icon_check_label != None:
-                to_color_list.append(self.icon_check_label)
-            for i in to_color_list:
-                i.config(bg=self.select_color)
-            self.selected_items.add(self.file_path)
+            if self.file_path not in self.selected_items:
+                self.selected_items.add(self.file_path)
+                self.draw_callback(self)
 
     def add_checkmark(self):
-        checkmark_icon = icons.gen_checkmark_icon(self.icon_size)
-        self.icon_check_obj = ImageTk.PhotoImage(checkmark_icon)
-        self.icon_check_label = tk.Label(self.icons, image=self.icon_check_obj)
-        self.icon_check_label.pack(side=tk.LEFT)
+        self.linked = True
+        self.draw_callback(self)
 
-    def on_click(self, event):
+    def on_click(self, shift_pressed):
         self.dragged_over.clear()
         if self.file_path in self.selected_items:
             self.deselect()
@@ -203,22 +246,17 @@ class Item(tk.Frame):
             self.select()
             Item.mouse_action = 1
         self.dragged_over.add(self)
-        if event.state & constants.TK_SHIFT_MASK and Item.last_selected != None:
+        if shift_pressed and Item.last_selected != None:
             self.shift_select_callback(Item.last_selected, self, Item.mouse_action)
         Item.last_selected = self
 
     def get_file_path(self):
         return self.file_path
 
-    def on_drag(self, event):
-        widget = event.widget.winfo_containing(event.x_root, event.y_root)
-        if widget is None:
-            return
-        while widget and not isinstance(widget, Item):
-            widget = widget.master
-        if isinstance(widget, Item) and widget not in self.dragged_over:
+    def on_drag(self, item):
+        if item not in self.dragged_over:
             if Item.mouse_action == 1:
-                widget.select()
+                item.select()
             else:
-                widget.deselect()
-            self.dragged_over.add(widget)
+                item.deselect()
+            self.dragged_over.add(item)
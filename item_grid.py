@@ -1,241 +1,687 @@
 import tkinter as tk
+import tkinter.font
 import concurrent.futures
+import multiprocessing
 import queue
+import threading
+import os
+import time
+import sys
+import collections
+import heapq
 import random
 
 import item
+import icons
+import thumbnail_cache
+import constants
+import geotag
+import tile_provider
+
+CAPTION_LINES = 2
+READ_ONLY_BG_COLOR = '#404040'
+READ_ONLY_FG_COLOR = 'lightgrey'
+SELECT_COLOR = "#5293fa"
+# Rows drawn above and below the visible area so short scrolls don't show empty cells
+OVERSCAN_ROWS = 1
+# Layout changes are collected and applied at most once per this many milliseconds
+LAYOUT_FRAME_INTERVAL = 16
+# Resizing only re-lays out the grid after the window stopped changing size for this long
+RESIZE_DEBOUNCE_INTERVAL = 50
+LAYOUT_TIME_HISTORY = 1000
+# Time spent creating items per consumer tick, what's left in the queue waits for the next tick so input
+# events get handled in between
+CONSUMER_TIME_BUDGET = 0.008
+CONSUMER_TICK_INTERVAL = 16
+# Items per worker job when reading create dates, exiftool gets all the files of a job in one call
+EPOCH_BATCH_SIZE = 64
+# Thumbnail jobs handed to the pool per worker. Only these few are committed to, everything else waits in
+# the priority queue so scrolling can change what gets loaded next
+JOBS_PER_WORKER = 2
+# Rows above and below the visible ones that get loaded before the rest of the timeline
+PREFETCH_ROWS = 10
+# Paths the dialog about items without a create date lists, the rest are only counted
+UNDATED_ITEMS_LISTED = 20
+# Job priorities, lower goes first. Visible and prefetch entries are only valid for the viewport they were
+# queued for, every item also has a timeline entry that never goes stale
+PRIORITY_VISIBLE = 0
+PRIORITY_PREFETCH = 1
+PRIORITY_TIMELINE = 2
+
+# A recycled set of canvas items that shows one grid item
+class GridCell:
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.item = None
+        self.placed_at = None # (index, items per row) the canvas items were last moved for
+        self.background = canvas.create_rectangle(0, 0, 0, 0, width=0)
+        self.image = canvas.create_image(0, 0, anchor='nw')
+        self.type_icon = canvas.create_image(0, 0, anchor='nw')
+        self.check_icon = canvas.create_image(0, 0, anchor='nw')
+        self.caption = canvas.create_text(0, 0, anchor='n', justify='center')
+
+    def hide(self):
+        self.placed_at = None
+        for i in (self.background, self.image, self.type_icon, self.check_icon, self.caption):
+            self.canvas.itemconfigure(i, state='hidden')
 
 class ItemGrid(tk.Frame):
-    def __init__(self, root, thumb_size, item_border_size, item_padding, selected_items, input_data, full_screen_callback, select_all_callback, update_progress_bar_callback, load_interface_data, tk_root, profile_save_filename, thread_count):
+    def __init__(self, root, thumb_size, item_border_size, item_padding, selected_items, input_data, full_screen_callback, select_all_callback, update_progress_bar_callback, stream_thumbnail_list, tk_root, profile_save_filename, thread_count):
         super().__init__(root)
 
         self.thumb_size = thumb_size
         self.item_border_size = item_border_size
         self.item_padding = item_padding
-        self.last_items_per_row = 0
-        self.last_item_count = 0
-        self.dragged_over = set()
         self.items = []
         self.selected_items = selected_items
         self.input_data = input_data
         self.full_screen_callback = full_screen_callback
         self.select_all_callback = select_all_callback
         self.update_progress_bar_callback = update_progress_bar_callback
+        self.stream_thumbnail_list = stream_thumbnail_list
         self.profile_save_filename = profile_save_filename
         self.tk_root = tk_root
         self.linked_count = 0
-
-        self.rows_per_page = 100 # TODO caluclaute based on item icon size and maximum drawabale area
-        self.total_page_count = 1
-        self.current_page = 1
-
-        # --- Paging Control Frame ---
-        self.control_frame = tk.Frame(self)
-
-        self.prev_button = tk.Button(self.control_frame, text="< Previous", command=lambda: self.switch_page(-1), state=tk.DISABLED)
-        self.prev_button.pack(side="left", padx=5)
-
-        self.page_label = tk.Label(self.control_frame)
-        self.update_page_text()
-        self.page_label.pack(side="left", padx=10)
-
-        self.next_button = tk.Button(self.control_frame, text="Next >", command=lambda: self.switch_page(1), state=tk.DISABLED)
-        self.next_button.pack(side="left", padx=5)
-        # ----------------------------
+        self.linked_files = set()
+        self.bg_color = self.cget('bg')
+        self.hovered_item = None
+
+        self.icon_size = (int(thumb_size[0]/8), int(thumb_size[1]/8))
+        # Render every icon once up front, drawing cells afterwards only reuses the shared PhotoImages
+        icons.set_grid_icon_size(self.icon_size)
+
+        font = tkinter.font.nametofont("TkDefaultFont")
+        self.caption_height = font.metrics("linespace")*CAPTION_LINES
+        self.cell_width = thumb_size[0] + item_border_size*2 + item_padding*2
+        self.cell_height = thumb_size[1] + self.icon_size[1] + self.caption_height + item_border_size*2 + item_padding*2
+        self.items_per_row = 1
+        self.last_scrollregion = None
+        self.layout_pending = False
+        self.layout_rebind_all = False
+        self.resize_after_id = None
+        self.pending_canvas_width = None
+        self.layout_times = collections.deque(maxlen=LAYOUT_TIME_HISTORY)
+
+        # Cells are only created for the rows on screen and get reused for other items when scrolling
+        self.cells = {}
+        self.free_cells = []
 
         # -------- Grid Frame --------
-        self.canvas = tk.Canvas(self, highlightthickness=0)
+        self.canvas = tk.Canvas(self, highlightthickness=0, yscrollincrement=20)
         self.scrollbar = tk.Scrollbar(self, orient="vertical", command=self.canvas.yview)
-        self.item_grid = tk.Frame(self.canvas)
-        self.canvas_window = self.canvas.create_window((0, 0), window=self.item_grid, anchor="nw")
 
-        self.canvas.configure(yscrollcommand=self.scrollbar.set)
-        self.canvas.grid   (row=1, column=0, sticky='nswe')
-        self.scrollbar.grid(row=0, column=1, sticky='nse', rowspan=2)
-        self.grid_rowconfigure(1, weight=1)
+        self.canvas.configure(yscrollcommand=self.on_canvas_scroll)
+        self.canvas.grid   (row=0, column=0, sticky='nswe')
+        self.scrollbar.grid(row=0, column=1, sticky='ns')
+        self.grid_rowconfigure(0, weight=1)
         self.grid_columnconfigure(0, weight=1)
         # ----------------------------
 
-        self.item_grid.bind("<Configure>", lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
-        self.canvas.bind("<Configure>", lambda x: self.canvas.after_idle(self.update_item_layout))
-
-        for i in (self.canvas, self.item_grid):
-            i.bind("<Enter>", self.bind_grid_scroll)
-            i.bind("<Leave>", self.unbind_grid_scroll)
-            i.bind("<Control-a>", self.select_all_callback)
-            i.bind("<Control-A>", self.select_all_callback)
+        self.canvas.bind("<Configure>", self.on_canvas_resize)
+        self.canvas.bind("<Enter>", lambda event: self.canvas.focus_set())
+        self.canvas.bind("<Motion>", self.on_motion)
+        self.canvas.bind("<Leave>", lambda event: self.set_hovered_item(None))
+        self.canvas.bind("<Button-1>", self.on_click)
+        self.canvas.bind("<B1-Motion>", self.on_drag)
+        self.canvas.bind("<Button-4>", self.scroll_steps)
+        self.canvas.bind("<Button-5>", self.scroll_steps)
+        self.canvas.bind("<MouseWheel>", self.scroll_steps)
+        self.canvas.bind("<Return>", self.on_return)
+        self.canvas.bind("<Control-a>", self.select_all_callback)
+        self.canvas.bind("<Control-A>", self.select_all_callback)
 
         self.result_queue = queue.Queue()
-        self.processing_threads_pool = concurrent.futures.ThreadPoolExecutor(max_workers=thread_count)
+        self.thumbnail_cache = thumbnail_cache.open_cache(self.input_data)
+        # Decoding and resizing is CPU bound, threads would just be waiting on the GIL. Spawn instead of
+        # forking so the workers don't inherit the Tk/X11 state of this process. The workers fetch the map
+        # tiles of the track thumbnails, they share one connection limit with the maps of this process
+        mp_context = multiprocessing.get_context("spawn")
+        fetch_limit = tile_provider.share_fetch_limit(mp_context)
+        self.processing_pool = concurrent.futures.ProcessPoolExecutor(max_workers=thread_count, mp_context=mp_context, initializer=tile_provider.set_fetch_limit, initargs=(fetch_limit,))
 
         if self.profile_save_filename != None:
             import cProfile
             self.profiler = cProfile.Profile()
             self.profiler.enable()
 
-        self.item_list = []
+        # Filled by the listing threads while the sources are read
+        self.listing_errors = queue.Queue()
+        self.sources_left_to_list = len(self.input_data["sources"])
+        self.sources_left_to_list_lock = threading.Lock()
+        # Counted by the listing threads under sources_left_to_list_lock, the progress bar follows them until
+        # the timeline is shown
+        self.items_listed = 0
+        self.items_dated = 0
+        # Every source's items sorted by create date, they get merged into the timeline once all are listed
+        self.source_timelines = [[] for i in self.input_data["sources"]]
+        # (create_epoch, item_data) for every slot of the grid, set by the last listing thread
+        self.timeline = None
+        self.timeline_shown = False
+        self.thumbnails_loaded = 0
+        # file path -> (lat, lon) for items positioned by the tracks recorded at the same time
+        self.track_positions = {}
+        self.track_positions_future = None
+
+        # Thumbnail job scheduling, only touched on the Tk thread
+        self.max_jobs_in_flight = thread_count*JOBS_PER_WORKER
+        self.job_heap = []         # (priority, distance, slot, viewport generation)
+        self.load_order = None     # Distance of the timeline entry of every slot, see show_timeline
+        self.jobs_in_flight = {}   # slot -> future
+        self.slot_submitted = None # bytearray, 1 for every slot that's submitted or done
+        self.slot_loaded = None    # bytearray, 1 for every slot whose thumbnail arrived at least once
+        # Only the items in this slot range keep their thumbnail decoded, memory doesn't grow with the
+        # number of items
+        self.resident_range = (0, 0)
+        self.resident_slots = set()
+        self.viewport_generation = 0
+        self.prioritized_range = None
+
+        # Worker threads write a byte into this pipe after queueing a result, Tk watches the other end and
+        # runs the consumer. That way nothing polls while there's no work
+        self.wakeup_read_fd, self.wakeup_write_fd = os.pipe()
+        os.set_blocking(self.wakeup_read_fd, False)
+        os.set_blocking(self.wakeup_write_fd, False)
+        self.tk.createfilehandler(self.wakeup_read_fd, tk.READABLE, self.on_wakeup)
+        self.consumer_scheduled = False
+        self.loading_done = False
+
+    # Loading happens in two passes. First every source is listed on its own thread and only the create
+    # dates get read, that's just headers and it's cached. Once all sources are done their sorted lists are
+    # merged into the timeline and the grid gets a slot for every item in its final place. The thumbnails
+    # are decoded afterwards and fill those slots, so nothing moves around while loading
+    def start_loading(self):
+        listing_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(self.input_data["sources"])))
         for index, data in enumerate(self.input_data["sources"]):
-            interface_data = load_interface_data(self.input_data, index, 'list-thumbnails')
-            for item in interface_data["file_list"]:
-                self.item_list.append((item, data[1]))
-        random.shuffle(self.item_list)
-
-        self.after(0, self.check_queue)
-
-    def update_page_button_state(self):
-        if len(self.items) == len(self.item_list):
-            if self.current_page == 1 :
-                self.prev_button.config(state=tk.DISABLED)
-            else:
-                self.prev_button.config(state=tk.NORMAL)
-
-            if self.current_page == self.total_page_count:
-                self.next_button.config(state=tk.DISABLED)
-            else:
-                self.next_button.config(state=tk.NORMAL)
-
-    def switch_page(self, num):
-        self.current_page += num
-        self.update_page_button_state()
-        self.update_item_layout( force_regrid=True )
-        self.canvas.yview_moveto(0)
-        self.update_page_text()
+            listing_pool.submit(self.list_source, index, data[1])
+        listing_pool.shutdown(wait=False)
 
-    def start_loading(self):
-        for item_data in self.item_list:
-            self.processing_threads_pool.submit(item.Item.preload_media_data, self.result_queue, item_data, self.thumb_size, self.input_data)
+    # Runs on a listing thread
+    def list_source(self, source_number, source_properties):
+        timeline = []
+        try:
+            self.read_source_create_epochs(source_number, source_properties, timeline)
+        except Exception as error:
+            self.listing_errors.put(f"ERROR: Couldn't list source '{self.input_data['sources'][source_number][0]}': {error}")
+        finally:
+            # Sorting is stable, items with the same date keep the order the interface listed them in
+            timeline.sort(key=lambda entry: entry[0])
+            with self.sources_left_to_list_lock:
+                self.source_timelines[source_number] = timeline
+                self.sources_left_to_list -= 1
+                last_source = self.sources_left_to_list == 0
+            if last_source:
+                self.build_timeline()
+            self.wake_consumer()
+
+    # Appends (create_epoch, item_data) for every item of the source to timeline. Dates that aren't cached
+    # get read in batches on the worker processes while the interface is still listing
+    def read_source_create_epochs(self, source_number, source_properties, timeline):
+        batches = []
+        batch = []
+        for entry in self.stream_thumbnail_list(self.input_data, source_number):
+            item_data = (entry, source_properties)
+            create_epoch = self.get_cached_create_epoch(item_data)
+            if create_epoch != None:
+                timeline.append((create_epoch, item_data))
+                self.count_listing_progress(1, 1)
+                continue
+            batch.append(item_data)
+            self.count_listing_progress(1, 0)
+            if len(batch) == EPOCH_BATCH_SIZE:
+                batches.append((batch, self.processing_pool.submit(item.Item.read_create_epochs, batch)))
+                batch = []
+        if batch:
+            batches.append((batch, self.processing_pool.submit(item.Item.read_create_epochs, batch)))
+
+        for batch, future in batches:
+            try:
+                create_epochs = future.result()
+            except Exception:
+                create_epochs = [-1]*len(batch) # Loading the thumbnail reports what's wrong with the file
+            timeline += zip(create_epochs, batch)
+            self.store_create_epochs(batch, create_epochs)
+            self.count_listing_progress(0, len(batch))
+
+    # Runs on a listing thread. The consumer is woken about once per batch worth of progress, that's often
+    # enough for the progress bar
+    def count_listing_progress(self, listed, dated):
+        with self.sources_left_to_list_lock:
+            counted_before = self.items_listed + self.items_dated
+            self.items_listed += listed
+            self.items_dated += dated
+            wake = counted_before//EPOCH_BATCH_SIZE != (counted_before + listed + dated)//EPOCH_BATCH_SIZE
+        if wake:
+            self.wake_consumer()
+
+    # The first half of the bar is reading the create dates, the second half loading the thumbnails
+    def update_progress_bar(self):
+        if self.timeline_shown:
+            self.update_progress_bar_callback(len(self.items) + self.thumbnails_loaded, len(self.items)*2, False)
+        else:
+            with self.sources_left_to_list_lock:
+                items_dated, items_listed = self.items_dated, self.items_listed
+            self.update_progress_bar_callback(items_dated, items_listed*2, False)
 
-    def check_queue(self):
+    def get_cached_create_epoch(self, item_data):
+        if self.thumbnail_cache == None:
+            return None
         try:
-            while not self.result_queue.empty():
-                result = self.result_queue.get_nowait()
-                self.add_item(result)
-        except queue.Empty:
+            return self.thumbnail_cache.get_create_epoch(self.thumbnail_cache.make_epoch_key(item_data))
+        except OSError:
+            return None
+
+    def store_create_epochs(self, item_data_list, create_epochs):
+        if self.thumbnail_cache == None:
+            return
+        entries = []
+        for item_data, create_epoch in zip(item_data_list, create_epochs):
+            if create_epoch == -1:
+                continue # Could be a file that's still being written, try again next time
+            try:
+                entries.append((self.thumbnail_cache.make_epoch_key(item_data), create_epoch))
+            except OSError:
+                pass
+        self.thumbnail_cache.put_create_epochs(entries)
+
+    # Runs on the listing thread that finished last. Every source is already sorted, so merging them keeps
+    # the timeline sorted without sorting everything again
+    def build_timeline(self):
+        self.timeline = list(heapq.merge(*self.source_timelines, key=lambda entry: entry[0]))
+        # The tracks get parsed for this, so it runs in a worker process and doesn't hold up the grid. The
+        # consumer picks up the positions once it's done
+        self.track_positions_future = self.processing_pool.submit(geotag.geotag_timeline, self.timeline, self.input_data["camera_clock_offset"])
+        self.track_positions_future.add_done_callback(lambda future: self.wake_consumer())
+
+    def apply_track_positions(self):
+        future = self.track_positions_future
+        self.track_positions_future = None
+        try:
+            self.track_positions = future.result()
+        except concurrent.futures.CancelledError:
+            return
+        except Exception as error:
+            tk.messagebox.showinfo("Error", f"ERROR: Couldn't place the items on the tracks: {error}")
+
+    # Returns (lat, lon) or None
+    def get_track_position(self, file_path):
+        return self.track_positions.get(file_path)
+
+    # Called whenever the visible range changes. The visible items go first, then the ones right around
+    # them. Queued entries of the previous viewport go stale and jobs that haven't started yet for items
+    # that are now far off screen go back into the queue
+    def update_job_priorities(self, first, last):
+        if self.slot_submitted == None or (first, last) == self.prioritized_range:
+            return
+        self.prioritized_range = (first, last)
+        self.viewport_generation += 1
+
+        prefetch_first = max(0, first - PREFETCH_ROWS*self.items_per_row)
+        prefetch_last = min(len(self.items), last + PREFETCH_ROWS*self.items_per_row)
+
+        self.resident_range = (prefetch_first, prefetch_last)
+        for slot in list(self.resident_slots):
+            if slot < prefetch_first or slot >= prefetch_last:
+                self.release_thumbnail(slot)
+
+        for slot, future in list(self.jobs_in_flight.items()):
+            if (slot < prefetch_first or slot >= prefetch_last) and future.cancel():
+                del self.jobs_in_flight[slot]
+                self.slot_submitted[slot] = 0
+                heapq.heappush(self.job_heap, (PRIORITY_TIMELINE, self.load_order[slot], slot, 0))
+
+        for slot in range(prefetch_first, prefetch_last):
+            if not self.slot_submitted[slot]:
+                if first <= slot < last:
+                    entry = (PRIORITY_VISIBLE, slot - first, slot, self.viewport_generation)
+                else:
+                    entry = (PRIORITY_PREFETCH, max(first - slot, slot - last), slot, self.viewport_generation)
+                heapq.heappush(self.job_heap, entry)
+
+        self.dispatch_jobs()
+
+    # Released thumbnails that are in the thumbnail cache get loaded again from there once they come close
+    # to the visible items, the visible and prefetch entries take care of that
+    def release_thumbnail(self, slot):
+        self.resident_slots.discard(slot)
+        if self.items[slot].release_thumbnail():
+            self.slot_submitted[slot] = 0
+
+    def dispatch_jobs(self):
+        while len(self.jobs_in_flight) < self.max_jobs_in_flight and self.job_heap:
+            priority, distance, slot, generation = heapq.heappop(self.job_heap)
+            if self.slot_submitted[slot]:
+                continue
+            if priority != PRIORITY_TIMELINE and generation != self.viewport_generation:
+                continue
+            self.submit_job(slot)
+
+    def submit_job(self, slot):
+        create_epoch, item_data = self.timeline[slot]
+        self.slot_submitted[slot] = 1
+        future = self.processing_pool.submit(item.Item.preload_media_data, item_data, self.thumb_size, self.input_data, create_epoch)
+        self.jobs_in_flight[slot] = future
+        future.add_done_callback(lambda future, slot=slot, item_data=item_data: self.queue_preloaded_result(future, slot, item_data))
+
+    def loading_finished(self):
+        return self.timeline_shown and self.thumbnails_loaded == len(self.items)
+
+    # Called from the executor's management thread, so it must not touch any Tk objects
+    def queue_preloaded_result(self, future, slot, item_data):
+        try:
+            item_data, image_data, create_epoch, error_message, in_cache = future.result()
+            img = item.Item.unpack_preloaded_image(image_data)
+        except concurrent.futures.CancelledError:
+            return
+        except Exception as error:
+            img = icons.gen_corrupted_file_icon(self.thumb_size)
+            error_message = f"ERROR: Couldn't load '{item_data[0]['file_path']}': {error}"
+            in_cache = False
+        self.post_result((slot, img, error_message, in_cache))
+
+    # Can be called from any thread
+    def post_result(self, result):
+        self.result_queue.put(result)
+        self.wake_consumer()
+
+    # Can be called from any thread
+    def wake_consumer(self):
+        try:
+            os.write(self.wakeup_write_fd, b"\0")
+        except BlockingIOError:
+            pass # The pipe is full of wakeups the consumer hasn't read yet, one more doesn't change anything
+
+    def on_wakeup(self, fd, mask):
+        try:
+            while os.read(fd, 4096):
+                pass
+        except BlockingIOError:
             pass
+        self.schedule_consumer(0)
+
+    def schedule_consumer(self, delay):
+        if not self.consumer_scheduled:
+            self.consumer_scheduled = True
+            self.after(delay, self.check_queue)
 
-        if len(self.items) != len(self.item_list):
-            self.after(1, self.check_queue)
+    def show_listing_errors(self):
+        while not self.listing_errors.empty():
+            tk.messagebox.showinfo("Error", self.listing_errors.get_nowait())
+
+    def check_queue(self):
+        self.consumer_scheduled = False
+        self.show_listing_errors()
+        if self.track_positions_future != None and self.track_positions_future.done():
+            self.apply_track_positions()
+
+        # The timeline is always set before the first thumbnail result gets queued
+        if self.timeline != None and not self.timeline_shown:
+            self.show_timeline()
+        elif not self.timeline_shown:
+            self.update_progress_bar()
+
+        deadline = time.perf_counter() + CONSUMER_TIME_BUDGET
+        while time.perf_counter() < deadline:
+            try:
+                result = self.result_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.fill_item(result)
+
+        if not self.result_queue.empty():
+            self.schedule_consumer(CONSUMER_TICK_INTERVAL)
+        elif self.loading_finished() and not self.loading_done:
+            self.finish_loading()
+
+    # Creates an item without thumbnail for every slot of the timeline, they're cheap until they get drawn
+    def show_timeline(self):
+        self.timeline_shown = True
+        undated_paths = []
+        for create_epoch, item_data in self.timeline:
+            new_item = item.Item(
+                item_data,
+                self.selected_items,
+                self.thumb_size,
+                self.draw_item,
+                self.shift_select,
+                preloaded_epoch=create_epoch
+            )
+            if new_item.file_path in self.linked_files:
+                new_item.linked = True
+                self.linked_count += 1
+            if create_epoch == -1:
+                undated_paths.append(new_item.file_path)
+            self.items.append(new_item)
+
+        # The items off screen load in random order like they always did, so the whole timeline fills in
+        # evenly instead of from the top. The list is sorted by distance, so it's a heap already
+        shuffled_slots = list(range(len(self.items)))
+        random.shuffle(shuffled_slots)
+        self.load_order = [0]*len(self.items)
+        for distance, slot in enumerate(shuffled_slots):
+            self.load_order[slot] = distance
+        self.job_heap = [(PRIORITY_TIMELINE, distance, slot, 0) for distance, slot in enumerate(shuffled_slots)]
+        self.slot_submitted = bytearray(len(self.items))
+        self.slot_loaded = bytearray(len(self.items))
+        self.request_layout()
+        self.update_job_priorities(*self.get_visible_index_range())
+        self.dispatch_jobs()
+        self.update_progress_bar()
+        self.show_undated_items(undated_paths)
+
+    # One dialog for all items without a create date, they're at the start of the timeline
+    def show_undated_items(self, undated_paths):
+        if not undated_paths:
+            return
+        listed = "\n".join(undated_paths[:UNDATED_ITEMS_LISTED])
+        if len(undated_paths) > UNDATED_ITEMS_LISTED:
+            listed += f"\n... and {len(undated_paths) - UNDATED_ITEMS_LISTED} more"
+        tk.messagebox.showinfo("Error", f"Warning: No create date could be found for {len(undated_paths)} files:\n{listed}")
+
+    def fill_item(self, result):
+        slot, pil_image, error_message, in_cache = result
+
+        if error_message != None:
+            tk.messagebox.showinfo("Error", error_message)
+
+        self.jobs_in_flight.pop(slot, None)
+        self.items[slot].set_thumbnail(pil_image, in_cache)
+        if not self.slot_loaded[slot]:
+            self.slot_loaded[slot] = 1
+            self.thumbnails_loaded += 1
+
+        # The timeline pass loads every item once, the ones far from the visible items are released right away
+        if self.resident_range[0] <= slot < self.resident_range[1]:
+            self.resident_slots.add(slot)
         else:
-            self.processing_threads_pool.shutdown(wait=False)
-
-
-    def add_item(self, result):
-        item_data, pil_image, create_epoch = result
-
-        new_item = item.Item(
-            self.item_grid,
-            item_data,
-            self.selected_items,
-            self.input_data,
-            0,
-            self.thumb_size,
-            self.cget('bg'),
-            "#5293fa",
-            self.bind_grid_scroll,
-            self.unbind_grid_scroll,
-            self.full_screen_callback,
-            self.shift_select,
-            self.select_all_callback,
-            bd=self.item_border_size,
-            preloaded_image=pil_image,
-            preloaded_epoch=create_epoch
-        )
-
-        self.items.append(new_item)
-        self.startup_update_item_layout()
-        new_item.update_idletasks()
-
-        self.update_progress_bar_callback(len(self.items))
-
-        if len(self.item_list) == len(self.items):
-            self.items.sort(key=lambda x: x.create_epoch)
-            self.update_item_layout(force_regrid=True)
-            if self.profile_save_filename != None:
-                self.profiler.disable()
-                self.profiler.dump_stats(self.profile_save_filename)
-                self.tk_root.destroy()
-
-
-    def bind_grid_scroll(self, event):
-        self.canvas.bind_all("<Button-4>", self.scroll_steps)
-        self.canvas.bind_all("<Button-5>", self.scroll_steps)
-        event.widget.focus_set()
-
-    def unbind_grid_scroll(self, event):
-        self.canvas.unbind_all("<Button-4>")
-        self.canvas.unbind_all("<Button-5>")
+            self.release_thumbnail(slot)
+        self.dispatch_jobs()
+        self.update_progress_bar()
+
+    # The pool and the wakeup handler stay until the grid is destroyed, released thumbnails get loaded
+    # again through them when they're scrolled back into view
+    def finish_loading(self):
+        self.loading_done = True
+        self.show_listing_errors()
+        self.update_progress_bar_callback(self.thumbnails_loaded, len(self.items), True)
+        if self.profile_save_filename != None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_save_filename)
+            print(self.get_layout_report(), file=sys.stderr)
+            self.tk_root.destroy()
+
+    def destroy(self):
+        # The pipe stays open, a listing or pool thread can still be about to send a wakeup
+        self.tk.deletefilehandler(self.wakeup_read_fd)
+        self.processing_pool.shutdown(wait=False, cancel_futures=True)
+        super().destroy()
+
+    def on_canvas_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.update_visible_cells()
+
+    def on_canvas_resize(self, event):
+        self.pending_canvas_width = event.width
+        if self.resize_after_id != None:
+            self.after_cancel(self.resize_after_id)
+        self.resize_after_id = self.after(RESIZE_DEBOUNCE_INTERVAL, self.apply_resize)
+
+    def apply_resize(self):
+        self.resize_after_id = None
+        self.items_per_row = max(1, self.pending_canvas_width // self.cell_width)
+        self.request_layout()
+
+    # Everything that changes the layout goes through here so bursts of changes (like many items arriving
+    # while loading) cost a single layout pass per frame
+    def request_layout(self, rebind_all=False):
+        self.layout_rebind_all = self.layout_rebind_all or rebind_all
+        if not self.layout_pending:
+            self.layout_pending = True
+            self.after(LAYOUT_FRAME_INTERVAL, self.run_layout)
+
+    def run_layout(self):
+        start_time = time.perf_counter()
+        self.layout_pending = False
+        rebind_all = self.layout_rebind_all
+        self.layout_rebind_all = False
+
+        self.update_scrollregion()
+        self.update_visible_cells(rebind_all=rebind_all)
+
+        self.layout_times.append(time.perf_counter() - start_time)
+
+    def get_layout_report(self):
+        if len(self.layout_times) == 0:
+            return "Layout: no frames"
+        average = sum(self.layout_times)/len(self.layout_times)
+        return f"Layout: {len(self.layout_times)} frames, average {average*1000:.2f} ms, worst {max(self.layout_times)*1000:.2f} ms, last {self.layout_times[-1]*1000:.2f} ms"
 
     def scroll_steps(self, event):
-        if event.num == 4:
+        if event.num == 4 or event.delta > 0:
             self.canvas.yview_scroll(-1, "units")
-        elif event.num == 5:
+        elif event.num == 5 or event.delta < 0:
             self.canvas.yview_scroll(1, "units")
 
-    def update_scrollregion(self, event=None):
-        self.item_grid.update_idletasks()
-        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
-
-    def calculate_item_location(self, idx, items_per_row):
-        page = ((( idx // items_per_row )) // self.rows_per_page)+1
-        row = ( idx // items_per_row ) % self.rows_per_page
-        col = idx % items_per_row
-        return (page, row, col)
-
-    def update_page_text(self):
-        self.page_label.config(text=f"Page {self.current_page} of {self.total_page_count}")
-
-    def update_item_layout(self, event=None, force_regrid=False):
-        canvas_width = self.canvas.winfo_width()
-        items_per_row = max(1, canvas_width // (self.thumb_size[0] + self.item_border_size*2 + self.item_padding*2))
-
-        if self.last_items_per_row != items_per_row or force_regrid :
-            new_pages = self.calculate_item_location(len(self.items)-1, items_per_row)[0];
-            if  new_pages != 0 and ( new_pages != self.total_page_count or (self.current_page != self.total_page_count and ( len(self.items) != len(self.item_list) ) ) ):
-                if new_pages == 1:
-                    self.control_frame.grid_forget()
-                elif self.total_page_count == 1:
-                    self.control_frame.grid(row=0, column=0, sticky='nwe')
-                self.total_page_count = new_pages
-                # Handles case where after we load all data, the page count decreases and the second part when we still load data
-                if self.current_page > self.total_page_count or len(self.items) != len(self.item_list):
-                    self.current_page = self.total_page_count
-                self.update_page_text()
-                self.update_page_button_state()
-
-            for item in self.items:
-                item.grid_forget()
-
-            for idx, item in enumerate(self.items):
-                page, row, col = self.calculate_item_location(idx, items_per_row)
-                if page == self.current_page:
-                    item.grid(row=row, column=col, padx=self.item_padding, pady=self.item_padding, sticky="nsew")
-
-            self.update_scrollregion()
-
-            self.last_items_per_row = items_per_row
-            return True
-        return False
-
-    def startup_update_item_layout(self):
-        canvas_width = self.canvas.winfo_width()
-        items_per_row = max(1, canvas_width // (self.thumb_size[0] + self.item_border_size*2 + self.item_padding*2))
-
-        if self.update_item_layout() == False:
-            idx = len(self.items)-1
-            item = self.items[-1]
-            max_pages_now, row, col = self.calculate_item_location(idx, items_per_row)
-
-            if max_pages_now > self.total_page_count:
-                self.update_item_layout(force_regrid=True)
-                self.canvas.yview_moveto(0)
-            else:
-                item.grid(row=row, column=col, padx=self.item_padding, pady=self.item_padding, sticky="nsew")
-                self.canvas.yview_moveto(1)
-
-            #It checks if all items have been loaded and if they have it initialises the buttons
-            self.update_page_button_state()
-
-        self.update_scrollregion()
+    def update_scrollregion(self):
+        row_count = (len(self.items) + self.items_per_row - 1) // self.items_per_row
+        scrollregion = (0, 0, self.items_per_row*self.cell_width, row_count*self.cell_height)
+        if scrollregion != self.last_scrollregion:
+            self.last_scrollregion = scrollregion
+            self.canvas.configure(scrollregion=scrollregion)
+
+    def calculate_item_location(self, idx):
+        row = idx // self.items_per_row
+        col = idx % self.items_per_row
+        return (row, col)
+
+    def get_visible_index_range(self):
+        top = self.canvas.canvasy(0)
+        bottom = self.canvas.canvasy(self.canvas.winfo_height())
+        first_row = max(0, int(top // self.cell_height) - OVERSCAN_ROWS)
+        last_row = int(bottom // self.cell_height) + OVERSCAN_ROWS
+        return first_row*self.items_per_row, min(len(self.items), (last_row+1)*self.items_per_row)
+
+    # Only cells that scrolled into view get drawn and only cells whose position changed get moved
+    def update_visible_cells(self, rebind_all=False):
+        first, last = self.get_visible_index_range()
+
+        for idx in list(self.cells):
+            if rebind_all or idx < first or idx >= last:
+                self.release_cell(idx)
+
+        for idx in range(first, last):
+            if idx not in self.cells:
+                if self.free_cells:
+                    cell = self.free_cells.pop()
+                else:
+                    cell = GridCell(self.canvas)
+                cell.item = self.items[idx]
+                cell.item.cell = cell
+                self.cells[idx] = cell
+                self.place_cell(cell, idx)
+                self.draw_cell(cell)
+            elif self.cells[idx].placed_at != (idx, self.items_per_row):
+                self.place_cell(self.cells[idx], idx)
+
+        self.update_job_priorities(first, last)
+
+    def release_cell(self, idx):
+        cell = self.cells.pop(idx)
+        cell.item.release_photo()
+        cell.item.cell = None
+        cell.item = None
+        cell.hide()
+        self.free_cells.append(cell)
+
+    def draw_item(self, item):
+        if item.cell != None:
+            self.draw_cell(item.cell)
+
+    def place_cell(self, cell, idx):
+        cell.placed_at = (idx, self.items_per_row)
+        row, col = self.calculate_item_location(idx)
+        x = col*self.cell_width + self.item_padding
+        y = row*self.cell_height + self.item_padding
+        inner_x = x + self.item_border_size
+        inner_y = y + self.item_border_size
+        self.canvas.coords(cell.background, x, y, x + self.cell_width - self.item_padding*2, y + self.cell_height - self.item_padding*2)
+        self.canvas.coords(cell.image, inner_x, inner_y)
+        self.canvas.coords(cell.type_icon, inner_x, inner_y + self.thumb_size[1])
+        self.canvas.coords(cell.check_icon, inner_x + self.icon_size[0], inner_y + self.thumb_size[1])
+        self.canvas.coords(cell.caption, inner_x + self.thumb_size[0]/2, inner_y + self.thumb_size[1] + self.icon_size[1])
+
+    def draw_cell(self, cell):
+        item = cell.item
+
+        if item.source_properties == constants.source_properties.read_only:
+            bg_color = READ_ONLY_BG_COLOR
+            fg_color = READ_ONLY_FG_COLOR
+        elif item.is_selected():
+            bg_color = SELECT_COLOR
+            fg_color = 'black'
+        else:
+            bg_color = self.bg_color
+            fg_color = 'black'
+
+        self.canvas.itemconfigure(cell.background, fill=bg_color, state='normal')
+        self.canvas.itemconfigure(cell.image, image=item.get_photo(), state='normal')
+        icon_kind = item.item_type if item.item_type in ("video", "image", "gnss-track") else "unknown"
+        self.canvas.itemconfigure(cell.type_icon, image=icons.get_photo_icon(icon_kind, self.icon_size), state='normal')
+        self.canvas.itemconfigure(cell.check_icon, image=icons.get_photo_icon("checkmark", self.icon_size), state=('normal' if item.linked else 'hidden'))
+        self.canvas.itemconfigure(cell.caption, text=item.caption, width=self.thumb_size[0], fill=fg_color, state='normal')
+
+    def get_item_at(self, x, y):
+        canvas_x = self.canvas.canvasx(x)
+        canvas_y = self.canvas.canvasy(y)
+        if canvas_x < 0 or canvas_y < 0:
+            return None
+        col = int(canvas_x // self.cell_width)
+        if col >= self.items_per_row:
+            return None
+        idx = int(canvas_y // self.cell_height)*self.items_per_row + col
+        if idx >= len(self.items):
+            return None
+        return self.items[idx]
+
+    def set_hovered_item(self, item):
+        self.hovered_item = item
+
+    def on_motion(self, event):
+        self.set_hovered_item(self.get_item_at(event.x, event.y))
+
+    def on_click(self, event):
+        self.canvas.focus_set()
+        clicked_item = self.get_item_at(event.x, event.y)
+        if clicked_item != None:
+            clicked_item.on_click(event.state & constants.TK_SHIFT_MASK)
+
+    def on_drag(self, event):
+        dragged_item = self.get_item_at(event.x, event.y)
+        if dragged_item != None and item.Item.last_selected != None:
+            item.Item.last_selected.on_drag(dragged_item)
+
+    def on_return(self, event):
+        if self.hovered_item != None:
+            self.full_screen_callback(self.hovered_item.file_path)
 
     def shift_select(self, start, end, action):
         select = 0
@@ -253,6 +699,11 @@ class ItemGrid(tk.Frame):
 
     def checkmark_items(self, file_list):
         for i in self.items:
-            if i.file_path in file_list:
+            if i.file_path in file_list and not i.linked:
                 i.add_checkmark()
                 self.linked_count += 1
+
+    # Items that are already linked in one of the destinations, including the ones still loading
+    def set_linked_files(self, file_list):
+        self.linked_files = set(file_list)
+        self.checkmark_items(self.linked_files)
@@ -0,0 +1,132 @@
+import os
+import queue
+import threading
+
+# How often the watcher thread checks the destination directories for changes
+WATCH_INTERVAL = 5
+# How long a duplicate check waits for the rescan after a script before looking through the project itself
+RESCAN_WAIT = 0.5
+
+# Reverse index of the symlinks in the destination directories, link target -> where it's linked. It's built
+# once on a background thread and then only the directories whose mtime changed get scanned again
+class LinkIndex:
+    def __init__(self, destinations):
+        self.destinations = [os.path.realpath(i) for i in destinations]
+        self.lock = threading.Lock()
+        self.targets = {}      # target -> {(filename, dirpath), ...}
+        self.dir_links = {}    # dirpath -> {filename: target, ...}
+        self.dir_mtimes = {}   # dirpath -> mtime_ns
+        self.ready = threading.Event()
+        self.rescan_requests = queue.Queue() # (dirs, event set once they're scanned)
+        self.last_rescan = None # Event of the latest request, the queue is worked through in order
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        for destination in self.destinations:
+            self.scan_tree(destination)
+        self.ready.set()
+
+        # All scans happen on this thread, so a directory is never scanned twice at once and an older
+        # listing can't end up in the index
+        while True:
+            try:
+                dirs, done = self.rescan_requests.get(timeout=WATCH_INTERVAL)
+            except queue.Empty:
+                self.check_for_changes()
+                continue
+            self.scan_dirs(dirs)
+            done.set()
+
+    def scan_dirs(self, dirs):
+        for dirpath in dirs:
+            self.scan_tree(os.path.realpath(dirpath))
+
+    def scan_tree(self, top):
+        pending = [top]
+        while pending:
+            pending += self.scan_dir(pending.pop())
+
+    # Updates the index with the links of one directory and returns its subdirectories that aren't known yet
+    def scan_dir(self, dirpath):
+        links = {}
+        new_subdirs = []
+        try:
+            mtime = os.stat(dirpath).st_mtime_ns
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    if entry.is_symlink():
+                        if not entry.is_dir():
+                            links[entry.name] = os.path.realpath(entry.path)
+                    elif entry.is_dir():
+                        if entry.path not in self.dir_mtimes:
+                            new_subdirs.append(entry.path)
+        except OSError:
+            self.remove_dir(dirpath)
+            return []
+
+        with self.lock:
+            for filename, target in self.dir_links.get(dirpath, {}).items():
+                self.discard_location(target, (filename, dirpath))
+            for filename, target in links.items():
+                self.targets.setdefault(target, set()).add((filename, dirpath))
+            self.dir_links[dirpath] = links
+            self.dir_mtimes[dirpath] = mtime
+        return new_subdirs
+
+    def remove_dir(self, dirpath):
+        with self.lock:
+            for filename, target in self.dir_links.pop(dirpath, {}).items():
+                self.discard_location(target, (filename, dirpath))
+            self.dir_mtimes.pop(dirpath, None)
+
+    # Must be called with the lock held
+    def discard_location(self, target, location):
+        locations = self.targets.get(target)
+        if locations != None:
+            locations.discard(location)
+            if not locations:
+                del self.targets[target]
+
+    # Creating or removing an entry changes the mtime of the directory, so comparing them finds every
+    # directory that has to be scanned again
+    def check_for_changes(self):
+        with self.lock:
+            known_dirs = list(self.dir_mtimes.items())
+        for dirpath, old_mtime in known_dirs:
+            try:
+                mtime = os.stat(dirpath).st_mtime_ns
+            except OSError:
+                self.remove_dir(dirpath)
+                continue
+            if mtime != old_mtime:
+                self.scan_tree(dirpath)
+
+    # Used after running a script, the watcher thread scans the directories ahead of its next change check
+    def rescan(self, dirs):
+        done = threading.Event()
+        self.last_rescan = done
+        self.rescan_requests.put((list(dirs), done))
+
+    # True when the index is built and every requested rescan is done, waiting at most timeout seconds
+    # for them. The duplicate checks use this so they see the links of the last script
+    def is_up_to_date(self, timeout):
+        if not self.is_ready():
+            return False
+        last_rescan = self.last_rescan
+        return last_rescan == None or last_rescan.wait(timeout)
+
+    def is_ready(self):
+        return self.ready.is_set()
+
+    def get_linked_targets(self):
+        with self.lock:
+            return set(self.targets)
+
+    # Returns the (filename, dirpath) locations under directory where target is linked
+    def find_links(self, target, directory):
+        directory = os.path.realpath(directory)
+        with self.lock:
+            locations = list(self.targets.get(target, ()))
+        return [i for i in locations if i[1] == directory or i[1].startswith(directory + os.sep)]
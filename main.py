@@ -6,14 +6,20 @@ from tkinter import ttk
 import subprocess
 import os
 import multiprocessing
+import concurrent.futures
 
 import full_screen_view
+import full_screen_loader
 import item_grid
 import project_list
 import shell_script_window
 import spell_check
 import media_interface
 import constants
+import thumbnail_cache
+import tile_provider
+import tile_pack
+import link_index
 
 #TODO: Add preference for gpx files in gnss track code
 
@@ -48,43 +54,72 @@ class CountCallbackSet:
         self.callback = callback
 
 
-class MediaSelectorApp:
-    def __init__(self, root, unsanitised_input_data, processing_thread_count, thumb_size=(180, 180), item_border_size=6, item_padding=10, profile_item_loading_filename=None):
-        self.input_data = {}
-
-        if not os.path.isfile(unsanitised_input_data["interface"]):
-            raise CmdLineError("Following provided interface file doesn't exist or isn't a file: '" + unsanitised_input_data["interface"] + "'")
-        if not os.access(unsanitised_input_data["interface"], os.X_OK):
-            raise CmdLineError("Following provided interface file isn't executable: '" + unsanitised_input_data["interface"] + "'")
-        self.input_data["interface"] = os.path.normpath(unsanitised_input_data["interface"])
+def sanitise_input_data(unsanitised_input_data):
+    input_data = {}
 
-        if unsanitised_input_data["map_database"] != None:
-            self.input_data["map_database"] = os.path.normpath(unsanitised_input_data["map_database"])
-        else:
-            self.input_data["map_database"] = None
-        self.input_data["force_offline"] = unsanitised_input_data["force_offline"]
+    if not os.path.isfile(unsanitised_input_data["interface"]):
+        raise CmdLineError("Following provided interface file doesn't exist or isn't a file: '" + unsanitised_input_data["interface"] + "'")
+    if not os.access(unsanitised_input_data["interface"], os.X_OK):
+        raise CmdLineError("Following provided interface file isn't executable: '" + unsanitised_input_data["interface"] + "'")
+    input_data["interface"] = os.path.normpath(unsanitised_input_data["interface"])
 
-        self.input_data["sources"] = []
-        for source in unsanitised_input_data["sources"]:
+    if unsanitised_input_data["map_database"] != None:
+        input_data["map_database"] = os.path.normpath(unsanitised_input_data["map_database"])
+    else:
+        input_data["map_database"] = None
+    input_data["force_offline"] = unsanitised_input_data["force_offline"]
+    input_data["camera_clock_offset"] = unsanitised_input_data["camera_clock_offset"]
+    input_data["tile_server"] = unsanitised_input_data["tile_server"]
+    if unsanitised_input_data["use_tile_cache"]:
+        input_data["tile_cache"] = os.path.normpath(unsanitised_input_data["tile_cache"])
+    else:
+        input_data["tile_cache"] = None
+
+    if unsanitised_input_data["thumbnail_cache_size"] <= 0:
+        raise CmdLineError("Thumbnail cache size must be a positive number of megabytes")
+    thumbnail_cache_settings = (os.path.normpath(unsanitised_input_data["thumbnail_cache"]), unsanitised_input_data["thumbnail_cache_size"]*1024*1024)
+    if unsanitised_input_data["clear_thumbnail_cache"]:
+        thumbnail_cache.ThumbnailCache(*thumbnail_cache_settings).clear()
+    if unsanitised_input_data["use_thumbnail_cache"]:
+        input_data["thumbnail_cache"] = thumbnail_cache_settings
+    else:
+        input_data["thumbnail_cache"] = None
+
+    input_data["sources"] = []
+    for source in unsanitised_input_data["sources"]:
+        if not os.path.isdir(source):
+            raise CmdLineError("Following provided source directory doesn't exist: '" + source + "'")
+        input_data["sources"].append((os.path.normpath(source), constants.source_properties.normal))
+    if "read_only_source" in unsanitised_input_data:
+        for source in unsanitised_input_data["read_only_source"]:
             if not os.path.isdir(source):
                 raise CmdLineError("Following provided source directory doesn't exist: '" + source + "'")
-            self.input_data["sources"].append((os.path.normpath(source), constants.source_properties.normal))
-        if "read_only_source" in unsanitised_input_data:
-            for source in unsanitised_input_data["read_only_source"]:
-                if not os.path.isdir(source):
-                    raise CmdLineError("Following provided source directory doesn't exist: '" + source + "'")
-                self.input_data["sources"].append((os.path.normpath(source), constants.source_properties.read_only))
+            input_data["sources"].append((os.path.normpath(source), constants.source_properties.read_only))
+
+    input_data["destinations"] = []
+    for destination in unsanitised_input_data["destinations"]:
+        if not os.path.isdir(destination):
+            raise CmdLineError("Following provided destination directory doesn't exist: '" + destination + "'")
+        input_data["destinations"].append(os.path.normpath(destination))
+
+    input_data["destinations_append"] = unsanitised_input_data["destinations_append"]
+    return input_data
 
-        self.input_data["destinations"] = []
-        for destination in unsanitised_input_data["destinations"]:
-            if not os.path.isdir(destination):
-                raise CmdLineError("Following provided destination directory doesn't exist: '" + destination + "'")
-            self.input_data["destinations"].append(os.path.normpath(destination))
 
-        self.input_data["destinations_append"] = unsanitised_input_data["destinations_append"]
+class MediaSelectorApp:
+    def __init__(self, root, unsanitised_input_data, processing_thread_count, thumb_size=(180, 180), item_border_size=6, item_padding=10, profile_item_loading_filename=None):
+        self.input_data = sanitise_input_data(unsanitised_input_data)
 
         self.selected_items = CountCallbackSet()  # set of selected file paths
 
+        self.link_index = link_index.LinkIndex(self.input_data["destinations"])
+        self.link_index.start()
+
+        self.full_screen_prefetcher = full_screen_loader.FullScreenPrefetcher(self.input_data)
+        self.full_screen_items = []
+        self.full_screen_paths = []
+        self.full_screen_position = 0
+
         root.title("MEDIA organiser")
 
         self.upper_and_shell_pane = ttk.PanedWindow(root, orient=tk.VERTICAL)
@@ -93,8 +128,7 @@ class MediaSelectorApp:
 
         self.grid_and_toolbar = tk.Frame(self.list_grid_pane)
 
-        self.ItemGrid = item_grid.ItemGrid(self.grid_and_toolbar, thumb_size, item_border_size, item_padding, self.selected_items, self.input_data, self.enter_full_screen, self.select_all_callback, self.update_progress_bar, media_interface.load_interface_data, root, profile_item_loading_filename, processing_thread_count)
-        self.item_count = len(self.ItemGrid.item_list)
+        self.ItemGrid = item_grid.ItemGrid(self.grid_and_toolbar, thumb_size, item_border_size, item_padding, self.selected_items, self.input_data, self.enter_full_screen, self.select_all_callback, self.update_progress_bar, media_interface.stream_thumbnail_list, root, profile_item_loading_filename, processing_thread_count)
 
         self.toolbar = tk.Frame(self.grid_and_toolbar, bd=3)
         self.toolbar.config(relief="groove")
@@ -130,6 +164,12 @@ class MediaSelectorApp:
         self.select_invert_button = tk.Button(self.toolbar, text="Invert selections", command=self.select_invert)
         self.select_invert_button.pack(side=tk.LEFT, padx=2)
 
+        ttk.Separator(self.toolbar, orient='vertical').pack(side=tk.LEFT, padx=(5, 5), fill=tk.Y)
+
+        self.tile_pack_button = tk.Button(self.toolbar, text="Build tile pack", command=self.build_tile_pack)
+        self.tile_pack_button.pack(side=tk.LEFT, padx=2)
+        self.tile_pack_status = ""
+
         self.item_count_label = tk.Label(self.toolbar, text="")
         self.item_count_label.pack(side=tk.RIGHT, padx=2)
 
@@ -169,25 +209,56 @@ class MediaSelectorApp:
 
         self.shell_script_error_line = None
 
-    def update_progress_bar(self, items):
-        if items != self.item_count:
-            self.progress_bar["value"] = (items*100)/self.item_count
+        self.after_link_index_ready()
+
+    def after_link_index_ready(self):
+        if not self.link_index.is_ready():
+            self.grid_and_toolbar.after(200, self.after_link_index_ready)
+            return
+        self.ItemGrid.set_linked_files(self.link_index.get_linked_targets())
+        self.update_counters()
+
+    def update_progress_bar(self, loaded_items, listed_items, finished):
+        if not finished:
+            self.progress_bar["value"] = (loaded_items*100)/max(1, listed_items)
         else:
             self.progress_bar.grid_forget()
             self.toolbar.grid(row=1, column=0, sticky='we')
             self.update_counters()
 
     def enter_full_screen(self, path):
-        try:
-            self.FullScreenItem = full_screen_view.FullScreenItem(self.grid_and_toolbar, self.input_data, path, self.exit_full_screen)
-            self.ItemGrid.grid_forget()
-            self.FullScreenItem.grid(row=0, column=0, sticky='nswe')
-        except subprocess.CalledProcessError:
-            pass
+        # Stepping to the next or previous item follows the order of the grid
+        self.full_screen_items = list(self.ItemGrid.items)
+        self.full_screen_paths = [i.file_path for i in self.full_screen_items]
+        self.full_screen_position = self.full_screen_paths.index(path)
+        self.FullScreenItem = self.create_full_screen_item()
+        self.ItemGrid.grid_forget()
+        self.FullScreenItem.grid(row=0, column=0, sticky='nswe')
+
+    # The view opens on the grid thumbnail right away and fills in the rest as it finishes loading
+    def create_full_screen_item(self):
+        self.full_screen_prefetcher.set_position(self.full_screen_paths, self.full_screen_position)
+        media_future = self.full_screen_prefetcher.get_shown_future()
+        thumbnail = self.full_screen_items[self.full_screen_position].get_thumbnail()
+        track_position = self.ItemGrid.get_track_position(self.full_screen_paths[self.full_screen_position])
+        return full_screen_view.FullScreenItem(self.grid_and_toolbar, self.input_data, media_future, thumbnail, track_position, self.exit_full_screen, self.step_full_screen)
+
+    def step_full_screen(self, step):
+        position = self.full_screen_position + step
+        if position < 0 or position >= len(self.full_screen_paths):
+            return
+        self.full_screen_position = position
+        new_item = self.create_full_screen_item()
+        self.FullScreenItem.close()
+        self.FullScreenItem.grid_forget()
+        self.FullScreenItem.destroy()
+        self.FullScreenItem = new_item
+        self.FullScreenItem.grid(row=0, column=0, sticky='nswe')
 
     def exit_full_screen(self):
         self.FullScreenItem.grid_forget()
         self.FullScreenItem.destroy()
+        self.full_screen_prefetcher.clear()
         self.ItemGrid.grid(row=0, column=0, sticky='nswe')
 
     def recycle_bash_side_channel_pipe(self):
@@ -233,6 +304,7 @@ class MediaSelectorApp:
             self.ShellScriptWindow.update_bash_side_channel_write_fd(self.bash_side_channel_write_fd)
         else:
             self.shell_script_error = None
+            self.link_index.rescan(set(i[1] for i in self.ShellScriptWindow.script_written_lines))
             self.ItemGrid.checkmark_items(self.ShellScriptWindow.get_items_in_script())
             self.update_counters()
             self.ShellScriptWindow.clear(self.bash_side_channel_write_fd)
@@ -264,6 +336,62 @@ class MediaSelectorApp:
             else:
                 i.select()
 
+    # Fetches the map tiles of all tracks and geotagged photos into the tile cache on a background thread,
+    # the button shows how far it got. The tiles are only fetched after the number of them is confirmed
+    def build_tile_pack(self):
+        try:
+            tile_pack.check_tile_server(self.input_data)
+        except ValueError as error:
+            messagebox.showinfo("Error", f"Couldn't build the tile pack: {error}")
+            return
+        self.tile_pack_button.config(state=tk.DISABLED)
+        self.tile_pack_status = "Looking for tracks and geotagged photos"
+        self.run_tile_pack_job(tile_pack.collect_missing_tiles, self.input_data, self.set_tile_pack_status, done_callback=self.confirm_tile_pack)
+
+    def run_tile_pack_job(self, function, *args, done_callback):
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        future = pool.submit(function, *args)
+        pool.shutdown(wait=False)
+        self.check_tile_pack(future, done_callback)
+
+    # Called from the tile pack thread
+    def set_tile_pack_status(self, status):
+        self.tile_pack_status = status
+
+    def check_tile_pack(self, future, done_callback):
+        if not future.done():
+            self.tile_pack_button.config(text=self.tile_pack_status)
+            self.grid_and_toolbar.after(200, lambda: self.check_tile_pack(future, done_callback))
+            return
+        done_callback(future)
+
+    def confirm_tile_pack(self, future):
+        try:
+            tiles = future.result()
+        except Exception as error:
+            self.tile_pack_button.config(text="Build tile pack", state=tk.NORMAL)
+            messagebox.showinfo("Error", f"Couldn't build the tile pack: {error}")
+            return
+        if not tiles or not messagebox.askyesno("Build tile pack", f"Fetch {len(tiles)} tiles from {self.input_data['tile_server']}?"):
+            self.tile_pack_button.config(text="Build tile pack", state=tk.NORMAL)
+            if not tiles:
+                messagebox.showinfo("Tile pack", "All map tiles of the sources are stored already")
+            return
+        self.tile_pack_status = "Fetching tiles"
+        self.run_tile_pack_job(tile_pack.store_tile_pack, self.input_data, tiles, self.set_tile_pack_status, done_callback=self.finish_tile_pack)
+
+    def finish_tile_pack(self, future):
+        self.tile_pack_button.config(text="Build tile pack", state=tk.NORMAL)
+        try:
+            fetched, failed = future.result()
+        except Exception as error:
+            messagebox.showinfo("Error", f"Couldn't build the tile pack: {error}")
+            return
+        if failed:
+            messagebox.showinfo("Tile pack", f"Fetched {fetched} tiles, {failed} tiles couldn't be fetched")
+        else:
+            messagebox.showinfo("Tile pack", f"Fetched {fetched} tiles, all maps can be shown offline now")
+
     def export_shell_script(self):
         save_path = filedialog.asksaveasfilename(defaultextension=".sh", filetypes=[("Shell Script", "*.sh")])
         if not save_path:
@@ -281,21 +409,28 @@ class MediaSelectorApp:
             messagebox.showinfo("Selection", "No items selected.")
             return
 
-        linked_already = []
+        linked_already = {}
         destination_dir = self.ShellScriptWindow.get_destination_dir(selected_tab, selected_project);
-        if not self.ProjectList.query_project_queued_in_script(selected_tab, selected_project) :
+        check_links = not self.ProjectList.query_project_queued_in_script(selected_tab, selected_project)
+        use_link_index = self.link_index.is_up_to_date(link_index.RESCAN_WAIT)
+        if check_links and not use_link_index:
+            # The index is still being built or scanning what the last script linked, only look through the selected project
             for dirpath, dirnames, filenames in os.walk(destination_dir, followlinks=False):
                 for filename in filenames:
                     full_path = os.path.join(dirpath, filename)
                     if os.path.islink(full_path):
                         link_destination = os.path.realpath(full_path)
-                        linked_already.append((link_destination, filename, dirpath))
+                        linked_already.setdefault(link_destination, []).append((filename, dirpath))
         try:
-            for file_id in self.selected_items:
-                for file_to_link in media_interface.load_interface_data(self.input_data, 0, 'get-related', arg=file_id)["file_list"]:
-                    for i in linked_already:
-                        if i[0] == file_to_link["file_path"]:
-                            messagebox.showinfo("Error", f"ERROR: file \"{file_to_link["file_path"]}\" is already linked as \"{i[1]}\" in \"{i[2]}\"")
+            for related in media_interface.load_related_batch(self.input_data, list(self.selected_items)):
+                for file_to_link in related["file_list"]:
+                    if check_links:
+                        if use_link_index:
+                            locations = self.link_index.find_links(file_to_link["file_path"], destination_dir)
+                        else:
+                            locations = linked_already.get(file_to_link["file_path"], [])
+                        if locations:
+                            messagebox.showinfo("Error", f"ERROR: file \"{file_to_link["file_path"]}\" is already linked as \"{locations[0][0]}\" in \"{locations[0][1]}\"")
                             return
                     self.ShellScriptWindow.add_file(file_to_link["file_path"], selected_tab, selected_project)
         except FileNotFoundError as error_message:
@@ -306,12 +441,15 @@ class MediaSelectorApp:
         self.select_none()
 
 
+def confirm_tile_pack(tile_count):
+    try:
+        return input(f"Fetch {tile_count} tiles? [y/N] ").strip().lower() in ("y", "yes")
+    except EOFError:
+        return False
+
 def main():
     version = "v0.0"
 
-    root = tk.Tk()
-    root.geometry("1000x600")
-
     parser = argparse.ArgumentParser(description='Select and symlink media from one directory to another')
     parser.add_argument('-i', '--interface',            type=str,                                         required=True,  help='Path to source direcotry interface executable')
     parser.add_argument('-s', '--source',               type=str,  action='append',                       required=True,  help='Path to the source directory of media to get linked. This can be entered multiple times')
@@ -323,6 +461,15 @@ def main():
     parser.add_argument('-j', '--jobs',                 type=int,                                         required=False, help='The number of jobs to run simultaneously. Currently this is used for reading and processing the input data when starting up. By default the number of availiable threads is used.')
     parser.add_argument('-m', '--map-database',         type=str,                                         required=False, help='Path to a database of tile images to look through before loading from the network')
     parser.add_argument('-O', '--force-offline',        type=bool, action=argparse.BooleanOptionalAction, required=False, help='Disable fetching resources from the network')
+    parser.add_argument(      '--tile-server',          type=str,                                         required=False, help=f'URL template of the map tile server, {{z}}, {{x}} and {{y}} get replaced by the tile coordinates. By default \'{tile_provider.DEFAULT_TILE_SERVER}\' is used', default=tile_provider.DEFAULT_TILE_SERVER)
+    parser.add_argument(      '--tile-cache',           type=str,                                         required=False, help=f'Path to the database fetched map tiles are stored in. It uses the same format as the map database. By default \'{tile_provider.DEFAULT_TILE_CACHE}\' is used', default=tile_provider.DEFAULT_TILE_CACHE)
+    parser.add_argument(      '--no-tile-cache',                   action='store_true',                   required=False, help='Don\'t store fetched map tiles, they are only kept in memory while running')
+    parser.add_argument(      '--camera-clock-offset',  type=int,                                         required=False, help='Seconds the camera clock runs ahead of GPS time, used to place photos without GPS data on the GPX tracks. Cameras set to local time run ahead by the UTC offset of the time zone. By default 0 is used', default=0)
+    parser.add_argument(      '--build-tile-pack',                 action='store_true',                   required=False, help=f'Fetch the map tiles of every track and geotagged photo in the sources into the tile cache and exit, at most {tile_pack.MAX_PACK_TILES} and after asking. Needs a --tile-server that allows bulk downloading, the default OpenStreetMap one doesn\'t. Later runs can then show these maps with --force-offline')
+    parser.add_argument('-c', '--thumbnail-cache',      type=str,                                         required=False, help=f'Path to the directory the thumbnail cache is stored in. By default \'{thumbnail_cache.DEFAULT_CACHE_DIR}\' is used', default=thumbnail_cache.DEFAULT_CACHE_DIR)
+    parser.add_argument('-C', '--no-thumbnail-cache',              action='store_true',                   required=False, help='Don\'t read or write the thumbnail cache, every thumbnail gets generated from the media files')
+    parser.add_argument(      '--clear-thumbnail-cache',           action='store_true',                   required=False, help='Delete all entries of the thumbnail cache before loading')
+    parser.add_argument(      '--thumbnail-cache-size', type=int,                                         required=False, help=f'Maximum size of the thumbnail cache in MiB. The least recently used thumbnails get removed when it\'s exceeded. By default {thumbnail_cache.DEFAULT_MAX_SIZE_MB} is used', default=thumbnail_cache.DEFAULT_MAX_SIZE_MB)
 
     args = parser.parse_args()
 
@@ -337,7 +484,15 @@ def main():
         "destinations": args.destination,
         "destinations_append": (args.destination_append if args.destination_append is not None else ""),
         "force_offline": args.force_offline,
-        "map_database": args.map_database
+        "map_database": args.map_database,
+        "camera_clock_offset": args.camera_clock_offset,
+        "tile_server": args.tile_server,
+        "tile_cache": args.tile_cache,
+        "use_tile_cache": not args.no_tile_cache,
+        "thumbnail_cache": args.thumbnail_cache,
+        "use_thumbnail_cache": not args.no_thumbnail_cache,
+        "thumbnail_cache_size": args.thumbnail_cache_size,
+        "clear_thumbnail_cache": args.clear_thumbnail_cache
     }
 
     if input_data["force_offline"] == None:
@@ -346,6 +501,18 @@ def main():
     if args.read_only_source != None:
         input_data["read_only_source"]= args.read_only_source
 
+    if args.build_tile_pack:
+        try:
+            fetched, failed = tile_pack.build_tile_pack(sanitise_input_data(input_data), lambda status: print(status, file=sys.stderr), confirm_tile_pack)
+        except (CmdLineError, ValueError) as error_message:
+            print(f"ERROR: {error_message}", file=sys.stderr)
+            sys.exit(1)
+        print(f"Fetched {fetched} tiles, {failed} tiles couldn't be fetched", file=sys.stderr)
+        sys.exit(1 if failed else 0)
+
+    root = tk.Tk()
+    root.geometry("1000x600")
+
     try:
         app = MediaSelectorApp(root, input_data, jobs, profile_item_loading_filename=args.profile_item_loading)
     except CmdLineError as error_message:
@@ -1,7 +1,121 @@
 import subprocess
 import json
 import os
-from tkinter import messagebox
+import select
+import atexit
+import threading
+import re
+import codecs
+
+# Interfaces that report at least this version can be started once with -D and then answer queries as JSON
+# lines on stdin/stdout. Older ones are run once per query. After a hello line of {"version": ...} every
+# request {"id": n, "query": "get-related", "args": [id, ...]} is answered by
+# {"id": n, "version": ..., "results": [{"file_list": ...}, ...]} with one result per arg, or by
+# {"id": n, "error_string": ...}
+# Queries also run on loader and prefetch threads, so errors are raised and the UI thread shows them
+DAEMON_MIN_VERSION = (1, 1)
+DAEMON_STARTUP_TIMEOUT = 5
+# Limit how many ids go in one request so a single response line doesn't get huge
+DAEMON_BATCH_SIZE = 500
+
+def check_version(data):
+    if data["version"].split('.')[0] != "1":
+        raise ValueError("ERROR invalid api version on source media interface")
+
+def parse_version(version):
+    try:
+        return tuple(int(i) for i in version.split('.')[:2])
+    except ValueError:
+        return (0, 0)
+
+class InterfaceDaemon:
+    def __init__(self, interface):
+        self.interface = interface
+        self.lock = threading.Lock()
+        self.next_request_id = 0
+        self.process = subprocess.Popen([interface, '-D'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, bufsize=1)
+
+        # The first line is a hello message carrying the api version. Interfaces that don't know -D print an
+        # error or nothing at all
+        try:
+            ready, _, _ = select.select([self.process.stdout], [], [], DAEMON_STARTUP_TIMEOUT)
+            hello = json.loads(self.process.stdout.readline()) if ready else None
+        except ValueError:
+            hello = None
+        if not isinstance(hello, dict) or "version" not in hello or hello.get("error_string") != None or parse_version(hello["version"]) < DAEMON_MIN_VERSION:
+            self.close()
+            raise OSError("Media interface doesn't support daemon mode")
+
+    def request(self, query, args):
+        with self.lock:
+            self.next_request_id += 1
+            request_id = self.next_request_id
+            command = json.dumps({"id": request_id, "query": query, "args": args})
+            try:
+                self.process.stdin.write(command + "\n")
+                self.process.stdin.flush()
+                line = self.process.stdout.readline()
+            except OSError:
+                line = ""
+        if line == "":
+            raise OSError("Media interface daemon exited")
+
+        data = json.loads(line)
+        if data.get("error_string") != None:
+            raise ValueError("Error with media interface: " + data["error_string"])
+        if data.get("id") != request_id or len(data.get("results", [])) != len(args):
+            raise ValueError("Media interface daemon sent an unexpected response: " + line.strip())
+        check_version(data)
+
+        for result in data["results"]:
+            result.setdefault("version", data["version"])
+        return data["results"]
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+daemons = {}
+daemons_lock = threading.Lock()
+
+# Returns None if the interface only supports one-shot queries, this is only tried once per interface
+def get_daemon(interface):
+    with daemons_lock:
+        if interface not in daemons:
+            try:
+                daemons[interface] = InterfaceDaemon(interface)
+            except OSError:
+                daemons[interface] = None
+        return daemons[interface]
+
+# Returns None when the query has to be run with the one-shot command line instead
+def daemon_request(interface, query, args):
+    daemon = get_daemon(interface)
+    if daemon == None:
+        return None
+    try:
+        return daemon.request(query, args)
+    except OSError:
+        # The daemon died, fall back to one-shot queries from now on
+        with daemons_lock:
+            daemons[interface] = None
+        daemon.close()
+        return None
+
+def close_daemons():
+    with daemons_lock:
+        for daemon in daemons.values():
+            if daemon != None:
+                daemon.close()
+        daemons.clear()
+
+atexit.register(close_daemons)
 
 def load_interface_data(input_data , source_number, query, arg=None):
     match query:
@@ -9,8 +123,10 @@ def load_interface_data(input_data , source_number, query, arg=None):
             command = [input_data["interface"], '-l', os.path.normpath(input_data["sources"][source_number][0])]
         case 'get-related':
             if arg == None:
-                messagebox.showinfo("Error", "Internal error: called load_interface_data without passing arg")
-                raise ValueError
+                raise ValueError("Internal error: called load_interface_data without passing arg")
+            results = daemon_request(input_data["interface"], 'get-related', [arg])
+            if results != None:
+                return results[0]
             command = [input_data["interface"], '-g', arg]
         case _:
             raise CalledProcessRtt
@@ -18,12 +134,95 @@ def load_interface_data(input_data , source_number, query, arg=None):
     try:
         data = json.loads(subprocess.check_output(command))
     except subprocess.CalledProcessError as error:
-        error = json.loads(error.stdout)["error_string"]
-        messagebox.showinfo("Error", "Error with media interface: " + error )
-        raise error
+        try:
+            error_string = json.loads(error.stdout)["error_string"]
+        except (ValueError, TypeError, KeyError):
+            error_string = f"exit status {error.returncode}"
+        raise ValueError("Error with media interface: " + error_string) from error
 
-    if data["version"].split('.')[0] != "1":
-        messagebox.showinfo("Error", "ERROR invalid api version on source media interface")
-        raise error
+    check_version(data)
 
     return data
+
+# Same as calling load_interface_data with 'get-related' for every id, but it only takes one round trip
+# per batch when the interface runs as a daemon
+def load_related_batch(input_data, file_ids):
+    results = []
+    for batch_start in range(0, len(file_ids), DAEMON_BATCH_SIZE):
+        batch = file_ids[batch_start:batch_start+DAEMON_BATCH_SIZE]
+        batch_results = daemon_request(input_data["interface"], 'get-related', batch)
+        if batch_results == None:
+            batch_results = [load_interface_data(input_data, 0, 'get-related', arg=file_id) for file_id in batch]
+        results += batch_results
+    return results
+
+FILE_LIST_START = re.compile(r'"file_list"\s*:\s*\[')
+STREAM_READ_SIZE = 64*1024
+
+# Incrementally parses the {"version": ..., "file_list": [...]} document printed by 'list-thumbnails'. The
+# entries of file_list are returned as soon as they are complete, the rest of the document is parsed at the end
+class FileListStreamParser:
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.state = "before-list"
+        self.document_without_list = ""
+
+    def feed(self, text):
+        self.buffer += text
+        entries = []
+
+        if self.state == "before-list":
+            match = FILE_LIST_START.search(self.buffer)
+            if match == None:
+                return entries
+            self.document_without_list = self.buffer[:match.end()]
+            self.buffer = self.buffer[match.end():]
+            self.state = "in-list"
+
+        if self.state == "in-list":
+            position = 0
+            while True:
+                while position < len(self.buffer) and self.buffer[position] in " \t\r\n,":
+                    position += 1
+                if position == len(self.buffer):
+                    break
+                if self.buffer[position] == "]":
+                    self.state = "after-list"
+                    break
+                try:
+                    entry, position = self.decoder.raw_decode(self.buffer, position)
+                except json.JSONDecodeError:
+                    break # The entry isn't complete yet
+                entries.append(entry)
+            self.buffer = self.buffer[position:]
+
+        return entries
+
+    def finish(self):
+        if self.state == "before-list":
+            return json.loads(self.buffer)
+        if self.state == "in-list":
+            raise ValueError("Media interface output ended in the middle of the file list")
+        return json.loads(self.document_without_list + self.buffer)
+
+# Runs 'list-thumbnails' on a source and yields the entries of its file list while the interface is still
+# writing them. This runs on loader threads, so errors are raised instead of shown
+def stream_thumbnail_list(input_data, source_number):
+    command = [input_data["interface"], '-l', os.path.normpath(input_data["sources"][source_number][0])]
+    parser = FileListStreamParser()
+    with subprocess.Popen(command, stdout=subprocess.PIPE) as process:
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        while True:
+            chunk = process.stdout.read1(STREAM_READ_SIZE)
+            for entry in parser.feed(decoder.decode(chunk, final=(chunk == b""))):
+                yield entry
+            if chunk == b"":
+                break
+        returncode = process.wait()
+
+    data = parser.finish()
+    if returncode != 0 or data.get("error_string") != None:
+        raise ValueError("Error with media interface: " + str(data.get("error_string")))
+    if data["version"].split('.')[0] != "1":
+        raise ValueError("ERROR invalid api version on source media interface")
@@ -0,0 +1,193 @@
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+from PIL import Image
+
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "media_organiser")
+DEFAULT_MAX_SIZE_MB = 1024
+
+# Eviction goes this far below the maximum size, so the query that looks at the whole table doesn't run
+# again on the next few stores
+EVICTION_HEADROOM = 0.1
+# Don't rewrite the access time of an entry more often than this, it saves a write per hit
+ACCESS_TIME_GRANULARITY = 60*60
+
+open_caches = {}
+open_caches_lock = threading.Lock()
+
+def open_cache(input_data):
+    if input_data.get("thumbnail_cache") == None:
+        return None
+    cache_dir, max_size = input_data["thumbnail_cache"]
+    with open_caches_lock:
+        if (cache_dir, max_size) not in open_caches:
+            open_caches[(cache_dir, max_size)] = ThumbnailCache(cache_dir, max_size)
+        return open_caches[(cache_dir, max_size)]
+
+class ThumbnailCache:
+    def __init__(self, cache_dir, max_size):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.database_path = os.path.join(cache_dir, "thumbnails.sqlite")
+        self.max_size = max_size
+        self.local = threading.local()
+
+        connection = self.get_connection()
+        connection.execute("BEGIN IMMEDIATE")
+        connection.execute("""CREATE TABLE IF NOT EXISTS thumbnails (
+                                  key TEXT PRIMARY KEY,
+                                  create_epoch INTEGER NOT NULL,
+                                  image BLOB NOT NULL,
+                                  size INTEGER NOT NULL,
+                                  last_access INTEGER NOT NULL)""")
+        connection.execute("CREATE INDEX IF NOT EXISTS thumbnails_last_access ON thumbnails (last_access)")
+        # Create dates don't depend on the thumbnail size, so they are kept separately and survive size changes
+        connection.execute("""CREATE TABLE IF NOT EXISTS create_epochs (
+                                  key TEXT PRIMARY KEY,
+                                  create_epoch INTEGER NOT NULL)""")
+        # Running total of the stored image sizes, kept up to date by triggers so every process and running
+        # instance sees the same number
+        connection.execute("""CREATE TABLE IF NOT EXISTS cache_size (
+                                  id INTEGER PRIMARY KEY CHECK (id = 0),
+                                  total INTEGER NOT NULL)""")
+        connection.execute("INSERT OR IGNORE INTO cache_size (id, total) SELECT 0, COALESCE(SUM(size), 0) FROM thumbnails")
+        connection.execute("""CREATE TRIGGER IF NOT EXISTS thumbnails_size_insert AFTER INSERT ON thumbnails BEGIN
+                                  UPDATE cache_size SET total = total + NEW.size WHERE id = 0;
+                              END""")
+        connection.execute("""CREATE TRIGGER IF NOT EXISTS thumbnails_size_delete AFTER DELETE ON thumbnails BEGIN
+                                  UPDATE cache_size SET total = total - OLD.size WHERE id = 0;
+                              END""")
+        connection.execute("COMMIT")
+
+        # The maximum size could have been lowered since the last run
+        if self.get_total_size() > self.max_size:
+            self.evict()
+
+    # sqlite connections can't be shared between threads so every thread gets its own. WAL mode lets
+    # multiple running instances read while one of them writes
+    def get_connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection == None:
+            connection = sqlite3.connect(self.database_path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    @staticmethod
+    def get_file_key_parts(item_data):
+        key_parts = []
+        paths = [item_data[0]["file_path"]]
+        if "metadata_file" in item_data[0]:
+            paths.append(item_data[0]["metadata_file"])
+        for path in paths:
+            stat = os.stat(path)
+            key_parts += [os.path.realpath(path), str(stat.st_size), str(stat.st_mtime_ns)]
+        return key_parts
+
+    @staticmethod
+    def make_key(item_data, thumb_size, input_data):
+        key_parts = [item_data[0]["file_type"], str(thumb_size[0]), str(thumb_size[1])]
+        key_parts += ThumbnailCache.get_file_key_parts(item_data)
+
+        # Track thumbnails rendered offline only have placeholder tiles, don't reuse them once online
+        if item_data[0]["file_type"] == "gnss-track":
+            key_parts.append(str(input_data["force_offline"]))
+            key_parts.append(input_data["tile_server"])
+
+        return hashlib.sha256("\0".join(key_parts).encode()).hexdigest()
+
+    @staticmethod
+    def make_epoch_key(item_data):
+        key_parts = [item_data[0]["file_type"]] + ThumbnailCache.get_file_key_parts(item_data)
+        return hashlib.sha256("\0".join(key_parts).encode()).hexdigest()
+
+    def get(self, key):
+        connection = self.get_connection()
+        row = connection.execute("SELECT create_epoch, image, last_access FROM thumbnails WHERE key=?", (key,)).fetchone()
+        if row == None:
+            return None
+        create_epoch, image_data, last_access = row
+
+        try:
+            img = Image.open(io.BytesIO(image_data))
+            img.load()
+        except Exception:
+            connection.execute("DELETE FROM thumbnails WHERE key=?", (key,))
+            return None
+
+        now = int(time.time())
+        if now - last_access > ACCESS_TIME_GRANULARITY:
+            try:
+                connection.execute("UPDATE thumbnails SET last_access=? WHERE key=?", (now, key))
+            except sqlite3.OperationalError:
+                pass # Another instance holds the write lock for too long, the access time is only a hint
+
+        return img, create_epoch
+
+    def get_create_epoch(self, epoch_key):
+        row = self.get_connection().execute("SELECT create_epoch FROM create_epochs WHERE key=?", (epoch_key,)).fetchone()
+        if row == None:
+            return None
+        return row[0]
+
+    # entries are (epoch_key, create_epoch) pairs, they are written in one transaction
+    def put_create_epochs(self, entries):
+        connection = self.get_connection()
+        try:
+            connection.execute("BEGIN")
+            connection.executemany("INSERT OR REPLACE INTO create_epochs (key, create_epoch) VALUES (?, ?)", entries)
+            connection.execute("COMMIT")
+        except sqlite3.OperationalError:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+
+    # Returns False if the thumbnail couldn't be stored
+    def put(self, key, img, create_epoch):
+        buffer = io.BytesIO()
+        if img.mode == "RGB":
+            img.save(buffer, format="JPEG", quality=90)
+        else:
+            img.save(buffer, format="PNG")
+        image_data = buffer.getvalue()
+
+        # The old entry is deleted on its own instead of with INSERT OR REPLACE, replacing doesn't run the
+        # delete trigger that keeps the total size
+        connection = self.get_connection()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM thumbnails WHERE key=?", (key,))
+            connection.execute("INSERT INTO thumbnails (key, create_epoch, image, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                               (key, create_epoch, image_data, len(image_data), int(time.time())))
+            total_size = connection.execute("SELECT total FROM cache_size WHERE id = 0").fetchone()[0]
+            connection.execute("COMMIT")
+        except sqlite3.OperationalError:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            return False
+
+        if total_size > self.max_size:
+            self.evict()
+        return True
+
+    def get_total_size(self):
+        return self.get_connection().execute("SELECT total FROM cache_size WHERE id = 0").fetchone()[0]
+
+    # Drop the least recently used entries until the total size of the stored images is EVICTION_HEADROOM
+    # below max_size
+    def evict(self):
+        try:
+            self.get_connection().execute("""DELETE FROM thumbnails WHERE key IN (
+                                                 SELECT key FROM (
+                                                     SELECT key, SUM(size) OVER (ORDER BY last_access DESC, key) AS running_size FROM thumbnails
+                                                 ) WHERE running_size > ?)""", (int(self.max_size*(1 - EVICTION_HEADROOM)),))
+        except sqlite3.OperationalError:
+            pass
+
+    def clear(self):
+        connection = self.get_connection()
+        connection.execute("DELETE FROM thumbnails")
+        connection.execute("DELETE FROM create_epochs")
+        connection.execute("VACUUM")
@@ -0,0 +1,23 @@
+import tkintermapview
+from PIL import ImageTk
+
+# TkinterMapView that gets its tiles from a tile_provider.TileProvider, so the maps share the tiles fetched
+# for the thumbnails and store the ones they fetch in the tile cache. request_image is called from the
+# loading threads of TkinterMapView
+class TileMapView(tkintermapview.TkinterMapView):
+    def __init__(self, root, tile_provider, **kwargs):
+        # The loading threads start in the constructor
+        self.tile_provider = tile_provider
+        super().__init__(root, **kwargs)
+
+    def request_image(self, zoom, x, y, db_cursor=None):
+        try:
+            image = self.tile_provider.get_tile(zoom, x, y)
+        except Exception:
+            return self.empty_tile_image
+        if image == None or not self.running:
+            return self.empty_tile_image
+
+        image_tk = ImageTk.PhotoImage(image)
+        self.tile_image_cache[f"{zoom}{x}{y}"] = image_tk
+        return image_tk
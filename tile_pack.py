@@ -0,0 +1,135 @@
+import gnss_track_helpers
+import geotag
+import exiftool_service
+import media_interface
+import tile_provider
+import item
+
+# Has to match gnss_track_helpers.gnss_thumbnail_and_timestamp
+THUMBNAIL_MAX_TILES = 2
+# Tiles across and down a full screen track map shows when fitted to the track, 1920x1080 is about 8x5
+FULL_SCREEN_MAP_TILES = (8, 5)
+# The map fits the track at a fractional zoom, tiles of the zooms around it get loaded
+FULL_SCREEN_MAP_EXTRA_ZOOMS = 1
+# Tiles around the track box, the map shows more than the box when its shape is different
+FULL_SCREEN_MAP_MARGIN = 1
+# Has to match the zoom of the map in the metadata panel of full_screen_view, the map is 400x400
+PHOTO_MAP_ZOOM = 15
+PHOTO_MAP_MARGIN = 1
+EXIF_BATCH_SIZE = 64
+# Most tiles one pack fetches, the tile servers that allow bulk downloads still limit how much is fetched
+MAX_PACK_TILES = 20000
+
+# Returns the (zoom, x, y) tiles covering bounds plus margin tiles on every side
+def get_bounds_tiles(bounds, zoom, margin=0):
+    last_tile = 2**zoom - 1
+    min_x, min_y = gnss_track_helpers.deg2tile(bounds["max_lat"], bounds["min_lon"], zoom)
+    max_x, max_y = gnss_track_helpers.deg2tile(bounds["min_lat"], bounds["max_lon"], zoom)
+    return {(zoom, x, y)
+            for x in range(max(0, min_x - margin), min(last_tile, max_x + margin) + 1)
+            for y in range(max(0, min_y - margin), min(last_tile, max_y + margin) + 1)}
+
+def get_track_tiles(gpx_path):
+    bounds = gnss_track_helpers.get_gpx_summary(gpx_path)
+
+    thumbnail_zoom = gnss_track_helpers.calculate_zoom(bounds, max_tiles_x=THUMBNAIL_MAX_TILES, max_tiles_y=THUMBNAIL_MAX_TILES)
+    tiles = get_bounds_tiles(bounds, thumbnail_zoom)
+
+    map_zoom = gnss_track_helpers.calculate_zoom(bounds, max_tiles_x=FULL_SCREEN_MAP_TILES[0], max_tiles_y=FULL_SCREEN_MAP_TILES[1])
+    for zoom in range(map_zoom, min(tile_provider.OSM_MAX_ZOOM, map_zoom + FULL_SCREEN_MAP_EXTRA_ZOOMS) + 1):
+        tiles |= get_bounds_tiles(bounds, zoom, FULL_SCREEN_MAP_MARGIN)
+    return tiles
+
+def get_photo_tiles(lat, lon):
+    point = {"min_lat": lat, "max_lat": lat, "min_lon": lon, "max_lon": lon}
+    return get_bounds_tiles(point, PHOTO_MAP_ZOOM, PHOTO_MAP_MARGIN)
+
+# Goes through every source and returns the set of tiles the thumbnails and maps of its tracks and
+# geotagged photos use, photos without GPS data count where the tracks put them (see geotag.py).
+# progress_callback gets a status line every now and then
+def collect_tiles(input_data, progress_callback=None):
+    tiles = set()
+    exif_paths = []
+    track_paths = []
+    untagged_photos = [] # (create_epoch, path)
+
+    def add_photo_tiles():
+        service = exiftool_service.get_service()
+        untagged_paths = []
+        for path, position in zip(exif_paths, service.get_gps_positions(exif_paths)):
+            if position != None:
+                tiles.update(get_photo_tiles(*position))
+            else:
+                untagged_paths.append(path)
+        for path, create_epoch in zip(untagged_paths, service.get_create_epochs(untagged_paths)):
+            if create_epoch != -1:
+                untagged_photos.append((create_epoch, path))
+        exif_paths.clear()
+
+    item_count = 0
+    for source_number, (source, source_properties) in enumerate(input_data["sources"]):
+        for entry in media_interface.stream_thumbnail_list(input_data, source_number):
+            item_data = (entry, source_properties)
+            if entry["file_type"] == "gnss-track":
+                track_paths.append(entry["file_path"])
+                try:
+                    tiles |= get_track_tiles(entry["file_path"])
+                except (OSError, ValueError):
+                    pass # Not readable or no track points, there's no map to show
+            else:
+                exif_paths.append(item.Item.get_exif_path(item_data))
+                if len(exif_paths) >= EXIF_BATCH_SIZE:
+                    add_photo_tiles()
+
+            item_count += 1
+            if progress_callback != None and item_count % EXIF_BATCH_SIZE == 0:
+                progress_callback(f"Looked through {item_count} items, {len(tiles)} tiles needed")
+    add_photo_tiles()
+
+    if track_paths and untagged_photos:
+        track_index = geotag.build_track_index(track_paths)
+        for lat, lon in geotag.locate_photos(track_index, untagged_photos, input_data["camera_clock_offset"]).values():
+            tiles.update(get_photo_tiles(lat, lon))
+    return tiles
+
+# Raises ValueError when a tile pack can't be built with these settings
+def check_tile_server(input_data):
+    if input_data["tile_server"] == tile_provider.DEFAULT_TILE_SERVER:
+        raise ValueError("The OpenStreetMap tile servers don't allow bulk downloading, tile packs need a tile server that does, given with --tile-server")
+    if input_data["tile_cache"] == None:
+        raise ValueError("Tile packs are stored in the tile cache, it can't be turned off")
+    if input_data["force_offline"]:
+        raise ValueError("Can't fetch tiles while offline")
+
+def get_provider(input_data):
+    # Its own provider so the pack doesn't hold up the tiles the maps are waiting for
+    return tile_provider.TileProvider(input_data["tile_server"], input_data["map_database"], input_data["tile_cache"], input_data["force_offline"])
+
+# Returns the tiles the sources need that aren't stored yet, raises ValueError when there are more than
+# MAX_PACK_TILES of them
+def collect_missing_tiles(input_data, progress_callback=None):
+    check_tile_server(input_data)
+    provider = get_provider(input_data)
+    missing = sorted(tile for tile in collect_tiles(input_data, progress_callback) if not provider.has_tile(tile))
+    if len(missing) > MAX_PACK_TILES:
+        raise ValueError(f"The sources need {len(missing)} tiles that aren't stored yet, a tile pack fetches at most {MAX_PACK_TILES}")
+    return missing
+
+# Fetches tiles into the tile cache. Returns how many tiles were fetched and how many couldn't be
+def store_tile_pack(input_data, tiles, progress_callback=None):
+    check_tile_server(input_data)
+
+    def report_fetch_progress(done, total):
+        if progress_callback != None:
+            progress_callback(f"Stored {done} of {total} tiles")
+
+    return get_provider(input_data).store_tiles(tiles, report_fetch_progress)
+
+# Fetches every tile the sources need into the tile cache, so later sessions can show all their maps
+# offline. confirm_callback gets the number of tiles to fetch and nothing is fetched unless it returns
+# True. Returns how many tiles were fetched and how many couldn't be
+def build_tile_pack(input_data, progress_callback=None, confirm_callback=None):
+    tiles = collect_missing_tiles(input_data, progress_callback)
+    if not tiles or (confirm_callback != None and not confirm_callback(len(tiles))):
+        return 0, 0
+    return store_tile_pack(input_data, tiles, progress_callback)
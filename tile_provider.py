@@ -0,0 +1,260 @@
+import collections
+import concurrent.futures
+import io
+import os
+import sqlite3
+import threading
+import urllib.parse
+import requests
+from PIL import Image
+
+import thumbnail_cache
+
+DEFAULT_TILE_SERVER = "https://tile.openstreetmap.org/{z}/{x}/{y}.png"
+# tkintermapview stores OpenStreetMap tiles under this url in the server column of its databases
+OSM_DATABASE_SERVER = "https://a.tile.openstreetmap.org/{z}/{x}/{y}.png"
+DEFAULT_TILE_CACHE = os.path.join(thumbnail_cache.DEFAULT_CACHE_DIR, "tiles.sqlite")
+OSM_MAX_ZOOM = 19
+
+HEADERS = {
+    "User-Agent": "media-organiser/1.0"
+}
+
+# Decoded tiles kept per process, at 256x256 RGB this is up to 48 MiB
+MEMORY_CACHE_SIZE = 256
+# The OpenStreetMap tile usage policy asks for at most two connections per client. That's for the whole
+# program, every provider of every process takes a slot of fetch_limit for each request
+FETCH_JOBS = 2
+FETCH_TIMEOUT = 15
+# Tile packs are fetched and written in batches of this many tiles
+STORE_BATCH_SIZE = 64
+
+open_providers = {}
+open_providers_lock = threading.Lock()
+
+# Only limits this process until share_fetch_limit or set_fetch_limit replaces it
+fetch_limit = threading.BoundedSemaphore(FETCH_JOBS)
+
+def set_fetch_limit(semaphore):
+    global fetch_limit
+    fetch_limit = semaphore
+
+# Called in the UI process before any worker process starts. The workers get the returned semaphore passed
+# to set_fetch_limit as their initializer, so all processes together keep to FETCH_JOBS connections
+def share_fetch_limit(mp_context):
+    semaphore = mp_context.BoundedSemaphore(FETCH_JOBS)
+    set_fetch_limit(semaphore)
+    return semaphore
+
+# One provider per process and settings, so the thumbnails and maps of a process share the fetched tiles
+def open_provider(input_data):
+    settings = (input_data["tile_server"], input_data["map_database"], input_data["tile_cache"], input_data["force_offline"])
+    with open_providers_lock:
+        if settings not in open_providers:
+            open_providers[settings] = TileProvider(*settings)
+        return open_providers[settings]
+
+# Looks for map tiles in memory, then in the tile cache and the map database and fetches the rest from the
+# tile server. Both databases use the tiles table of tkintermapview, so a tile cache can be passed as map
+# database to tkintermapview and the offline loader of tkintermapview can make map databases
+class TileProvider:
+    def __init__(self, tile_server=DEFAULT_TILE_SERVER, map_database=None, tile_cache=None, force_offline=False):
+        self.tile_server = tile_server
+        self.server_key = OSM_DATABASE_SERVER if tile_server == DEFAULT_TILE_SERVER else tile_server
+        self.force_offline = force_offline
+        self.memory_cache = collections.OrderedDict() # (zoom, x, y) -> PIL image
+        self.memory_cache_lock = threading.Lock()
+        self.local = threading.local()
+        self.fetch_pool = concurrent.futures.ThreadPoolExecutor(max_workers=FETCH_JOBS)
+
+        self.tile_cache = tile_cache
+        self.write_connection = None
+        self.write_lock = threading.Lock()
+        if tile_cache != None:
+            self.open_tile_cache()
+
+        # The tile cache goes first, it only ever holds tiles of the current tile server
+        self.databases = [i for i in (tile_cache, map_database) if i != None]
+
+    def open_tile_cache(self):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.tile_cache)), exist_ok=True)
+            connection = sqlite3.connect(self.tile_cache, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("""CREATE TABLE IF NOT EXISTS server (
+                                      url VARCHAR(300) PRIMARY KEY NOT NULL,
+                                      max_zoom INT NOT NULL)""")
+            connection.execute("""CREATE TABLE IF NOT EXISTS tiles (
+                                      zoom INT,
+                                      x INT,
+                                      y INT,
+                                      server TEXT,
+                                      tile_image BLOB,
+                                      CONSTRAINT fk_server FOREIGN KEY (server) REFERENCES server (url),
+                                      CONSTRAINT pk_tiles PRIMARY KEY (zoom, x, y, server))""")
+            connection.execute("INSERT OR IGNORE INTO server (url, max_zoom) VALUES (?, ?)", (self.server_key, OSM_MAX_ZOOM))
+        except (OSError, sqlite3.Error):
+            self.tile_cache = None
+            return
+        self.write_connection = connection
+
+    # Every thread gets its own read only connection to every database, None if it couldn't be opened
+    def get_read_connection(self, database):
+        connections = getattr(self.local, "connections", None)
+        if connections == None:
+            connections = self.local.connections = {}
+        if database not in connections:
+            uri = "file:" + urllib.parse.quote(os.path.abspath(database)) + "?mode=ro"
+            try:
+                connections[database] = sqlite3.connect(uri, uri=True, timeout=30)
+            except sqlite3.Error:
+                connections[database] = None
+        return connections[database]
+
+    def get_session(self):
+        session = getattr(self.local, "session", None)
+        if session == None:
+            session = self.local.session = requests.Session()
+            session.headers.update(HEADERS)
+        return session
+
+    def get_from_memory(self, tile):
+        with self.memory_cache_lock:
+            image = self.memory_cache.get(tile)
+            if image != None:
+                self.memory_cache.move_to_end(tile)
+            return image
+
+    def put_in_memory(self, tile, image):
+        with self.memory_cache_lock:
+            self.memory_cache[tile] = image
+            self.memory_cache.move_to_end(tile)
+            while len(self.memory_cache) > MEMORY_CACHE_SIZE:
+                self.memory_cache.popitem(last=False)
+
+    def has_tile(self, tile):
+        for database in self.databases:
+            connection = self.get_read_connection(database)
+            if connection == None:
+                continue
+            try:
+                if connection.execute("SELECT 1 FROM tiles WHERE zoom=? AND x=? AND y=? AND server=?", tile + (self.server_key,)).fetchone() != None:
+                    return True
+            except sqlite3.Error:
+                continue
+        return False
+
+    def read_databases(self, tile):
+        for database in self.databases:
+            connection = self.get_read_connection(database)
+            if connection == None:
+                continue
+            try:
+                row = connection.execute("SELECT tile_image FROM tiles WHERE zoom=? AND x=? AND y=? AND server=?", tile + (self.server_key,)).fetchone()
+            except sqlite3.Error:
+                continue # Not a tile database or locked for too long
+            if row != None:
+                try:
+                    return decode_tile(row[0])
+                except Exception:
+                    pass
+        return None
+
+    # Returns the tile and its encoded data, raises requests.RequestException when the server can't deliver it
+    def fetch_tile(self, tile):
+        zoom, x, y = tile
+        url = self.tile_server.replace("{z}", str(zoom)).replace("{x}", str(x)).replace("{y}", str(y))
+        with fetch_limit:
+            response = self.get_session().get(url, timeout=FETCH_TIMEOUT)
+        response.raise_for_status()
+        try:
+            return decode_tile(response.content), response.content
+        except Exception as error:
+            raise requests.RequestException(f"Tile server sent an invalid image for {url}") from error
+
+    def write_back(self, fetched):
+        if self.write_connection == None or not fetched:
+            return
+        rows = [tile + (self.server_key, data) for tile, data in fetched]
+        with self.write_lock:
+            try:
+                self.write_connection.execute("BEGIN")
+                self.write_connection.executemany("INSERT OR REPLACE INTO tiles (zoom, x, y, server, tile_image) VALUES (?, ?, ?, ?, ?)", rows)
+                self.write_connection.execute("COMMIT")
+            except sqlite3.OperationalError:
+                if self.write_connection.in_transaction:
+                    self.write_connection.execute("ROLLBACK")
+
+    # tiles are (zoom, x, y) tuples. Returns a dict from tile to PIL image, tiles that couldn't be found
+    # offline are left out. The tiles missing locally are fetched in parallel and the first fetch error is
+    # raised once all fetches finished, the tiles that did arrive are still cached
+    def get_tiles(self, tiles):
+        found = {}
+        missing = []
+        for tile in tiles:
+            image = self.get_from_memory(tile)
+            if image == None:
+                image = self.read_databases(tile)
+                if image != None:
+                    self.put_in_memory(tile, image)
+            if image != None:
+                found[tile] = image
+            else:
+                missing.append(tile)
+
+        if not missing or self.force_offline:
+            return found
+
+        futures = [(tile, self.fetch_pool.submit(self.fetch_tile, tile)) for tile in missing]
+        fetched = []
+        fetch_error = None
+        for tile, future in futures:
+            try:
+                image, data = future.result()
+            except requests.RequestException as error:
+                fetch_error = fetch_error or error
+                continue
+            self.put_in_memory(tile, image)
+            found[tile] = image
+            fetched.append((tile, data))
+        self.write_back(fetched)
+
+        if fetch_error != None:
+            raise fetch_error
+        return found
+
+    # Fetches the tiles that aren't in the tile cache or the map database yet and writes them to the tile
+    # cache, without decoding stored tiles or filling the memory cache. progress_callback gets the number of
+    # tiles done and the total. Returns how many tiles were fetched and how many couldn't be
+    def store_tiles(self, tiles, progress_callback=None):
+        if self.write_connection == None:
+            raise ValueError("There is no tile cache to store the tiles in")
+        if self.force_offline:
+            raise ValueError("Can't fetch tiles while offline")
+
+        missing = [tile for tile in tiles if not self.has_tile(tile)]
+        already_stored = len(tiles) - len(missing)
+        fetched_count = 0
+        failed_count = 0
+        for batch_start in range(0, len(missing), STORE_BATCH_SIZE):
+            batch = missing[batch_start:batch_start+STORE_BATCH_SIZE]
+            futures = [(tile, self.fetch_pool.submit(self.fetch_tile, tile)) for tile in batch]
+            fetched = []
+            for tile, future in futures:
+                try:
+                    fetched.append((tile, future.result()[1]))
+                except requests.RequestException:
+                    failed_count += 1
+            self.write_back(fetched)
+            fetched_count += len(fetched)
+            if progress_callback != None:
+                progress_callback(already_stored + batch_start + len(batch), len(tiles))
+        return fetched_count, failed_count
+
+    def get_tile(self, zoom, x, y):
+        return self.get_tiles([(zoom, x, y)]).get((zoom, x, y))
+
+def decode_tile(data):
+    image = Image.open(io.BytesIO(data))
+    return image.convert("RGB") # Also makes PIL read the whole image
@@ -0,0 +1,166 @@
+import collections
+import math
+import time
+import tkinter as tk
+from PIL import Image, ImageTk
+
+TILE_SIZE = 256
+# Converted tiles kept around, at 256x256 this is up to 64 MiB of PhotoImages
+TILE_CACHE_SIZE = 256
+MAX_ZOOM = 4
+ZOOM_STEP = 2
+# Placeholder tiles are cut from a level this many halvings coarser than the sharp ones
+COARSE_LEVEL_OFFSET = 2
+# Time spent making sharp tiles per tick, the rest waits so panning stays responsive
+SHARP_TILE_TIME_BUDGET = 0.01
+SHARP_TILE_TICK_INTERVAL = 1
+
+# Shows an image pyramid (see full_screen_loader.build_pyramid) at any zoom. Only the tiles in view get cut
+# out of the pyramid level closest to the zoom and turned into PhotoImages. Tiles first show up as a blurry
+# upscale of a coarse level and get replaced by the sharp version a few at a time
+class TiledImageView(tk.Canvas):
+    def __init__(self, root, zoom_out_callback, **kwargs):
+        super().__init__(root, highlightthickness=0, width=1, height=1, **kwargs)
+
+        self.zoom_out_callback = zoom_out_callback
+        self.pyramid = None
+        self.zoom = 1
+        self.tile_cache = collections.OrderedDict() # (zoom, tile x, tile y) -> PhotoImage
+        self.shown_tiles = {}                       # (tile x, tile y) -> [canvas item, PhotoImage, is sharp]
+        self.pending_tiles = collections.deque()
+        self.sharpen_scheduled = False
+
+        self.bind("<ButtonPress-1>", lambda event: self.scan_mark(event.x, event.y))
+        self.bind("<B1-Motion>", self.on_drag)
+        self.bind("<Configure>", lambda event: self.update_tiles())
+        self.bind("<Button-4>", lambda event: self.zoom_at_pointer(event, ZOOM_STEP))
+        self.bind("<Button-5>", lambda event: self.zoom_at_pointer(event, 1/ZOOM_STEP))
+        self.bind("<MouseWheel>", lambda event: self.zoom_at_pointer(event, ZOOM_STEP if event.delta > 0 else 1/ZOOM_STEP))
+
+    def set_pyramid(self, pyramid):
+        if pyramid is self.pyramid:
+            return
+        self.pyramid = pyramid
+        self.clear_tiles()
+        self.tile_cache.clear()
+        self.update_scrollregion()
+        self.update_tiles()
+
+    def get_fit_zoom(self):
+        width, height = self.pyramid[0].size
+        return min(max(1, self.winfo_width())/width, max(1, self.winfo_height())/height, 1)
+
+    # Zooms so that image_point (in full resolution pixels) ends up under view_point (in widget pixels)
+    def set_zoom(self, zoom, image_point, view_point):
+        self.zoom = min(zoom, MAX_ZOOM)
+        self.clear_tiles()
+        self.update_scrollregion()
+
+        zoomed_width, zoomed_height = self.get_zoomed_size()
+        self.xview_moveto((image_point[0]*self.zoom - view_point[0])/zoomed_width)
+        self.yview_moveto((image_point[1]*self.zoom - view_point[1])/zoomed_height)
+        self.update_tiles()
+
+    def zoom_at_pointer(self, event, factor):
+        new_zoom = self.zoom*factor
+        if new_zoom < self.get_fit_zoom():
+            self.zoom_out_callback()
+            return
+        image_point = (self.canvasx(event.x)/self.zoom, self.canvasy(event.y)/self.zoom)
+        self.set_zoom(new_zoom, image_point, (event.x, event.y))
+
+    def on_drag(self, event):
+        self.scan_dragto(event.x, event.y, gain=1)
+        self.update_tiles()
+
+    def get_zoomed_size(self):
+        width, height = self.pyramid[0].size
+        return (max(1, round(width*self.zoom)), max(1, round(height*self.zoom)))
+
+    def update_scrollregion(self):
+        if self.pyramid != None:
+            zoomed_width, zoomed_height = self.get_zoomed_size()
+            self.configure(scrollregion=(0, 0, zoomed_width, zoomed_height))
+
+    def clear_tiles(self):
+        for canvas_item, photo, is_sharp in self.shown_tiles.values():
+            self.delete(canvas_item)
+        self.shown_tiles.clear()
+        self.pending_tiles.clear()
+
+    def update_tiles(self):
+        if self.pyramid == None:
+            return
+        zoomed_width, zoomed_height = self.get_zoomed_size()
+        left = max(0, self.canvasx(0))
+        top = max(0, self.canvasy(0))
+        right = min(zoomed_width, self.canvasx(self.winfo_width()))
+        bottom = min(zoomed_height, self.canvasy(self.winfo_height()))
+
+        visible = set()
+        for tile_y in range(int(top//TILE_SIZE), math.ceil(bottom/TILE_SIZE)):
+            for tile_x in range(int(left//TILE_SIZE), math.ceil(right/TILE_SIZE)):
+                visible.add((tile_x, tile_y))
+
+        for tile in list(self.shown_tiles):
+            if tile not in visible:
+                self.delete(self.shown_tiles.pop(tile)[0])
+
+        for tile in sorted(visible - set(self.shown_tiles), key=lambda tile: (tile[1], tile[0])):
+            photo = self.tile_cache.get((self.zoom,) + tile)
+            if photo != None:
+                self.tile_cache.move_to_end((self.zoom,) + tile)
+                is_sharp = True
+            else:
+                sharp_level = self.get_level_index(self.zoom)
+                coarse_level = min(len(self.pyramid)-1, sharp_level + COARSE_LEVEL_OFFSET)
+                photo = ImageTk.PhotoImage(self.make_tile_image(tile, coarse_level, Image.NEAREST))
+                is_sharp = False
+                self.pending_tiles.append(tile)
+            canvas_item = self.create_image(tile[0]*TILE_SIZE, tile[1]*TILE_SIZE, image=photo, anchor='nw')
+            self.shown_tiles[tile] = [canvas_item, photo, is_sharp]
+
+        if self.pending_tiles and not self.sharpen_scheduled:
+            self.sharpen_scheduled = True
+            self.after(SHARP_TILE_TICK_INTERVAL, self.sharpen_tiles)
+
+    # The smallest level that still has at least as many pixels as the screen at this zoom
+    def get_level_index(self, zoom):
+        index = 0
+        while index+1 < len(self.pyramid) and self.pyramid[index+1].width/self.pyramid[0].width >= zoom:
+            index += 1
+        return index
+
+    def make_tile_image(self, tile, level_index, resample):
+        level = self.pyramid[level_index]
+        zoomed_width, zoomed_height = self.get_zoomed_size()
+        tile_width = min(TILE_SIZE, zoomed_width - tile[0]*TILE_SIZE)
+        tile_height = min(TILE_SIZE, zoomed_height - tile[1]*TILE_SIZE)
+
+        # Screen pixels to pixels of this level
+        factor = (level.width/self.pyramid[0].width)/self.zoom
+        box = (tile[0]*TILE_SIZE*factor, tile[1]*TILE_SIZE*factor, (tile[0]*TILE_SIZE + tile_width)*factor, (tile[1]*TILE_SIZE + tile_height)*factor)
+        box = (box[0], box[1], min(box[2], level.width), min(box[3], level.height))
+        return level.resize((tile_width, tile_height), resample, box=box)
+
+    def sharpen_tiles(self):
+        self.sharpen_scheduled = False
+        deadline = time.perf_counter() + SHARP_TILE_TIME_BUDGET
+        while self.pending_tiles and time.perf_counter() < deadline:
+            tile = self.pending_tiles.popleft()
+            shown = self.shown_tiles.get(tile)
+            if shown == None or shown[2]:
+                continue # Scrolled away or already sharp
+
+            photo = ImageTk.PhotoImage(self.make_tile_image(tile, self.get_level_index(self.zoom), Image.BILINEAR))
+            self.tile_cache[(self.zoom,) + tile] = photo
+            while len(self.tile_cache) > TILE_CACHE_SIZE:
+                self.tile_cache.popitem(last=False)
+
+            self.itemconfigure(shown[0], image=photo)
+            shown[1] = photo
+            shown[2] = True
+
+        if self.pending_tiles:
+            self.sharpen_scheduled = True
+            self.after(SHARP_TILE_TICK_INTERVAL, self.sharpen_tiles)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# Builds a tile pack for some sources and checks that it's complete: a second build has nothing left to
+# fetch and every tile the sources need can be read by an offline provider. Run it from the repository
+# directory against the stand-in tile server, for example
+#   tools/stand_in_tile_server.py &
+#   tools/check_tile_pack.py -i tools/stand_in_interface.py -s ~/gpx -c /tmp/pack.sqlite
+# exiftool has to be installed, the GPS positions of the photos are read with it
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import constants
+import tile_pack
+import tile_provider
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a tile pack and check that all maps of the sources work offline')
+    parser.add_argument('-i', '--interface',           type=str,                 required=True, help='Path to the media interface executable')
+    parser.add_argument('-s', '--source',              type=str, action='append', required=True, help='Source directory, can be given multiple times')
+    parser.add_argument('-c', '--tile-cache',          type=str,                 required=True, help='Tile cache to build the pack in')
+    parser.add_argument('-t', '--tile-server',         type=str,                 default="http://127.0.0.1:8765/{z}/{x}/{y}.png", help='Tile server url, the stand-in tile server by default')
+    parser.add_argument(      '--camera-clock-offset', type=int,                 default=0, help='Seconds the camera clocks run ahead of GPS time')
+    args = parser.parse_args()
+
+    input_data = {
+        "interface": os.path.normpath(args.interface),
+        "sources": [(os.path.normpath(i), constants.source_properties.normal) for i in args.source],
+        "tile_server": args.tile_server,
+        "tile_cache": os.path.normpath(args.tile_cache),
+        "map_database": None,
+        "force_offline": False,
+        "camera_clock_offset": args.camera_clock_offset,
+    }
+    report = lambda status: print(status, file=sys.stderr)
+
+    fetched, failed = tile_pack.build_tile_pack(input_data, report)
+    print(f"First build: fetched {fetched} tiles, {failed} failed")
+    fetched_again, failed_again = tile_pack.build_tile_pack(input_data, report)
+    print(f"Second build: fetched {fetched_again} tiles, {failed_again} failed")
+
+    tiles = tile_pack.collect_tiles(input_data)
+    offline_provider = tile_provider.TileProvider(input_data["tile_server"], None, input_data["tile_cache"], force_offline=True)
+    missing = [tile for tile in tiles if not offline_provider.has_tile(tile)]
+    print(f"{len(tiles)} tiles needed, {len(missing)} of them not in the pack")
+    for zoom, x, y in missing[:20]:
+        print(f"  missing {zoom}/{x}/{y}")
+
+    if failed or fetched_again or failed_again or missing:
+        print("FAILED")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# A minimal media interface for trying the program out on a plain directory of files, without the
+# media-interface of a real device. Every file is its own item, the type comes from the extension and
+# related files aren't grouped, so RAW files are left out. Pass it with -i, it answers
+#   -l <source directory>   the thumbnail list, written one entry at a time like a slow interface would
+#   -g <file path>          the related files of one item
+#   -D                      daemon mode (api 1.1), JSON requests on stdin and answers on stdout
+# With STAND_IN_INTERFACE_VERSION=1.0 in the environment it acts like an interface from before daemon
+# mode, -D fails and every query starts it again
+import json
+import os
+import sys
+import time
+
+FILE_TYPES = {
+    ".jpg": "image",
+    ".jpeg": "image",
+    ".png": "image",
+    ".mp4": "video",
+    ".mov": "video",
+    ".gpx": "gnss-track",
+}
+
+VERSION = os.environ.get("STAND_IN_INTERFACE_VERSION", "1.1")
+# Seconds between the entries of -l, shows if the grid gets going before the listing is done
+LIST_DELAY = float(os.environ.get("STAND_IN_INTERFACE_LIST_DELAY", "0"))
+
+def get_entry(file_path):
+    file_type = FILE_TYPES.get(os.path.splitext(file_path)[1].lower())
+    if file_type == None:
+        return None
+    entry = {
+        "file_path": file_path,
+        "file_type": file_type,
+        "item_type": file_type,
+    }
+    if file_type == "video":
+        entry["part_num"] = 1
+        entry["part_count"] = 1
+    return entry
+
+def get_related(file_path):
+    entry = get_entry(file_path)
+    if entry == None or not os.path.isfile(file_path):
+        raise ValueError(f"Not a media file: {file_path}")
+    return {"version": VERSION, "file_list": [entry]}
+
+def list_thumbnails(source):
+    sys.stdout.write(json.dumps({"version": VERSION})[:-1] + ', "file_list": [')
+    first = True
+    for dirpath, dirnames, filenames in os.walk(source):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            entry = get_entry(os.path.join(dirpath, filename))
+            if entry == None:
+                continue
+            sys.stdout.write(("" if first else ", ") + json.dumps(entry))
+            sys.stdout.flush()
+            first = False
+            time.sleep(LIST_DELAY)
+    sys.stdout.write("]}\n")
+
+def run_daemon():
+    print(json.dumps({"version": VERSION}), flush=True)
+    for line in sys.stdin:
+        request = json.loads(line)
+        try:
+            if request["query"] != "get-related":
+                raise ValueError(f"Unknown query {request['query']}")
+            response = {"id": request["id"], "version": VERSION, "results": [get_related(i) for i in request["args"]]}
+        except ValueError as error:
+            response = {"id": request["id"], "error_string": str(error)}
+        print(json.dumps(response), flush=True)
+
+def fail(error_string):
+    print(json.dumps({"version": VERSION, "error_string": error_string}))
+    sys.exit(1)
+
+def main():
+    if len(sys.argv) == 2 and sys.argv[1] == "-D":
+        if tuple(int(i) for i in VERSION.split(".")[:2]) < (1, 1):
+            fail("Unknown option -D")
+        run_daemon()
+    elif len(sys.argv) == 3 and sys.argv[1] == "-l":
+        list_thumbnails(sys.argv[2])
+    elif len(sys.argv) == 3 and sys.argv[1] == "-g":
+        try:
+            print(json.dumps(get_related(sys.argv[2])))
+        except ValueError as error:
+            fail(str(error))
+    else:
+        fail("Usage: stand_in_interface.py -l <source> | -g <file> | -D")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# Serves generated map tiles on localhost, so the tile cache, the tile packs and the connection limit can be
+# tried out without sending requests to a real tile server. Start the program with
+#   --tile-server http://127.0.0.1:8765/{z}/{x}/{y}.png
+# Every tile is a plain colour picked from its x, the track shows up on top of it. Each request is logged
+# with the number of requests being served at that moment, the highest one is printed on exit
+import argparse
+import http.server
+import io
+import re
+import threading
+import time
+from PIL import Image
+
+TILE_PATH = re.compile(r'/(\d+)/(\d+)/(\d+)\.png$')
+
+active_requests = 0
+max_active_requests = 0
+request_count = 0
+counter_lock = threading.Lock()
+
+class TileHandler(http.server.BaseHTTPRequestHandler):
+    delay = 0
+
+    def do_GET(self):
+        global active_requests, max_active_requests, request_count
+        match = TILE_PATH.match(self.path)
+        if match == None:
+            self.send_error(404)
+            return
+
+        with counter_lock:
+            active_requests += 1
+            max_active_requests = max(max_active_requests, active_requests)
+            request_count += 1
+            active = active_requests
+        try:
+            time.sleep(self.delay) # Makes requests overlap like they do with a real server
+            buffer = io.BytesIO()
+            Image.new("P", (256, 256), int(match.group(2)) % 256).save(buffer, format="PNG")
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(buffer.getvalue())))
+            self.end_headers()
+            self.wfile.write(buffer.getvalue())
+        finally:
+            with counter_lock:
+                active_requests -= 1
+        print(f"GET {self.path} ({active} at once)", flush=True)
+
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve generated map tiles for testing')
+    parser.add_argument('-p', '--port',  type=int,   default=8765, help='Port to listen on, only localhost is served')
+    parser.add_argument('-d', '--delay', type=float, default=0,    help='Seconds every tile takes to send')
+    args = parser.parse_args()
+
+    TileHandler.delay = args.delay
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", args.port), TileHandler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"Served {request_count} tiles, at most {max_active_requests} at once", flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import atexit
+import queue
+import threading
+import time
+import mpv
+
+DEFAULT_TIMEOUT = 15
+
+# How long to wait for another property change before trying to grab the frame again
+FRAME_RETRY_INTERVAL = 0.05
+
+class VideoFrameTimeout(Exception):
+    pass
+
+class PosterFramePlayer:
+    def __init__(self):
+        self.property_changed = threading.Event()
+        # Only decode video, the first keyframe is all that's needed
+        self.player = mpv.MPV(vo='null', ao='null', aid='no', sid='no', hr_seek='no', keep_open='yes')
+        self.player.pause = True
+        for name in ('duration', 'time-pos', 'video-params'):
+            self.player.observe_property(name, self.on_property_change)
+
+    def on_property_change(self, name, value):
+        self.property_changed.set()
+
+    def wait_for_change(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise VideoFrameTimeout
+        self.property_changed.wait(remaining)
+        self.property_changed.clear()
+
+    def open_file(self, file_path, deadline):
+        self.property_changed.clear()
+        self.player.play(file_path)
+
+        # Wait until the new file is open and has a duration, stale events from the previous file don't count
+        while self.player.path != file_path or self.player.duration == None:
+            self.wait_for_change(deadline)
+        return self.player.duration
+
+    def get_duration(self, file_path, timeout):
+        duration = self.open_file(file_path, time.monotonic() + timeout)
+        self.player.command('stop')
+        return duration
+
+    def extract(self, file_path, timeout):
+        deadline = time.monotonic() + timeout
+        self.open_file(file_path, deadline)
+
+        while True:
+            try:
+                img = self.player.screenshot_raw()
+                break
+            except Exception:
+                if time.monotonic() > deadline:
+                    raise VideoFrameTimeout
+                self.property_changed.wait(FRAME_RETRY_INTERVAL)
+                self.property_changed.clear()
+
+        self.player.command('stop')
+        return img
+
+    def close(self):
+        try:
+            self.player.terminate()
+        except Exception:
+            pass
+
+# mpv instances are expensive to start, so they are kept around and reused for every video
+class PosterFrameExtractor:
+    def __init__(self, player_count=1):
+        self.idle_players = queue.LifoQueue()
+        self.players = []
+        self.players_lock = threading.Lock()
+        for i in range(player_count):
+            self.idle_players.put(None) # Players get started the first time they are needed
+
+    # Returns the first frame as a PIL image
+    def extract(self, file_path, timeout=DEFAULT_TIMEOUT):
+        return self.run_on_player("extract", file_path, timeout)
+
+    def get_duration(self, file_path, timeout=DEFAULT_TIMEOUT):
+        return self.run_on_player("get_duration", file_path, timeout)
+
+    # The slot always goes back to idle_players, even when mpv fails to start, otherwise every later
+    # video would wait for it forever
+    def run_on_player(self, method, file_path, timeout):
+        player = self.idle_players.get()
+        try:
+            if player == None:
+                player = PosterFramePlayer()
+                with self.players_lock:
+                    self.players.append(player)
+            return getattr(player, method)(file_path, timeout)
+        except Exception:
+            # A player that timed out could still be stuck on the file, don't hand it out again
+            if player != None:
+                with self.players_lock:
+                    self.players.remove(player)
+                player.close()
+            player = None
+            raise
+        finally:
+            self.idle_players.put(player)
+
+    def close(self):
+        with self.players_lock:
+            for player in self.players:
+                player.close()
+            self.players.clear()
+
+extractor = None
+extractor_lock = threading.Lock()
+
+def get_extractor(player_count=1):
+    global extractor
+    with extractor_lock:
+        if extractor == None:
+            extractor = PosterFrameExtractor(player_count)
+            atexit.register(extractor.close)
+        return extractor